@@ -0,0 +1,91 @@
+"""
+回放一组 flow 经过 cookie_extractor 插件，测量每个 flow 的平均处理耗时。
+
+用法:
+    python benchmarks/bench_cookie_extractor.py                 # 使用合成的 flow
+    python benchmarks/bench_cookie_extractor.py flows.mitm      # 回放 mitmdump -w 录制的 flow
+    python benchmarks/bench_cookie_extractor.py --count 50000 --rounds 5
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from mitmproxy import io as mitm_io
+from mitmproxy.test import tflow, tutils
+
+import cookie_extractor
+
+# 模拟在微信中浏览时的常见流量
+OTHER_HOSTS = ["mp.weixin.qq.com", "res.wx.qq.com", "mmbiz.qpic.cn", "dns.weixin.qq.com", "libseats.ldu.edu.cn"]
+OTHER_PATHS = ["/index.php/graphql/", "/web/index.html", "/s?__biz=abc", "/mmbiz_png/xyz/640", "/cgi-bin/micromsg-bin/getconfig"]
+
+
+def make_flow(host: str, path: str, set_cookie: str = ""):
+    flow = tflow.tflow(req=tutils.treq(host=host, path=path.encode()), resp=True)
+    flow.response.content = b"x" * 2048
+    if set_cookie:
+        flow.response.headers["Set-Cookie"] = set_cookie
+    return flow
+
+
+def synthesize_flows(count: int, target_every: int):
+    flows = []
+    for i in range(count):
+        if i % target_every == 0:
+            flows.append(make_flow(cookie_extractor.TARGET_HOST, cookie_extractor.TARGET_URL_PATTERN,
+                                   f"{cookie_extractor.TARGET_COOKIE_NAME}=token{i // target_every}; path=/"))
+        else:
+            flows.append(make_flow(OTHER_HOSTS[i % len(OTHER_HOSTS)], OTHER_PATHS[i % len(OTHER_PATHS)]))
+    return flows
+
+
+def load_flows(path: str):
+    with open(path, "rb") as f:
+        return [flow for flow in mitm_io.FlowReader(f).stream() if getattr(flow, "response", None) is not None]
+
+
+def replay(flows) -> float:
+    start = time.perf_counter()
+    for flow in flows:
+        flow.metadata.clear()
+        cookie_extractor.requestheaders(flow)
+        cookie_extractor.responseheaders(flow)
+        cookie_extractor.response(flow)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="cookie_extractor 插件回放基准测试")
+    parser.add_argument("flow_file", nargs="?", help="mitmdump -w 录制的 flow 文件 (可选)")
+    parser.add_argument("--count", type=int, default=20000, help="合成 flow 数量")
+    parser.add_argument("--target-every", type=int, default=500, help="每多少个 flow 中出现一个目标 flow")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    flows = load_flows(args.flow_file) if args.flow_file else synthesize_flows(args.count, args.target_every)
+    if not flows:
+        print("没有可回放的 flow。"); return
+
+    logging.getLogger(cookie_extractor.__name__).setLevel(logging.ERROR) # 日志输出不计入耗时
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cookie_extractor.OUTPUT_PATH = os.path.join(tmp_dir, cookie_extractor.OUTPUT_FILE)
+        cookie_extractor.COOKIE_MAP_PATH = os.path.join(tmp_dir, cookie_extractor.COOKIE_MAP_FILE)
+        cookie_extractor.cookie_map.clear()
+        best = None
+        for round_no in range(1, args.rounds + 1):
+            for key in cookie_extractor.stats: cookie_extractor.stats[key] = 0
+            elapsed = replay(flows)
+            best = elapsed if best is None else min(best, elapsed)
+            print(f"第 {round_no} 轮: {len(flows)} 个 flow, 耗时 {elapsed * 1000:.1f} ms, "
+                  f"平均 {elapsed / len(flows) * 1e6:.2f} us/flow, 统计 {cookie_extractor.stats}")
+    print(f"最佳: 平均 {best / len(flows) * 1e6:.2f} us/flow")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+在合成的大型 libs 数据上比较 json.load 与流式解析 (data_process/libs_stream.py) 的耗时和峰值内存。
+
+用法:
+    python benchmarks/bench_libs_stream.py                       # 100000 个座位，分布在 29 个阅览室
+    python benchmarks/bench_libs_stream.py --seats 500000 --rooms 40
+    python benchmarks/bench_libs_stream.py --keep dump.json      # 保留生成的数据文件
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'data_process'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'data_process', 'seat'))
+
+import libs_stream
+import seat_json_convert
+
+
+def write_synthetic_dump(path: str, seats: int, rooms: int) -> None:
+    """按抓包数据的结构写出合成数据，逐个座位写入，生成过程本身不占用大量内存。"""
+    per_room = -(-seats // rooms)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"data":{"userAuth":{"reserve":{"libs":[')
+        written = 0
+        for room in range(rooms):
+            count = min(per_room, seats - written)
+            width = max(1, int(count ** 0.5))
+            if room: f.write(",")
+            f.write(json.dumps({"lib_id": 30000 + room, "is_open": True, "lib_floor": f"{room % 9 + 1}楼",
+                                "lib_name": f"{room + 1:02d}自习室", "lib_type": 0}, ensure_ascii=False)[:-1])
+            f.write(f',"lib_layout":{{"seats_total":{count},"max_x":{width},"max_y":{count // width + 1},"seats":[')
+            for i in range(count):
+                y, x = divmod(i, width)
+                name = str(i + 1) if i % 5 else None # 每 5 格有一个过道/桌子
+                if i: f.write(",")
+                f.write(json.dumps({"x": x, "y": y, "key": f"{y},{x}", "type": 1 if name else 7, "name": name,
+                                    "seat_status": 0, "status": i % 3 == 0}))
+            f.write("]}}")
+            written += count
+        f.write('],"libGroups":[]}}}}')
+
+
+def measure(label: str, func):
+    """先计时，再在 tracemalloc 下运行一次测量峰值内存 (tracemalloc 会显著拖慢运行速度)。"""
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28} 耗时 {elapsed:7.2f} s   峰值内存 {peak / 1024 / 1024:8.1f} MB   {result}")
+    return elapsed, peak
+
+
+def full_load(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        libs = json.load(f)["data"]["userAuth"]["reserve"]["libs"]
+    return f"{sum(len(lib['lib_layout']['seats']) for lib in libs)} 个座位"
+
+
+def streamed(path: str) -> str:
+    seats = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for event, _, _ in libs_stream.iter_lib_events(f):
+            seats += event == "seat"
+    return f"{seats} 个座位"
+
+
+def rooms_only(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f"{sum(1 for _ in libs_stream.iter_libs(f))} 个阅览室"
+
+
+def convert(path: str, output_dir: str) -> str:
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = seat_json_convert.convert_all_rooms(path, output_dir, force=True)
+    return f"{sum(entry['seats'] for entry in results.values())} 个座位映射"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="libs 数据流式解析基准测试")
+    parser.add_argument("--seats", type=int, default=100000, help="合成数据中的座位格总数")
+    parser.add_argument("--rooms", type=int, default=29, help="阅览室数量")
+    parser.add_argument("--keep", help="把生成的数据文件保存到此路径")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.keep or os.path.join(tmp_dir, "libs_dump.json")
+        write_synthetic_dump(path, args.seats, args.rooms)
+        print(f"合成数据: {args.seats} 个座位格, {args.rooms} 个阅览室, {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+        measure("json.load", lambda: full_load(path))
+        measure("流式解析 (逐个座位)", lambda: streamed(path))
+        measure("流式解析 (跳过座位)", lambda: rooms_only(path))
+        measure("seat_json_convert 全部房间", lambda: convert(path, os.path.join(tmp_dir, "output")))
+
+
+if __name__ == "__main__":
+    main()
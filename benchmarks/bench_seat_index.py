@@ -0,0 +1,64 @@
+"""
+测量座位空间索引 (SeatGridIndex) 的查询耗时：最近 N 个空闲座位、矩形区域内的空闲座位。
+
+用法:
+    python benchmarks/bench_seat_index.py                      # 使用 data_process/seat/seat_data_array.json 中的真实布局
+    python benchmarks/bench_seat_index.py --grid 300 --queries 20000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import beta
+
+SAMPLE_LAYOUT = os.path.join(ROOT_DIR, "data_process", "seat", "seat_data_array.json")
+
+
+def sample_room():
+    with open(SAMPLE_LAYOUT, "r", encoding="utf-8") as f:
+        layout = json.load(f)["data"]["userAuth"]["reserve"]["libs"][0]["lib_layout"]
+    return beta.summarize_layout(0, layout)
+
+
+def synthetic_room(size: int, taken_ratio: float):
+    rng = random.Random(42)
+    seats = [{"key": f"{y},{x}", "name": str(y * size + x), "x": x, "y": y, "taken": rng.random() < taken_ratio}
+             for y in range(size) for x in range(size)]
+    return {"_index": beta.SeatGridIndex.from_layout_seats(seats), "_taken": frozenset(s["key"] for s in seats if s["taken"])}
+
+
+def bench(label, func, queries):
+    start = time.perf_counter()
+    for args in queries: func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {len(queries)} 次, 平均 {elapsed / len(queries) * 1e6:.2f} us/次")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="座位空间索引基准测试")
+    parser.add_argument("--grid", type=int, default=0, help="使用 N×N 的合成座位网格代替真实布局")
+    parser.add_argument("--taken", type=float, default=0.8, help="合成网格中已占用座位的比例")
+    parser.add_argument("--queries", type=int, default=10000)
+    parser.add_argument("-n", type=int, default=5, help="最近邻查询返回的座位数")
+    args = parser.parse_args()
+
+    room = synthetic_room(args.grid, args.taken) if args.grid else sample_room()
+    index, taken = room["_index"], room["_taken"]
+    print(f"座位数: {len(index.seats)}, 已占用: {len(taken)}")
+    rng = random.Random(0)
+    accept = lambda key: key not in taken
+    anchors = [rng.choice(index.seats) for _ in range(args.queries)]
+    bench(f"最近 {args.n} 个空闲座位", lambda x, y: index.nearest(x, y, args.n, accept=accept), [(a[2], a[3]) for a in anchors])
+    bench("8×8 区域内空闲座位", lambda x, y: index.in_rect(x, y, x + 8, y + 8, accept=accept), [(a[2], a[3]) for a in anchors])
+    brute = lambda x, y: sorted(((s[2] - x) ** 2 + (s[3] - y) ** 2, s) for s in index.seats if accept(s[1]))[:args.n]
+    bench("对照: 全量扫描排序", brute, [(a[2], a[3]) for a in anchors[:max(1, args.queries // 10)]])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+测量 beta.py 的启动耗时：分别以命令行模式和 Web 模式 (被 uvicorn 导入) 启动，
+用 python -X importtime 统计导入耗时最多的顶层模块，并检查命令行模式是否加载了 Web/网络依赖。
+
+用法:
+    python benchmarks/bench_startup.py                         # 默认运行 "beta.py contention --help"
+    python benchmarks/bench_startup.py --rounds 10 --top 15
+    python benchmarks/bench_startup.py --cli-args "batch --help"
+"""
+import argparse
+import os
+import re
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BETA_PATH = os.path.join(ROOT_DIR, "beta.py")
+
+# 命令行模式不应加载的模块 (只在 Web 模式或真正发出请求时才需要)
+HEAVY_MODULES = ["fastapi", "pydantic", "uvicorn", "jinja2", "starlette", "requests", "websocket", "asyncio"]
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def run(command):
+    """运行一次并返回 (墙钟耗时秒, importtime 记录 [(累计微秒, 模块名, 缩进层级)])。"""
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=ROOT_DIR, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, text=True, encoding="utf-8", errors="replace")
+    elapsed = time.perf_counter() - start
+    records = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            records.append((int(match.group(2)), match.group(4), len(match.group(3)) // 2))
+    return elapsed, records
+
+
+def report(label, command, rounds, top):
+    times, records = [], []
+    for _ in range(rounds):
+        elapsed, records = run(command)
+        times.append(elapsed)
+    loaded = {name for _, name, _ in records}
+    top_level = sorted((record for record in records if record[2] == 0), reverse=True)
+    print(f"{label}: {' '.join(command[1:])}")
+    print(f"  进程总耗时: 最佳 {min(times) * 1000:.0f} ms, 中位数 {statistics.median(times) * 1000:.0f} ms ({rounds} 次)")
+    print(f"  导入模块 {len(loaded)} 个, 顶层导入合计 {sum(us for us, _, _ in top_level) / 1000:.0f} ms; 最慢的顶层导入:")
+    for us, name, _ in top_level[:top]:
+        print(f"    {us / 1000:8.1f} ms  {name}")
+    heavy = [name for name in HEAVY_MODULES if name in loaded]
+    print(f"  已加载的 Web/网络依赖: {', '.join(heavy) if heavy else '无'}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="beta.py 启动耗时基准测试")
+    parser.add_argument("--rounds", type=int, default=5, help="每种模式运行的次数")
+    parser.add_argument("--top", type=int, default=10, help="列出最慢的顶层导入数量")
+    parser.add_argument("--cli-args", default="contention --help", help="命令行模式传给 beta.py 的参数")
+    args = parser.parse_args()
+
+    python = [sys.executable, "-X", "importtime"]
+    # 注意: -X importtime 不统计 __main__ 自身 (beta.py) 的执行耗时，进程总耗时包含全部
+    report("命令行模式", python + [BETA_PATH] + shlex.split(args.cli_args), args.rounds, args.top)
+    report("Web 模式", python + ["-c", "import beta"], args.rounds, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
-import asyncio
+import collections
+import contextvars
 import datetime
 import glob
+import gzip
+import hashlib
 import json
+import logging
+import logging.handlers
 import os
 import re
 import stat
@@ -11,15 +16,45 @@ import time
 import atexit
 import traceback
 import subprocess
-from typing import Any, Callable, Dict, List, Optional, Tuple
-import requests
-import websocket  # 需要安装 websocket-client
+import heapq
+import itertools
+import multiprocessing
+import queue
+import sqlite3
+import threading
+import uuid
+import zlib
+import importlib
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Mapping, Optional, Tuple
+from data_process import mapping_bundle
+
+
+class _LazyModule:
+    """模块代理：第一次访问属性时才导入真正的模块 (导入本身由 import 锁保证线程安全)。"""
+    def __init__(self, name: str): self._name = name; self._module = None
+    def preload(self):
+        """立即导入 (在倒计时之前调用，避免把导入耗时算进发出请求的时刻)。"""
+        if self._module is None: self._module = importlib.import_module(self._name)
+        return self._module
+    def __getattr__(self, attr: str): return getattr(self._module or self.preload(), attr)
+
+# requests (~0.1 s) 和 websocket 只在真正发出请求时才导入，contention 等不联网的子命令不需要它们；asyncio 只有 Web 模式使用
+requests = _LazyModule("requests")
+websocket = _LazyModule("websocket")  # 需要安装 websocket-client
+asyncio = _LazyModule("asyncio")
 
 # --- 全局变量，用于跟踪 mitmproxy 进程 ---
 mitmproxy_process = None
 
 # --- Web Dependencies (Import conditionally) ---
+# 只有 Web 模式 (--web，或被 uvicorn 等作为模块导入) 才加载 FastAPI/pydantic/uvicorn/Jinja2 并注册路由；
+# 命令行模式 (python beta.py ...) 和任务工作进程不导入它们，进程启动耗时从约 0.6 s 降到 0.2 s 以内 (见 benchmarks/bench_startup.py)
+JOB_WORKER_PROCESS_PREFIX = "igolib-worker" # 任务工作进程的进程名前缀 (uvicorn --reload/--workers 的子进程仍是 Web 模式)
+WEB_MODE = (__name__ != "__main__" or '--web' in sys.argv) and not multiprocessing.current_process().name.startswith(JOB_WORKER_PROCESS_PREFIX)
 try:
+    if not WEB_MODE: raise ImportError("命令行模式不加载 Web 依赖")
     from fastapi import (
         BackgroundTasks,
         FastAPI,
@@ -28,7 +63,7 @@ try:
         WebSocket,
         WebSocketDisconnect,
     )
-    from fastapi.responses import JSONResponse
+    from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
     from fastapi.templating import Jinja2Templates
     from pydantic import BaseModel, Field, validator
     import uvicorn
@@ -46,7 +81,10 @@ except ImportError:
     WebSocket = Any
     WebSocketDisconnect = Any
     BackgroundTasks = Any # Keep Any for type hints, don't assign None
+    FileResponse = None
     JSONResponse = None
+    Response = None
+    StreamingResponse = None
     Jinja2Templates = Any # type: ignore
     BaseModel = object # Basic object dummy for Pydantic
     validator = lambda *args, **kwargs: lambda f: f # Dummy decorator
@@ -54,9 +92,10 @@ except ImportError:
     uvicorn = None
     # asyncio is always available
 
-    print("\n❌ 错误：运行 Web 界面需要 FastAPI 相关依赖库，但未能成功导入。")
-    print("请确保已安装: pip install fastapi uvicorn jinja2 pydantic websockets websocket-client requests")
-    print("Web 服务器功能将不可用。\n")
+    if WEB_MODE:
+        print("\n❌ 错误：运行 Web 界面需要 FastAPI 相关依赖库，但未能成功导入。")
+        print("请确保已安装: pip install fastapi uvicorn jinja2 pydantic websockets websocket-client requests")
+        print("Web 服务器功能将不可用。\n")
     app = None # Explicitly set app to None
 
 # --- Configuration ---
@@ -69,8 +108,51 @@ TOMORROW_RESERVE_WINDOW_START = datetime.time(19, 48, 0) # Example window start
 TOMORROW_RESERVE_WINDOW_END = datetime.time(23, 59, 59) # Example window end
 DEFAULT_RESERVE_TIME_STR = "21:48:00"
 COOKIE_FILENAME = "latest_cookie.txt"
+COOKIE_MAP_FILENAME = "latest_cookies.json" # cookie_extractor 按账号保存的 Cookie 映射
+WEB_SHARE_COOKIE_IDENTITIES = False # Web 接口是否可以使用 Cookie 映射中的账号 (/api/cookies、cookieIdentity、实时座位状态)。Web 接口没有鉴权，开启后任何能访问服务器的人都能以这些账号提交任务
 FILE_CHECK_INTERVAL = 2 # Seconds
 MAX_WAIT_TIME = 120 # Seconds
+HTTP_POOL_SIZE = 32 # 共享连接池中每个主机保持的最大连接数
+JOB_MAX_WORKERS = 32 # 调度器同时执行的任务数上限
+JOB_PREWARM_SECONDS = 30 # 任务提前多少秒交给工作线程 (之后由 perform_seat_operation 精确倒计时)
+JOB_STORE_FLUSH_INTERVAL = 0.5 # 任务存储批量提交的间隔 (秒)
+JOB_RESTORE_GRACE_SECONDS = 60 # 重启后恢复任务时，执行时间已过多久以内的任务仍会立即执行
+JOB_EVENT_LOG_SIZE = 500 # 每个任务保留的最近事件数 (环形缓冲区)
+JOB_RETENTION_SECONDS = 600 # 已结束的任务在调度器内存中保留多久 (秒)，之后只能从任务存储查询结果
+SSE_KEEPALIVE_SECONDS = 15 # SSE 流无新事件时发送心跳的间隔
+MAX_RUNNING_JOBS = 32 # Web 模式下同时执行 (含即将执行) 的任务数上限
+MAX_SCHEDULED_JOBS = 200 # Web 模式下排队等待与执行中的任务总数上限
+JOB_STAGGER_MS = 50 # 同一时刻执行的多个任务之间错开的毫秒数，避免自己的任务互相争抢
+JOB_TYPICAL_DURATION = 20 # 估算的单个任务执行耗时 (秒)，用于计算 Retry-After
+JOB_DEADLINE_SECONDS = 90 # 任务默认截止时间: 执行时间之后多少秒强制结束 (释放排队连接和工作线程)
+JOB_WORKER_PROCESSES = 0 # Web 模式下执行任务的工作进程数，0 表示在 Web 进程内用线程执行
+AVAILABILITY_TTL_SECONDS = 10 # 阅览室实时座位状态的缓存时间 (秒)，期间所有请求共用同一份结果
+AVAILABILITY_MAX_CONCURRENCY = 8 # 刷新多个阅览室座位状态时的最大并发请求数
+LEARN_SEAT_MAPS = True # 根据任务和座位状态查询收到的 libLayout 自动生成/补全座位图 (写入 data_process/seat/output)
+SEAT_INDEX_CELL_SIZE = 4 # 座位空间索引的网格边长 (座位坐标单位)
+OCCUPANCY_RECORD_INTERVAL = 0 # Web 模式下记录座位占用快照的间隔 (秒)，0 表示不记录
+OCCUPANCY_KEYFRAME_SECONDS = 600 # 座位状态未变化时，至少每隔多久仍写入一条快照
+OCCUPANCY_BURST_WINDOWS: List[Tuple[str, str, float]] = [] # 加密采样的时间段 [(开始 HH:MM:SS, 结束 HH:MM:SS, 间隔秒)]，如 [("21:47:58", "21:48:05", 0.05)]
+OUTCOME_RECORDING = True # 是否记录每次尝试的结果 (座位、发出时间偏移、延迟、成败)
+OUTCOME_HISTORY_DAYS = 60 # 计算座位竞争度时使用最近多少天的记录
+OUTCOME_ARRIVAL_TOLERANCE_MS = 150 # 与当前典型到达时间相差在此范围内的历史记录视为 "同等速度"
+OUTCOME_PRIOR_WEIGHT = 2.0 # 座位成功率向整体成功率收缩的先验权重 (样本少的座位更接近整体水平)
+ADAPTIVE_FIRE_OFFSET = True # 是否根据历史结果自动调整提前发出主操作的时间
+FIRE_LEAD_MIN_MS = 0 # 提前量下限 (毫秒)
+FIRE_LEAD_MAX_MS = 200 # 提前量上限 (毫秒)，无论历史如何都不会提前更多
+FIRE_LEAD_STEP_MS = 20 # 被抢且晚于开放时间到达时，每次最多增加的提前量
+FIRE_LEAD_LOSS_STREAK = 3 # 同一提前量下连续多少次 "开放后到达且被抢" 才增加提前量
+FIRE_LEAD_BACKOFF_MS = 30 # 收到 "不在预约时间内" 时减少的提前量
+FIRE_TUNING_HISTORY = 10 # 调整提前量时参考同一窗口最近多少次首次尝试
+LEASE_TTL_SECONDS = 15 # 多节点模式下任务租约的有效期，节点每 1/3 有效期续约一次
+LEASE_POLL_INTERVAL = 1.0 # 多节点模式下领取新任务的轮询间隔 (秒)
+LOG_LEVEL = "INFO" # 任务执行日志的级别 (DEBUG 时输出倒计时)，也可用环境变量 IGOLIB_LOG_LEVEL 覆盖
+LOG_FILE: Optional[str] = None # 任务执行日志写入的文件，None 表示输出到控制台
+LOG_JSON = False # 每行输出一个 JSON 对象 (t, mono, level, job, step, msg)，便于按任务和步骤分析耗时
+JOB_PROFILING = os.environ.get("IGOLIB_PROFILE", "") not in ("", "0") # 对所有任务做性能分析 (也可在提交单个任务时指定 profile)
+JOB_PROFILER = "cprofile" # "cprofile": 确定性分析，生成 .prof (pstats)；"sample": 定时采样调用栈，生成 .folded (火焰图)
+JOB_PROFILE_SAMPLE_INTERVAL = 0.002 # 采样分析的间隔 (秒)
+RECORD_EXCHANGES = os.environ.get("IGOLIB_RECORD", "") not in ("", "0") # 录制所有任务与服务器的交换 (HTTP 请求/响应、排队 WebSocket 帧)，用于离线回放
 
 # --- 配置 mitmproxy 脚本路径 ---
 MITMPROXY_SCRIPT_NAME = "cookie_extractor.py"
@@ -89,30 +171,125 @@ except NameError:
 DATA_DIR = os.path.join(SCRIPT_DIR, 'data_process')
 ROOM_MAPPINGS_FILE = os.path.join(DATA_DIR, 'room', 'output', 'room_mappings.json')
 SEAT_MAPPINGS_DIR = os.path.join(DATA_DIR, 'seat', 'output')
+MAPPING_BUNDLE_PATH = os.path.join(DATA_DIR, 'mappings.bundle') # 由上面的 JSON 文件编译而成，过期时自动重新生成
+USE_MAPPING_BUNDLE = True # 关闭后每次启动都逐个解析 JSON 映射文件
 TEMPLATES_DIR = os.path.join(SCRIPT_DIR, 'templates')
 COOKIE_FILE_PATH = os.path.join(SCRIPT_DIR, COOKIE_FILENAME)
+COOKIE_MAP_FILE_PATH = os.path.join(SCRIPT_DIR, COOKIE_MAP_FILENAME)
+JOB_DB_PATH = os.path.join(SCRIPT_DIR, 'jobs.db') # Web 模式的任务持久化数据库
+OCCUPANCY_DB_PATH = os.path.join(SCRIPT_DIR, 'occupancy.db') # 历史座位占用记录
+OUTCOMES_DB_PATH = os.path.join(SCRIPT_DIR, 'outcomes.db') # 每次抢座/预约尝试的结果记录 (用于座位竞争分析)
+JOB_PROFILE_DIR = os.path.join(SCRIPT_DIR, 'profiles') # 每个被分析任务的性能分析文件 (<job_id>.prof / .folded)
+RECORDINGS_DIR = os.path.join(SCRIPT_DIR, 'recordings') # 每个被录制任务的交换记录 (<job_id>.jsonl.gz，Cookie 已脱敏)
 
 # --- Global Variables ---
+# 以下映射始终是 MAPPING_REGISTRY 当前快照中的对象 (热重载时整体替换)；需要同时读取多个映射时请用 current_mappings()
 ROOM_ID_TO_NAME: Dict[str, str] = {}
 ROOM_NAME_TO_ID: Dict[str, str] = {}
-SEAT_MAPPINGS: Dict[str, Dict[str, str]] = {} # { room_name: { seat_number: seat_key } }
+# 以下三个映射在使用映射包时是只读的 Mapping (按阅览室延迟解码)，否则是普通 dict
+SEAT_MAPPINGS: Mapping[str, Dict[str, str]] = {} # { room_name: { seat_number: seat_key } }
+SEAT_KEY_TO_NUMBER: Mapping[str, Dict[str, str]] = {} # { room_name: { seat_key: seat_number } }，加载时预先计算
+SEAT_COORDINATES: Mapping[str, List[Tuple[str, str, int, int]]] = {} # { room_name: [(座位号, 座位 Key, x, y), ...] }，来自映射包
 SEAT_TAKEN_ERROR_CODE = "SEAT_TAKEN"
+JOB_CANCELLED_PREFIX = "任务已取消" # 被取消或超过截止时间的任务，其结果以此开头
+MAPPING_RELOAD_INTERVAL = 2.0 # Web 模式下检查映射文件变化的间隔 (秒)，0 表示不自动重载
+
+# --- Logging ---
+# 任务执行过程 (perform_seat_operation / pass_queue / 调度器) 的日志只放入队列，由后台线程写出，
+# 多个任务同时在执行时刻输出时不会在控制台 IO 上互相阻塞。每条记录带任务 ID、步骤和单调时钟时间戳。
+log = logging.getLogger("igolib")
+log.propagate = False
+_log_job_id: contextvars.ContextVar[str] = contextvars.ContextVar("igolib_log_job_id", default="-") # 当前线程正在执行的任务
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class _LogContextFilter(logging.Filter):
+    """在调用线程中 (入队之前) 补上任务 ID、步骤和单调时钟时间。"""
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.mono = time.monotonic()
+        if not hasattr(record, "job"): record.job = _log_job_id.get()
+        if not hasattr(record, "step"): record.step = "-"
+        return True
+
+
+class _JsonLogFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps({"t": round(record.created, 6), "mono": round(record.mono, 6), "level": record.levelname,
+                           "job": record.job, "step": record.step, "msg": record.getMessage()}, ensure_ascii=False)
+
+
+def setup_logging(level: Optional[str] = None, log_file: Optional[str] = None, json_lines: Optional[bool] = None) -> None:
+    """(重新) 配置任务日志: 调用方只做入队 (QueueHandler)，格式化和写出在后台的 QueueListener 线程中进行。"""
+    global _log_listener
+    if _log_listener: _log_listener.stop() # 写出队列中剩余的记录
+    level = (level or os.environ.get("IGOLIB_LOG_LEVEL") or LOG_LEVEL).upper()
+    log_file = log_file if log_file is not None else LOG_FILE
+    target = logging.FileHandler(log_file, encoding="utf-8") if log_file else logging.StreamHandler(sys.stdout)
+    if json_lines if json_lines is not None else LOG_JSON: target.setFormatter(_JsonLogFormatter())
+    else: target.setFormatter(logging.Formatter("%(asctime)s.%(msecs)03d [%(job)s] %(step)s | %(message)s", "%H:%M:%S"))
+    handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    handler.addFilter(_LogContextFilter())
+    for old in list(log.handlers): log.removeHandler(old)
+    log.addHandler(handler); log.setLevel(level)
+    _log_listener = logging.handlers.QueueListener(handler.queue, target)
+    _log_listener.start()
+
+
+def flush_logging() -> None:
+    """等待队列中的日志全部写出 (进程退出前调用)。"""
+    global _log_listener
+    if _log_listener: _log_listener.stop(); _log_listener = None
+
+
+setup_logging()
+atexit.register(flush_logging)
 
 # --- Data Loading Function ---
-def load_mappings() -> bool:
-    """Loads room and seat mappings from JSON files."""
-    global ROOM_ID_TO_NAME, ROOM_NAME_TO_ID, SEAT_MAPPINGS
+class MappingSnapshot:
+    """
+    一份完整、只读的阅览室和座位映射。热重载时整体换成新的快照：
+    已经拿到旧快照的任务继续使用旧快照，之后的请求看到新快照，读取时不需要加锁。
+    """
+    __slots__ = ("rooms", "room_ids", "seats", "seat_keys", "coords", "fingerprint", "version", "loaded_at", "indexes", "responses")
+
+    def __init__(self, rooms: Dict[str, str], seats: Mapping[str, Dict[str, str]], seat_keys: Mapping[str, Dict[str, str]],
+                 coords: Mapping[str, List[Tuple[str, str, int, int]]], fingerprint: Optional[bytes] = None,
+                 room_ids: Optional[Dict[str, str]] = None):
+        self.rooms = rooms # { lib_id: room_name }
+        self.room_ids = room_ids if room_ids is not None else {name: lib_id for lib_id, name in rooms.items()}
+        self.seats, self.seat_keys, self.coords = seats, seat_keys, coords
+        self.fingerprint = fingerprint # 加载时映射文件的指纹，用于判断是否需要重载
+        self.version = 0 # 由 MappingRegistry 发布时设置
+        self.loaded_at = time.time()
+        self.indexes: Dict[str, "SeatGridIndex"] = {} # { room_name: 空间索引 }，按需构建，随快照一起替换
+        self.responses: Dict[str, Any] = {} # Web 模式下由本快照生成的已编码响应 (见 cached_json_response)
+
+    def room_name(self, lib_id: Any) -> str:
+        return self.rooms.get(str(lib_id), f"ID {lib_id}")
+
+
+def read_mapping_snapshot() -> Optional[MappingSnapshot]:
+    """Reads room and seat mappings, from the compiled bundle when it is up to date, otherwise from the JSON files."""
     print("正在加载阅览室和座位映射数据...")
-    ROOM_ID_TO_NAME.clear(); ROOM_NAME_TO_ID.clear(); SEAT_MAPPINGS.clear()
+    fingerprint = mapping_bundle.source_fingerprint(ROOM_MAPPINGS_FILE, SEAT_MAPPINGS_DIR) # 在读取之前取指纹，读取期间的修改会在下次检查时重载
+    if USE_MAPPING_BUNDLE:
+        try: bundle, status = mapping_bundle.load_or_rebuild(MAPPING_BUNDLE_PATH, ROOM_MAPPINGS_FILE, SEAT_MAPPINGS_DIR)
+        except (OSError, ValueError) as e: print(f"映射包不可用 ({type(e).__name__}: {e})，改为逐个读取 JSON 映射文件。")
+        else: # 座位图在第一次用到某个阅览室时才解码
+            for message in bundle.skipped: print(f"警告: {message}，已跳过。")
+            print(f"成功加载 {len(bundle.rooms)} 个阅览室映射和 {len(bundle.seats)} 个阅览室的座位映射 (映射包{'' if status == 'loaded' else ': ' + status})。")
+            if not bundle.rooms: print("错误: 未能加载任何阅览室数据。")
+            return MappingSnapshot(bundle.rooms, bundle.seats, bundle.seat_keys, bundle.coords, fingerprint, bundle.room_ids)
     try:
         if not os.path.exists(ROOM_MAPPINGS_FILE):
             print(f"错误: 阅览室映射文件未找到: {ROOM_MAPPINGS_FILE}")
-            return False
+            return None
         with open(ROOM_MAPPINGS_FILE, 'r', encoding='utf-8') as f:
-            ROOM_ID_TO_NAME = json.load(f)
-        ROOM_NAME_TO_ID = {v: k for k, v in ROOM_ID_TO_NAME.items()}
-        print(f"成功加载 {len(ROOM_ID_TO_NAME)} 个阅览室映射。")
+            room_id_to_name = json.load(f)
+        room_name_to_id = {v: k for k, v in room_id_to_name.items()}
+        print(f"成功加载 {len(room_id_to_name)} 个阅览室映射。")
 
+        seat_mappings: Dict[str, Dict[str, str]] = {}; seat_key_to_number: Dict[str, Dict[str, str]] = {}
         seat_files = glob.glob(os.path.join(SEAT_MAPPINGS_DIR, '*.json'))
         if not seat_files:
              print(f"警告: 在 {SEAT_MAPPINGS_DIR} 未找到座位映射文件 (*.json)。")
@@ -121,11 +298,12 @@ def load_mappings() -> bool:
             for seat_file in seat_files:
                 try:
                     room_name_from_file = os.path.splitext(os.path.basename(seat_file))[0]
-                    if room_name_from_file in ROOM_NAME_TO_ID: # Check against loaded room names
+                    if room_name_from_file in room_name_to_id: # Check against loaded room names
                         with open(seat_file, 'r', encoding='utf-8') as f:
                             seat_map = json.load(f)
                             if isinstance(seat_map, dict):
-                                SEAT_MAPPINGS[room_name_from_file] = seat_map
+                                seat_mappings[room_name_from_file] = seat_map
+                                seat_key_to_number[room_name_from_file] = {v: k for k, v in seat_map.items()}
                                 loaded_seat_maps += 1
                             else:
                                 print(f"警告: 座位文件 '{os.path.basename(seat_file)}' 内容格式不正确，已跳过。")
@@ -138,14 +316,134 @@ def load_mappings() -> bool:
             elif seat_files:
                 print(f"警告: 找到了座位文件，但未能成功加载任何有效的座位映射。")
 
-        if not ROOM_ID_TO_NAME:
+        if not room_id_to_name:
             print("错误: 未能加载任何阅览室数据。")
-            return False
-        return True
+            return None
+        return MappingSnapshot(room_id_to_name, seat_mappings, seat_key_to_number, {}, fingerprint, room_name_to_id)
 
     except Exception as e:
         print(f"加载映射数据时发生错误: {type(e).__name__} - {e}")
-        return False
+        return None
+
+
+class MappingRegistry:
+    """
+    持有当前的映射快照。reload() 在映射文件变化时读取新快照并一次性替换引用；
+    读取方只做一次属性访问 (current)，不与重载争锁。watch() 在后台线程中定期检查文件指纹。
+    """
+    def __init__(self):
+        self._current = MappingSnapshot({}, {}, {}, {})
+        self._reload_lock = threading.Lock() # 只用于串行化重载，读取不经过这把锁
+        self._failed_fingerprint: Optional[bytes] = None # 读取失败的文件版本，文件再次变化前不重复尝试
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[MappingSnapshot], None]] = []
+
+    def add_listener(self, callback: Callable[[MappingSnapshot], None]) -> None:
+        """注册在每个新快照发布后调用的回调 (在重载线程中执行，如预先生成响应)。"""
+        self._listeners.append(callback)
+
+    @property
+    def current(self) -> MappingSnapshot:
+        return self._current
+
+    def publish(self, snapshot: MappingSnapshot) -> None:
+        global ROOM_ID_TO_NAME, ROOM_NAME_TO_ID, SEAT_MAPPINGS, SEAT_KEY_TO_NUMBER, SEAT_COORDINATES
+        snapshot.version = self._current.version + 1
+        self._current = snapshot
+        # 兼容直接读取模块级映射的代码: 每个名字都指向新快照中的对象
+        ROOM_ID_TO_NAME, ROOM_NAME_TO_ID = snapshot.rooms, snapshot.room_ids
+        SEAT_MAPPINGS, SEAT_KEY_TO_NUMBER, SEAT_COORDINATES = snapshot.seats, snapshot.seat_keys, snapshot.coords
+        for callback in self._listeners:
+            try: callback(snapshot)
+            except Exception as e: print(f"映射更新回调出错: {type(e).__name__} - {e}")
+
+    def reload(self, force: bool = False) -> bool:
+        """映射文件有变化 (或 force) 时读取并发布新快照，返回是否发布了新快照。读取失败时保留当前快照。"""
+        with self._reload_lock:
+            old = self._current
+            fingerprint = mapping_bundle.source_fingerprint(ROOM_MAPPINGS_FILE, SEAT_MAPPINGS_DIR)
+            if not force and fingerprint in (old.fingerprint, self._failed_fingerprint): return False
+            snapshot = read_mapping_snapshot()
+            if snapshot is None or not snapshot.rooms:
+                self._failed_fingerprint = fingerprint
+                if old.rooms: print(f"映射重载失败，继续使用版本 {old.version} 的映射。")
+                return False
+            self._failed_fingerprint = None
+            self.publish(snapshot)
+        if old.rooms:
+            added = sorted(set(snapshot.room_ids) - set(old.room_ids)); removed = sorted(set(old.room_ids) - set(snapshot.room_ids))
+            print(f"映射已更新到版本 {snapshot.version}" + (f"，新增阅览室: {', '.join(added)}" if added else "") + (f"，移除阅览室: {', '.join(removed)}" if removed else ""))
+        return True
+
+    def watch(self, interval: float = MAPPING_RELOAD_INTERVAL) -> None:
+        """启动后台线程，每 interval 秒检查一次映射文件 (只比较文件名、大小和修改时间)。"""
+        if interval <= 0 or (self._thread and self._thread.is_alive()): return
+        self._stop_event.clear()
+        def loop():
+            while not self._stop_event.wait(interval):
+                try: self.reload()
+                except Exception as e: print(f"检查映射文件时出错: {type(e).__name__} - {e}")
+        self._thread = threading.Thread(target=loop, name="mapping-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread: self._thread.join(timeout=2)
+
+
+MAPPING_REGISTRY = MappingRegistry()
+
+
+def current_mappings() -> MappingSnapshot:
+    """当前的映射快照。一次请求内需要同时读取阅览室和座位映射时，先取一次快照再使用。"""
+    return MAPPING_REGISTRY.current
+
+
+def load_mappings() -> bool:
+    """Loads (or reloads) room and seat mappings and publishes them as the current snapshot."""
+    MAPPING_REGISTRY.reload(force=True)
+    return bool(MAPPING_REGISTRY.current.rooms)
+
+# --- Cookie Map (multi-identity) ---
+_cookie_map_cache: Tuple[Optional[float], Dict[str, Dict[str, Any]]] = (None, {})
+
+def load_cookie_map() -> Dict[str, Dict[str, Any]]:
+    """
+    读取 cookie_extractor 写出的多账号 Cookie 映射 { 身份: {"cookie", "client", "updated_at"} }。
+    文件由代理端原子替换，这里按 mtime 缓存，未变化时不重复解析。
+    """
+    global _cookie_map_cache
+    try: mtime = os.stat(COOKIE_MAP_FILE_PATH).st_mtime
+    except OSError: return {}
+    cached_mtime, cached_map = _cookie_map_cache
+    if cached_mtime == mtime: return cached_map
+    try:
+        with open(COOKIE_MAP_FILE_PATH, 'r', encoding='utf-8') as f: cookie_map = json.load(f)
+        if not isinstance(cookie_map, dict): cookie_map = {}
+    except (OSError, ValueError) as e:
+        print(f"读取 Cookie 映射文件失败: {e}"); return cached_map
+    _cookie_map_cache = (mtime, cookie_map)
+    return cookie_map
+
+
+def find_cookie(identity: Optional[str] = None, client_host: Optional[str] = None, since: float = 0.0) -> Optional[str]:
+    """
+    从 Cookie 映射中查找 Cookie。
+    指定 identity 时精确匹配；否则返回 since 之后更新的最新条目，优先选择来自 client_host 的条目。
+    映射中的 client 是代理看到的微信客户端地址，只有浏览器和微信在同一台机器上 (代理设为 127.0.0.1 的常见用法)
+    且 client_host 是浏览器地址时两者才一致；不一致时退回到最新条目。
+    """
+    cookie_map = load_cookie_map()
+    if identity:
+        entry = cookie_map.get(identity)
+        return entry.get("cookie") if isinstance(entry, dict) else None
+    candidates = [e for e in cookie_map.values() if isinstance(e, dict) and e.get("cookie") and e.get("updated_at", 0) > since]
+    if client_host:
+        same_client = [e for e in candidates if e.get("client") == client_host]
+        if same_client: candidates = same_client
+    if not candidates: return None
+    return max(candidates, key=lambda e: e.get("updated_at", 0))["cookie"]
 
 # --- Default Payloads ---
 # Using multi-line strings for better readability
@@ -333,6 +631,272 @@ def stop_mitmproxy():
 # 确保在 beta.py 退出时，我们启动的 mitmproxy 也能退出
 atexit.register(stop_mitmproxy)
 
+# --- Shared HTTP Session ---
+_http_session: Optional["requests.Session"] = None
+_http_session_lock = threading.Lock()
+
+def get_http_session() -> "requests.Session":
+    """
+    返回进程内共享的 requests.Session，所有任务复用同一个连接池。
+    每个请求都显式携带自己的 Cookie 头，Session 不保存任何服务器下发的 Cookie，避免不同账号之间串号。
+    """
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                import http.cookiejar # 与 requests 一样只在第一次需要连接池时导入
+                session = requests.Session()
+                session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+                adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("https://", adapter); session.mount("http://", adapter)
+                _http_session = session
+    return _http_session
+
+# --- Server Transport (live / record / replay) ---
+# perform_seat_operation 和 pass_queue 通过 transport 发出 HTTP 请求和建立排队 WebSocket：
+# 默认直接访问服务器；录制时额外记下每次交换的内容和耗时；回放时按顺序返回录制的响应，不访问网络。
+RECORDING_FORMAT_VERSION = 1
+
+
+class ReplayMismatchError(RuntimeError):
+    """回放时引擎发出的请求与录制的交换顺序不一致 (说明引擎行为已改变)。"""
+
+
+class LiveTransport:
+    def prepare(self) -> None:
+        """在倒计时之前调用：创建共享连接池并导入 websocket (首次调用时导入 requests)。"""
+        get_http_session(); websocket.preload()
+
+    def post(self, url: str, headers: Dict[str, str], payload: Dict[str, Any], timeout: float) -> "requests.Response":
+        return get_http_session().post(url, headers=headers, json=payload, timeout=timeout)
+
+    def connect_queue(self, url: str, headers: Dict[str, str], timeout: float) -> Any:
+        return websocket.create_connection(url, header=headers, suppress_origin=True, timeout=timeout)
+
+
+live_transport = LiveTransport()
+
+
+class ExchangeRecorder:
+    """
+    录制一个任务与服务器的全部交换。执行时只把事件追加到内存列表，任务结束后一次性写入
+    RECORDINGS_DIR/<job_id>.jsonl.gz (首行为任务信息，末行为结果)。不保存请求头，响应中出现的 Cookie 值替换为 <redacted>。
+    """
+    def __init__(self, job: "SeatJob", inner: Optional[LiveTransport] = None):
+        self.job, self.inner = job, inner or live_transport
+        self.events: List[Dict[str, Any]] = []
+        self.started_at, self._start_mono = time.time(), time.monotonic()
+        self._secret = job.cookie.split("=", 1)[-1].strip()
+
+    def redact(self, text: str) -> str:
+        return text.replace(self._secret, "<redacted>") if self._secret and len(self._secret) >= 8 else text
+
+    def add(self, kind: str, started: float, **fields: Any) -> None:
+        """started 为调用开始时的 time.monotonic()；dt 为调用阻塞的时长。"""
+        now = time.monotonic()
+        self.events.append({"kind": kind, "t": round(started - self._start_mono, 4), "dt": round(now - started, 4), **fields})
+
+    def error_fields(self, error: BaseException) -> Dict[str, Any]:
+        return {"error": type(error).__name__, "module": type(error).__module__, "message": self.redact(str(error))}
+
+    def prepare(self) -> None: self.inner.prepare()
+
+    def post(self, url: str, headers: Dict[str, str], payload: Dict[str, Any], timeout: float) -> "requests.Response":
+        started = time.monotonic(); op = payload.get("operationName")
+        try: res = self.inner.post(url, headers, payload, timeout)
+        except Exception as e: self.add("http", started, op=op, request=payload, **self.error_fields(e)); raise
+        self.add("http", started, op=op, request=payload, status=res.status_code, reason=res.reason,
+                 elapsed=res.elapsed.total_seconds(), text=self.redact(res.text))
+        return res
+
+    def connect_queue(self, url: str, headers: Dict[str, str], timeout: float) -> Any:
+        started = time.monotonic()
+        try: ws = self.inner.connect_queue(url, headers, timeout)
+        except Exception as e: self.add("ws_connect", started, **self.error_fields(e)); raise
+        self.add("ws_connect", started, connected=bool(ws.connected))
+        return _RecordingWebSocket(self, ws)
+
+    def save(self, result: Optional[str]) -> Optional[str]:
+        """写入录制文件，返回路径 (写入失败时返回 None)。"""
+        job = self.job
+        header = {"kind": "job", "version": RECORDING_FORMAT_VERSION, "job_id": job.job_id, "name": job.name, "mode": job.mode,
+                  "lib_id": job.lib_id, "seat_targets": job.seat_targets, "fire_at": job.start_dt.timestamp() if job.start_dt else None,
+                  "fire_lead_ms": job.fire_lead_ms, "started_at": self.started_at}
+        end = {"kind": "end", "t": round(time.monotonic() - self._start_mono, 4), "result": result, "attempts": job.attempts}
+        path = os.path.join(RECORDINGS_DIR, f"{job.job_id}.jsonl.gz")
+        try:
+            os.makedirs(RECORDINGS_DIR, exist_ok=True)
+            with gzip.open(path, "wt", encoding="utf-8") as f:
+                for event in [header] + self.events + [end]: f.write(json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n")
+        except OSError as e:
+            log.warning(f"无法写入录制文件 {path}: {e}"); return None
+        log.info(f"已录制 {len(self.events)} 次交换 -> {path}", extra={"step": "record"})
+        return path
+
+
+class _RecordingWebSocket:
+    def __init__(self, recorder: ExchangeRecorder, ws: Any):
+        self._recorder, self._ws = recorder, ws
+
+    @property
+    def connected(self) -> bool: return self._ws.connected
+
+    def settimeout(self, timeout: float) -> None: self._ws.settimeout(timeout)
+
+    def send(self, data: str) -> None:
+        self._recorder.add("ws_send", time.monotonic(), data=data); self._ws.send(data)
+
+    def recv(self) -> str:
+        started = time.monotonic()
+        try: data = self._ws.recv()
+        except Exception as e: self._recorder.add("ws_recv", started, **self._recorder.error_fields(e)); raise
+        self._recorder.add("ws_recv", started, data=self._recorder.redact(data if isinstance(data, str) else data.decode("utf-8", "replace")))
+        return data
+
+    def abort(self) -> None: self._ws.abort()
+
+    def close(self) -> None:
+        self._recorder.add("ws_close", time.monotonic()); self._ws.close()
+
+
+def read_recording(path: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """读取录制文件，返回 (任务信息, 交换事件, 结束记录或 None)。"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if not records or records[0].get("kind") != "job": raise ValueError("不是有效的录制文件")
+    if records[0].get("version") != RECORDING_FORMAT_VERSION: raise ValueError(f"不支持的录制文件版本: {records[0].get('version')}")
+    end = records[-1] if records[-1].get("kind") == "end" else None
+    return records[0], records[1:-1] if end else records[1:], end
+
+
+class ReplayTransport:
+    """
+    按录制顺序返回响应。speed 为回放速度倍数：1 按原始耗时等待，10 快 10 倍，0 不等待。
+    引擎发出的请求与录制不一致时抛出 ReplayMismatchError。
+    """
+    def __init__(self, events: List[Dict[str, Any]], speed: float = 1.0):
+        self.events, self.speed = events, speed
+        self.position = 0
+        self._lock = threading.Lock()
+
+    def prepare(self) -> None: pass
+
+    def next_event(self, kind: str, op: Optional[str] = None) -> Dict[str, Any]:
+        with self._lock:
+            while self.position < len(self.events) and self.events[self.position]["kind"] in ("ws_send", "ws_close"):
+                self.position += 1 # 客户端发出的帧只用于查看，回放时不要求逐帧一致
+            if self.position >= len(self.events):
+                raise ReplayMismatchError(f"录制的交换已用完，引擎仍在请求 {op or kind}")
+            event = self.events[self.position]
+            if event["kind"] != kind or (op is not None and event.get("op") != op):
+                raise ReplayMismatchError(f"第 {self.position + 1} 个交换不一致: 录制为 {event.get('op') or event['kind']}，引擎请求 {op or kind}")
+            self.position += 1
+        return event
+
+    def wait(self, event: Dict[str, Any], limit: Optional[float] = None) -> None:
+        if self.speed > 0:
+            delay = event.get("dt", 0) / self.speed
+            time.sleep(min(delay, limit) if limit is not None else delay)
+
+    @staticmethod
+    def raise_error(event: Dict[str, Any]) -> None:
+        """按录制的异常类型重新抛出 (requests / websocket 的异常类，找不到时用 ConnectionError)。"""
+        module = {"requests.exceptions": requests.exceptions}.get(event.get("module", "")) or \
+                 (websocket if str(event.get("module", "")).startswith("websocket") else None)
+        error_type = getattr(module, event["error"], None) if module is not None else None
+        if not (isinstance(error_type, type) and issubclass(error_type, Exception)): error_type = ConnectionError
+        raise error_type(event.get("message", ""))
+
+    def post(self, url: str, headers: Dict[str, str], payload: Dict[str, Any], timeout: float) -> "requests.Response":
+        event = self.next_event("http", payload.get("operationName"))
+        self.wait(event, timeout)
+        if "error" in event: self.raise_error(event)
+        res = requests.models.Response()
+        res.status_code, res.reason, res.url, res.encoding = event["status"], event.get("reason", ""), url, "utf-8"
+        res._content = event["text"].encode("utf-8")
+        res.elapsed = datetime.timedelta(seconds=event.get("elapsed", 0))
+        return res
+
+    def connect_queue(self, url: str, headers: Dict[str, str], timeout: float) -> Any:
+        event = self.next_event("ws_connect")
+        self.wait(event, timeout)
+        if "error" in event: self.raise_error(event)
+        return _ReplayWebSocket(self, event.get("connected", True))
+
+
+class _ReplayWebSocket:
+    def __init__(self, transport: ReplayTransport, connected: bool):
+        self._transport, self.connected = transport, connected
+        self._timeout: Optional[float] = None
+
+    def settimeout(self, timeout: float) -> None: self._timeout = timeout
+
+    def send(self, data: str) -> None: pass
+
+    def recv(self) -> str:
+        event = self._transport.next_event("ws_recv")
+        self._transport.wait(event, self._timeout)
+        if "error" in event: self.connected = False; self._transport.raise_error(event)
+        return event["data"]
+
+    def abort(self) -> None: self.connected = False
+
+    def close(self) -> None: self.connected = False
+
+
+# --- Cancellation ---
+class CancelToken:
+    """
+    任务取消令牌：cancel() 设置取消标志，并立即执行已注册的清理回调 (如中断排队 WebSocket)。
+    设置了 deadline 后，到期即视为取消；所有等待和网络超时都不会超过截止时间。
+    """
+    def __init__(self, deadline: Optional[float] = None):
+        self.deadline = deadline # time.time() 时间戳
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self.deadline is not None and time.time() >= self.deadline:
+            self.cancel("超过任务截止时间")
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "用户取消") -> None:
+        with self._lock:
+            if self._event.is_set(): return
+            self.reason = reason; self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try: callback()
+            except Exception as cb_err: print(f"[Cancel] 清理回调出错: {cb_err}")
+
+    def on_cancel(self, callback: Callable[[], None]) -> None:
+        """注册取消时执行的清理回调；已取消则立即执行。"""
+        with self._lock:
+            if not self._event.is_set(): self._callbacks.append(callback); return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks: self._callbacks.remove(callback)
+
+    def remaining(self, default: float) -> float:
+        """网络操作可用的超时时间：不超过 default，也不超过截止时间。"""
+        if self.deadline is None: return default
+        return max(0.1, min(default, self.deadline - time.time()))
+
+    def wait(self, timeout: float) -> bool:
+        """可被取消打断的 sleep (不会睡过截止时间)，被取消时返回 True。"""
+        if self.deadline is not None: timeout = max(0.0, min(timeout, self.deadline - time.time()))
+        self._event.wait(timeout)
+        return self.cancelled
+
+    def message(self) -> str:
+        return f"{JOB_CANCELLED_PREFIX}: {self.reason or '用户取消'}"
+
+
 # --- Helper Functions ---
 def extract_error_msg(response_text: str) -> str:
     """Extracts the error message from the JSON response."""
@@ -359,35 +923,44 @@ def extract_error_msg(response_text: str) -> str:
         return f"解析错误信息时发生内部错误: {type(e).__name__}"
 
 
-def pass_queue(ws_headers: Dict[str, str], status_callback: Optional[Callable[[str], None]] = None) -> bool:
-    """Simulates WebSocket queueing, sends status updates via callback."""
+def pass_queue(ws_headers: Dict[str, str], status_callback: Optional[Callable[[str], None]] = None,
+               cancel_token: Optional[CancelToken] = None, transport: Optional[LiveTransport] = None) -> bool:
+    """Simulates WebSocket queueing, sends status updates via callback. Cancelling the token closes the socket."""
 
     def send_status_pq(msg: str):
-        """Internal helper to print and send status."""
-        print(msg)
+        """Internal helper to log and send status."""
+        cleaned_msg = msg.strip().replace('\r', '')
+        if not cleaned_msg: return
+        log.info(cleaned_msg, extra={"step": "queue"})
         if status_callback:
-            cleaned_msg = msg.strip().replace('\r', '')
-            if cleaned_msg:
-                try:
-                    status_callback(cleaned_msg)
-                except Exception as pq_cb_err:
-                    print(f"[Callback Error in pass_queue] {pq_cb_err}")
+            try:
+                status_callback(cleaned_msg)
+            except Exception as pq_cb_err:
+                log.warning(f"[Callback Error in pass_queue] {pq_cb_err}", extra={"step": "queue"})
 
     send_status_pq("\n================================")
     send_status_pq("尝试进入排队通道...")
     ws = None
     is_success = False
+    close_on_cancel = None
     try:
-        ws = websocket.create_connection(WEBSOCKET_URL, header=ws_headers, suppress_origin=True, timeout=10) # Added connection timeout
+        connect_timeout = cancel_token.remaining(10) if cancel_token else 10
+        ws = (transport or live_transport).connect_queue(WEBSOCKET_URL, ws_headers, connect_timeout) # Added connection timeout
+        if cancel_token:
+            close_on_cancel = ws.abort # 取消时立即中断阻塞中的 recv
+            cancel_token.on_cancel(close_on_cancel)
         if ws.connected:
             send_status_pq('WebSocket 连接成功，开始排队...')
             ws.send('{"ns":"prereserve/queue","msg":""}')
             timeout_seconds = 15 # Increased receive timeout
             start_time = time.time()
             while time.time() - start_time < timeout_seconds:
+                if cancel_token and cancel_token.cancelled:
+                    send_status_pq(f"排队已中止: {cancel_token.reason}"); break
                 try:
                     # Calculate remaining time for recv timeout
                     receive_timeout = max(0.1, timeout_seconds - (time.time() - start_time))
+                    if cancel_token: receive_timeout = cancel_token.remaining(receive_timeout)
                     ws.settimeout(receive_timeout)
                     raw_response = ws.recv()
                     decoded_response = raw_response # Default
@@ -417,6 +990,8 @@ def pass_queue(ws_headers: Dict[str, str], status_callback: Optional[Callable[[s
                     send_status_pq(f"排队响应超时（等待 {receive_timeout:.1f} 秒后）。")
                     break
                 except websocket.WebSocketConnectionClosedException as e:
+                    if cancel_token and cancel_token.cancelled:
+                        send_status_pq(f"排队已中止: {cancel_token.reason}"); break
                     code = getattr(e, 'code', 'N/A'); reason = getattr(e, 'reason', 'N/A')
                     send_status_pq(f"WebSocket 连接在排队过程中关闭: Code={code}, Reason={reason} (Exception: {e})")
                     if code == 1006 or (isinstance(reason, str) and "Connection to remote host was lost" in reason):
@@ -444,6 +1019,7 @@ def pass_queue(ws_headers: Dict[str, str], status_callback: Optional[Callable[[s
         send_status_pq(f"排队过程中发生未知错误: {type(e_outer).__name__} - {e_outer}")
         send_status_pq(traceback.format_exc())
     finally:
+        if cancel_token and close_on_cancel: cancel_token.remove_callback(close_on_cancel)
         if ws and ws.connected:
             try: ws.close(); send_status_pq("WebSocket 连接已关闭。")
             except Exception as e_close: send_status_pq(f"关闭WebSocket时出错: {e_close}")
@@ -487,22 +1063,29 @@ def perform_seat_operation(
     lib_id: int,
     seat_key: str,
     start_action_dt: Optional[datetime.datetime],
-    status_callback: Optional[Callable[[str], None]] = None
+    status_callback: Optional[Callable[[str], None]] = None,
+    cancel_token: Optional[CancelToken] = None,
+    metrics: Optional[Dict[str, Any]] = None,
+    transport: Optional[LiveTransport] = None
 ) -> str:
     """
     执行座位预约/抢座操作，包含详细状态更新和错误处理。
-    返回 "成功"、SEAT_TAKEN_ERROR_CODE 或错误消息字符串。
+    返回 "成功"、SEAT_TAKEN_ERROR_CODE 或错误消息字符串；被取消或超过截止时间时返回以 JOB_CANCELLED_PREFIX 开头的消息。
+    传入 metrics 字典时，记录第一次主操作请求的发出时间 (mutation_sent_at)、耗时 (mutation_latency_s)、
+    主操作请求次数 (mutation_requests) 和最后一次主操作的错误信息 (mutation_error)。
+    transport 默认直接访问服务器，也可传入 ExchangeRecorder (录制) 或 ReplayTransport (回放)。
     """
+    step = "prepare" # 当前步骤，写入每条日志的 step 字段
     def send_status(msg: str):
-        """打印到控制台并通过回调发送状态 (如果可用)。"""
-        print(msg)
+        """写入任务日志 (异步) 并通过回调发送状态 (如果可用)。"""
+        cleaned_msg = msg.strip().replace('\r', '')
+        if not cleaned_msg: return
+        log.info(cleaned_msg, extra={"step": step})
         if status_callback:
-            cleaned_msg = msg.strip().replace('\r', '')
-            if cleaned_msg:
-                try:
-                    status_callback(cleaned_msg)
-                except Exception as cb_err:
-                    print(f"[Callback Error] {cb_err}")
+            try:
+                status_callback(cleaned_msg)
+            except Exception as cb_err:
+                log.warning(f"[Callback Error] {cb_err}", extra={"step": step})
 
     # --- 1. 尽早验证模式参数 ---
     if mode not in [1, 2]:
@@ -512,11 +1095,10 @@ def perform_seat_operation(
     mode_str = '预约' if mode == 1 else '抢座'
 
     # --- 获取阅览室和座位信息 (用于日志) ---
-    room_name = ROOM_ID_TO_NAME.get(str(lib_id), f"ID {lib_id}")
+    mappings = current_mappings(); room_name = mappings.room_name(lib_id)
     seat_number_str = "未知"
-    if room_name in SEAT_MAPPINGS:
-        reverse_seat_map = {v: k for k, v in SEAT_MAPPINGS[room_name].items()}
-        seat_number_str = reverse_seat_map.get(seat_key, "未知Key")
+    if room_name in mappings.seat_keys:
+        seat_number_str = mappings.seat_keys[room_name].get(seat_key, "未知Key")
 
     send_status(f"\n--- 开始执行 {mode_str} 操作 ---")
     send_status(f"模式: {'明日预约' if mode == 1 else '立即抢座'} | 阅览室: {room_name} ({lib_id}) | 座位: {seat_number_str} (Key: {seat_key})")
@@ -550,36 +1132,48 @@ def perform_seat_operation(
         send_status(f"❌ {err_msg}")
         return err_msg
 
+    # 共享连接池，Cookie 通过请求头传递；在倒计时之前准备好 (首次调用时导入 requests 和 websocket)
+    transport = transport or live_transport
+    transport.prepare()
+
     # --- 处理等待时间 ---
     now_dt = datetime.datetime.now()
     if start_action_dt and start_action_dt > now_dt:
         wait_seconds = (start_action_dt - now_dt).total_seconds()
         if wait_seconds > 0:
+            step = "countdown"
             send_status(f"等待计划执行时间: {start_action_dt.strftime('%Y-%m-%d %H:%M:%S')}...")
             last_ws_update_time = time.time()
+            log_countdown = log.isEnabledFor(logging.DEBUG) # 倒计时只在 DEBUG 级别写日志
             while True:
                 now_ts = time.time()
                 remaining_seconds = start_action_dt.timestamp() - now_ts
                 if remaining_seconds <= 0.01:
-                    send_status("\n时间到，开始执行！")
+                    send_status("时间到，开始执行！")
                     break
-                # 每 0.5 秒左右更新一次控制台和 WebSocket
-                if int(remaining_seconds * 2) != int((remaining_seconds - 0.1) * 2):
+                # 每 0.5 秒左右更新一次日志和 WebSocket
+                if (log_countdown or status_callback) and int(remaining_seconds * 2) != int((remaining_seconds - 0.1) * 2):
                     countdown_msg = f"距离计划执行时间还有 {remaining_seconds:.1f} 秒..."
-                    print(f"\r{countdown_msg}", end="", flush=True)
+                    if log_countdown: log.debug(countdown_msg, extra={"step": step})
                     if status_callback and (now_ts - last_ws_update_time >= 0.5):
                         status_callback(countdown_msg)
                         last_ws_update_time = now_ts
-                # 自适应休眠
+                # 自适应休眠 (可被取消打断)
                 sleep_duration = max(0.005, min(0.1, remaining_seconds / 10))
-                time.sleep(sleep_duration)
-            print() # 倒计时结束后换行
+                if cancel_token:
+                    if cancel_token.wait(sleep_duration):
+                        send_status(f"❌ {cancel_token.message()}")
+                        return cancel_token.message()
+                else: time.sleep(sleep_duration)
 
     # --- 请求循环 ---
     last_error_msg = f"达到最大尝试次数({MAX_REQUEST_ATTEMPTS})仍未成功。" # 默认最终错误消息
-    session = requests.Session() # 使用 Session 保持连接和 Cookie
 
+    http_timeout = (lambda default: cancel_token.remaining(default)) if cancel_token else (lambda default: default)
     for attempt in range(1, MAX_REQUEST_ATTEMPTS + 1):
+        if cancel_token and cancel_token.cancelled:
+            send_status(f"❌ {cancel_token.message()}")
+            return cancel_token.message()
         send_status(f"\n--- 第 {attempt}/{MAX_REQUEST_ATTEMPTS} 次尝试 ---")
         res: Optional[requests.Response] = None # 类型提示
         text_res_validate = ""
@@ -587,32 +1181,46 @@ def perform_seat_operation(
 
         try:
             # --- 步骤 1: 排队 (WebSocket) ---
+            step = "queue"
             send_status("步骤 1/5: 执行排队...");
-            queue_success = pass_queue(current_queue_header, status_callback=status_callback)
+            queue_success = pass_queue(current_queue_header, status_callback=status_callback, cancel_token=cancel_token, transport=transport)
+            if cancel_token and cancel_token.cancelled: # 排队期间被取消或超过截止时间 (包括最后一次尝试)
+                send_status(f"❌ {cancel_token.message()}")
+                return cancel_token.message()
             if not queue_success: send_status("警告: 排队未确认成功，继续尝试...")
             else: send_status("排队步骤完成。")
 
             # --- 步骤 2: 选择阅览室 (HTTP POST) ---
+            step = "lib_chosen"
             send_status(f"步骤 2/5: 选择阅览室 ({room_name})...");
-            response_lib_chosen = session.post(URL, headers=current_pre_header, json=data_lib_chosen, timeout=10)
+            response_lib_chosen = transport.post(URL, current_pre_header, data_lib_chosen, http_timeout(10))
             send_status(f"  - 选择阅览室响应: {response_lib_chosen.status_code}")
             response_lib_chosen.raise_for_status() # 检查 HTTP 错误
 
             # --- 步骤 3: 主操作 (HTTP POST) ---
+            step = "mutation"
             send_status(f"步骤 3/5: 执行 {mode_str} (座位 {seat_number_str})...");
             time.sleep(0.1) # 短暂延迟
-            res = session.post(URL, headers=current_pre_header, json=main_payload, timeout=15)
+            mutation_sent_at = time.time()
+            res = transport.post(URL, current_pre_header, main_payload, http_timeout(15))
+            if metrics is not None:
+                metrics.setdefault("mutation_sent_at", mutation_sent_at)
+                metrics.setdefault("mutation_latency_s", res.elapsed.total_seconds())
+                metrics["mutation_requests"] = metrics.get("mutation_requests", 0) + 1
             send_status(f"  - 主操作响应: {res.status_code}")
             main_action_text = res.text # 保存响应文本
+            seat_map_learner.observe(lib_id, response_lib_chosen.text) # 选择阅览室的响应就是 libLayout，主操作发出后再交给后台学习座位图
 
             # --- 步骤 4: 验证请求 (HTTP POST) ---
+            step = "validate"
             send_status("步骤 4/5: 发送验证请求...");
-            response_validate = session.post(URL, headers=current_pre_header, json=data_validate_payload, timeout=10)
+            response_validate = transport.post(URL, current_pre_header, data_validate_payload, http_timeout(10))
             send_status(f"  - 验证响应: {response_validate.status_code}")
             text_res_validate = response_validate.text
             response_validate.raise_for_status() # 检查 HTTP 错误
 
             # --- 步骤 5: 检查主操作结果 ---
+            step = "result"
             send_status("步骤 5/5: 检查主操作结果...");
             main_action_failed = False
             error_msg_main = ""
@@ -662,6 +1270,7 @@ def perform_seat_operation(
                 if not error_msg_main: # 如果之前 HTTP 错误处理未提取，则现在提取
                     error_msg_main = extract_error_msg(main_action_text)
                 send_status(f"  - 主操作错误信息: {error_msg_main}")
+                if metrics is not None: metrics["mutation_error"] = error_msg_main
 
                 # --- 特定的业务逻辑错误处理 ---
                 if "access denied" in error_msg_main.lower():
@@ -736,8 +1345,13 @@ def perform_seat_operation(
 
         # 只有在没有成功返回，且尝试次数未满时才重试
         if attempt < MAX_REQUEST_ATTEMPTS:
+            step = "retry"
             send_status(f"等待 {SLEEP_INTERVAL_ON_FAIL} 秒后重试...")
-            time.sleep(SLEEP_INTERVAL_ON_FAIL)
+            if cancel_token:
+                if cancel_token.wait(SLEEP_INTERVAL_ON_FAIL):
+                    send_status(f"❌ {cancel_token.message()}")
+                    return cancel_token.message()
+            else: time.sleep(SLEEP_INTERVAL_ON_FAIL)
         # else: 最后一次尝试失败，循环结束
 
     # --- 循环结束 ---
@@ -746,6 +1360,1738 @@ def perform_seat_operation(
     send_status(final_msg)
     send_status(f"最终未能成功，最后记录的错误: {last_error_msg}")
     return last_error_msg
+# --- Job Scheduler ---
+class JobEventLog:
+    """
+    单个任务的只追加事件日志，保存在有界环形缓冲区中，事件 id 单调递增。
+    订阅者只需记住自己看到的最后一个 id 即可断点续传；所有订阅者共享同一个唤醒事件，
+    服务器不为每个连接保存状态。
+    """
+    def __init__(self, maxlen: int = JOB_EVENT_LOG_SIZE):
+        self._events: "collections.deque[Dict[str, Any]]" = collections.deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self.last_id = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed: Optional[asyncio.Event] = None
+
+    def append(self, event_type: str, **fields: Any) -> Dict[str, Any]:
+        """追加一个事件 (可在任意线程调用)，并唤醒等待中的订阅者。"""
+        with self._lock:
+            self.last_id += 1
+            event = {"id": self.last_id, "type": event_type, "time": time.time(), **fields}
+            self._events.append(event)
+            loop = self._loop
+        if loop is not None:
+            try: loop.call_soon_threadsafe(self._wake)
+            except RuntimeError: pass # 事件循环已关闭
+        return event
+
+    def _wake(self) -> None:
+        if self._changed is not None:
+            self._changed.set(); self._changed = None
+
+    def since(self, last_id: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """返回 id 大于 last_id 的事件，以及中间是否有事件已被环形缓冲区丢弃。"""
+        with self._lock:
+            oldest_id = self._events[0]["id"] if self._events else self.last_id + 1
+            if last_id + 1 >= oldest_id:
+                events = list(itertools.islice(self._events, last_id + 1 - oldest_id, None))
+            else:
+                events = list(self._events)
+        return events, last_id + 1 < oldest_id
+
+    async def wait(self, last_id: int, timeout: float) -> bool:
+        """等待 id 大于 last_id 的新事件，超时返回 False。"""
+        if self.last_id > last_id: return True
+        self._loop = asyncio.get_running_loop()
+        if self._changed is None: self._changed = asyncio.Event()
+        changed = self._changed
+        if self.last_id > last_id: return True # 注册唤醒后再检查一次，避免错过并发追加的事件
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+def job_result_payload(job: "SeatJob") -> Dict[str, Any]:
+    """把任务结果转换为前端使用的 {status, message, error_code}。"""
+    final_result = job.result or "未知结果"
+    payload: Dict[str, Any] = {"status": "success" if final_result.startswith("成功") else "error", "message": final_result}
+    if final_result == SEAT_TAKEN_ERROR_CODE:
+        room_name_for_msg = job.mappings.room_name(job.lib_id)
+        seat_nums_for_msg = "、".join(number if number != "未知" else "[未知Key]" for number, _ in job.seat_targets)
+        payload["message"] = f"该座位 (阅览室: {room_name_for_msg}, 座位号: {seat_nums_for_msg}) 已被占用，请重选。"
+        payload["error_code"] = SEAT_TAKEN_ERROR_CODE
+    elif final_result.startswith(JOB_CANCELLED_PREFIX):
+        payload["status"] = "cancelled"
+    return payload
+
+
+class SeatJob:
+    """
+    一个座位任务：在 start_dt 时按顺序尝试 seat_targets 中的座位，
+    当前座位被占用时立即尝试下一个，直到成功、出错或候选座位用完。
+    """
+    def __init__(self, mode: int, cookie: str, lib_id: int, seat_targets: List[Tuple[str, str]],
+                 start_dt: Optional[datetime.datetime], name: Optional[str] = None, job_id: Optional[str] = None,
+                 deadline_seconds: float = JOB_DEADLINE_SECONDS):
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.name = name or self.job_id
+        self.mode = mode
+        self.cookie = cookie
+        self.lib_id = lib_id
+        self.seat_targets = seat_targets # [(座位号, 座位 Key), ...] 按优先级排序
+        self.start_dt = start_dt
+        self.mappings = current_mappings() # 创建任务时的映射快照，映射热重载不影响已有任务
+        self.state = "pending" # pending -> scheduled -> running -> done
+        self.result: Optional[str] = None
+        self.attempts: List[Dict[str, Any]] = []
+        self.timings: Dict[str, Optional[float]] = {"submitted_at": None, "dispatched_at": None, "started_at": None, "finished_at": None}
+        self.status_callbacks: List[Callable[[str], None]] = [] # 实时状态回调 (如 WebSocket)；重复提交被合并时追加新提交方的回调
+        self.done_callbacks: List[Callable[["SeatJob"], None]] = []
+        self.done_event = threading.Event()
+        self.events = JobEventLog()
+        self.stagger_ms = 0 # 调度器为避免同时刻争抢而推迟的毫秒数
+        self.coalesced_into: Optional["SeatJob"] = None # 被合并到的已有重复任务
+        self.deadline_seconds = deadline_seconds # 执行时间之后最多运行多久
+        self.cancel_token = CancelToken()
+        self.fire_lead_ms: float = 0 # 提前发出主操作的毫秒数 (由调度器根据历史结果决定)
+        self.fire_decision: Optional[Dict[str, Any]] = None # 决定提前量的依据，便于审计
+        self.profiling = JOB_PROFILING # 是否对本任务做性能分析
+        self.profile: Optional[Dict[str, Any]] = None # 性能分析摘要 (墙钟/CPU 时间、分析文件)
+        self.recording = RECORD_EXCHANGES # 是否录制本任务与服务器的交换 (写入 RECORDINGS_DIR/<job_id>.jsonl.gz)
+        self.transport: Optional[Any] = None # 发出请求所用的 transport，None 表示直接访问服务器 (回放时为 ReplayTransport)
+
+    def report_status(self, message: str) -> None:
+        """记录一条状态消息到事件日志，并转发给所有实时回调 (如 WebSocket)。"""
+        self.events.append("status", message=message)
+        for callback in self.status_callbacks:
+            try: callback(message)
+            except Exception as cb_err: log.warning(f"[Job {self.name}] 状态回调出错: {cb_err}", extra={"job": self.job_id})
+
+    def set_state(self, state: str) -> None:
+        self.state = state
+        self.events.append("state", state=state)
+
+    @property
+    def succeeded(self) -> bool:
+        return bool(self.result) and self.result.startswith("成功")
+
+    @property
+    def cancelled(self) -> bool:
+        return bool(self.result) and self.result.startswith(JOB_CANCELLED_PREFIX)
+
+    def arm_deadline(self) -> None:
+        """开始执行时确定截止时间: 执行时间 (立即执行则为当前时间) + deadline_seconds。"""
+        fire_ts = self.start_dt.timestamp() if self.start_dt else time.time()
+        self.cancel_token.deadline = max(fire_ts, time.time()) + self.deadline_seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        """可序列化的任务信息 (不包含完整 Cookie)。"""
+        started, finished = self.timings["started_at"], self.timings["finished_at"]
+        return {
+            "job_id": self.job_id, "name": self.name, "mode": self.mode, "lib_id": self.lib_id,
+            "room": self.mappings.room_name(self.lib_id),
+            "seats": [{"number": number, "key": key} for number, key in self.seat_targets],
+            "fire_at": self.start_dt.isoformat(timespec='milliseconds') if self.start_dt else None,
+            "stagger_ms": self.stagger_ms, "fire_lead_ms": self.fire_lead_ms, "fire_decision": self.fire_decision,
+            "state": self.state, "result": self.result, "succeeded": self.succeeded, "cancelled": self.cancelled,
+            "deadline_s": self.deadline_seconds, "profile": self.profile,
+            "timings": dict(self.timings),
+            "duration_s": round(finished - started, 3) if started and finished else None,
+            "attempts": list(self.attempts),
+        }
+
+
+def run_seat_job(job: SeatJob) -> str:
+    """
+    执行一个座位任务，记录每个候选座位的尝试结果、耗时和主操作的发出时间偏移。
+    job.fire_lead_ms > 0 时第一个座位提前发出；若因此收到 "不在预约时间内"，在计划时间重试一次同一座位。
+    """
+    log_context = _log_job_id.set(job.job_id)
+    recorder = ExchangeRecorder(job, job.transport) if job.recording else None
+    if recorder: job.transport = recorder
+    result: Optional[str] = None
+    try:
+        result = profile_job(job, _run_seat_targets) if job.profiling else _run_seat_targets(job)
+        return result
+    finally:
+        if recorder: job.transport = recorder.inner; recorder.save(result)
+        _log_job_id.reset(log_context)
+
+
+def _run_seat_targets(job: SeatJob) -> str:
+    start_dt = job.start_dt
+    if start_dt and job.fire_lead_ms:
+        start_dt = job.start_dt - datetime.timedelta(milliseconds=job.fire_lead_ms)
+        job.report_status(f"提前 {job.fire_lead_ms:.0f} ms 发出 ({(job.fire_decision or {}).get('reason', '手动设置')})")
+    result = "未执行: 没有候选座位"
+    targets = list(job.seat_targets); index = 0
+    while index < len(targets):
+        seat_number, seat_key = targets[index]
+        if job.cancel_token.cancelled: return job.cancel_token.message()
+        attempt_start = time.time(); metrics: Dict[str, Any] = {}
+        lead_ms = job.fire_lead_ms if start_dt and start_dt != job.start_dt else 0
+        result = perform_seat_operation(job.mode, job.cookie, job.lib_id, seat_key, start_dt, job.report_status, job.cancel_token, metrics, job.transport)
+        attempt = {"seat": seat_number, "key": seat_key, "result": result, "lead_ms": lead_ms, "first_attempt": not job.attempts,
+                   "started_at": attempt_start, "elapsed_s": round(time.time() - attempt_start, 3)}
+        if "mutation_sent_at" in metrics:
+            # 相对于任务计划执行时间 (而非本座位的开始时间)，后续备选座位的偏移包含前面座位的耗时
+            attempt["fire_offset_ms"] = round((metrics["mutation_sent_at"] - (job.start_dt.timestamp() if job.start_dt else attempt_start)) * 1000, 1)
+            attempt["latency_ms"] = round(metrics["mutation_latency_s"] * 1000, 1)
+        job.attempts.append(attempt)
+        if OUTCOME_RECORDING and "mutation_sent_at" in metrics:
+            try: get_outcome_store().record(job, attempt, metrics.get("mutation_error", ""))
+            except (sqlite3.Error, OSError) as e: log.warning(f"记录尝试结果失败: {e}")
+        if lead_ms and classify_outcome(result) == "too_early" and time.time() < job.start_dt.timestamp() + 2:
+            job.report_status(f"提前 {lead_ms:.0f} ms 过早，在计划时间重试座位 {seat_number}")
+            start_dt = job.start_dt; continue
+        if result != SEAT_TAKEN_ERROR_CODE: break
+        start_dt = None; index += 1 # 候选座位被占后，下一个座位立即尝试
+    return result
+
+
+# --- Job Profiling ---
+class StackSampler:
+    """
+    采样分析器：后台线程每隔 interval 秒记录一次目标线程的调用栈 (包括阻塞在网络 IO、sleep 或等待 GIL 的位置)，
+    结果按 "外层;...;内层 次数" 的折叠格式输出，可直接用 flamegraph.pl / speedscope 查看。
+    """
+    def __init__(self, thread_id: int, interval: float = JOB_PROFILE_SAMPLE_INTERVAL):
+        self.thread_id, self.interval = thread_id, interval
+        self.stacks: collections.Counter = collections.Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="job-profiler", daemon=True)
+
+    def start(self) -> None: self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set(); self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None: continue
+            stack = []
+            while frame is not None and len(stack) < 128:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1; self.samples += 1
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common(): f.write(f"{stack} {count}\n")
+
+
+def profile_job(job: SeatJob, run: Callable[[SeatJob], str]) -> str:
+    """
+    在性能分析器下执行任务，把结果写入 JOB_PROFILE_DIR/<job_id>.prof (或 .folded)，
+    并在 job.profile 中记录墙钟时间、本线程 CPU 时间和两者之差 (网络等待、sleep、GIL 等待)。
+    """
+    import cProfile
+    profiler = cProfile.Profile() if JOB_PROFILER != "sample" else None
+    sampler = StackSampler(threading.get_ident()) if profiler is None else None
+    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+    if profiler: profiler.enable()
+    else: sampler.start()
+    try:
+        return run(job)
+    finally:
+        if profiler: profiler.disable()
+        else: sampler.stop()
+        wall, cpu = time.perf_counter() - wall_start, time.thread_time() - cpu_start
+        fire_ts = job.start_dt.timestamp() - job.fire_lead_ms / 1000 if job.start_dt else None
+        path = os.path.join(JOB_PROFILE_DIR, f"{job.job_id}.{'prof' if profiler else 'folded'}")
+        job.profile = {"profiler": "cprofile" if profiler else "sample", "file": os.path.basename(path),
+                       "wall_s": round(wall, 4), "cpu_s": round(cpu, 4), "off_cpu_s": round(max(0.0, wall - cpu), 4),
+                       "countdown_s": round(max(0.0, min(wall, fire_ts - (time.time() - wall))), 4) if fire_ts else 0.0}
+        if sampler: job.profile["samples"] = sampler.samples
+        try:
+            os.makedirs(JOB_PROFILE_DIR, exist_ok=True)
+            if profiler: profiler.dump_stats(path)
+            else: sampler.write(path)
+            log.info(f"性能分析: 墙钟 {wall:.3f} s (其中倒计时 {job.profile['countdown_s']:.3f} s), CPU {cpu:.3f} s -> {path}", extra={"step": "profile"})
+        except OSError as e:
+            job.profile["file"] = None; log.warning(f"无法写入性能分析文件 {path}: {e}", extra={"step": "profile"})
+
+
+def find_profile_file(job_id: str) -> Optional[str]:
+    """返回任务的性能分析文件路径 (不存在时返回 None)；job_id 只允许字母、数字、下划线和连字符。"""
+    if not re.fullmatch(r"[\w-]+", job_id): return None
+    for extension in ("prof", "folded"):
+        path = os.path.join(JOB_PROFILE_DIR, f"{job_id}.{extension}")
+        if os.path.isfile(path): return path
+    return None
+
+
+class JobStore:
+    """
+    基于 SQLite (WAL 模式) 的任务持久化存储，服务器重启后可恢复未完成的任务。
+    save() 只把任务快照放入队列，由后台线程批量写入并统一提交，执行时刻不会被磁盘 IO 阻塞。
+    """
+    _COLUMNS = ("job_id", "name", "mode", "cookie", "lib_id", "seat_targets", "fire_at",
+                "state", "result", "attempts", "timings", "deadline_seconds", "stagger_ms", "profiling", "recording", "updated_at")
+
+    def __init__(self, db_path: str = JOB_DB_PATH, flush_interval: float = JOB_STORE_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Optional[Tuple[Any, ...]]]" = queue.Queue()
+        conn = self._connect()
+        conn.execute(f"""CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY, name TEXT, mode INTEGER, cookie TEXT, lib_id INTEGER,
+            seat_targets TEXT, fire_at REAL, state TEXT, result TEXT, attempts TEXT, timings TEXT,
+            deadline_seconds REAL, stagger_ms INTEGER, profiling INTEGER, recording INTEGER, updated_at REAL)""")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, column_type in (("deadline_seconds", "REAL"), ("stagger_ms", "INTEGER"), ("profiling", "INTEGER"), ("recording", "INTEGER")):
+            if column not in columns: conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}") # 旧版本数据库补充新列
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state)")
+        conn.commit(); conn.close()
+        self._writer = threading.Thread(target=self._write_loop, name="job-store-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL") # WAL 下 NORMAL 已能保证崩溃后数据库一致
+        return conn
+
+    def save(self, job: "SeatJob") -> None:
+        """把任务当前状态加入写队列 (非阻塞)。"""
+        self._queue.put((
+            job.job_id, job.name, job.mode, job.cookie, job.lib_id, json.dumps(job.seat_targets, ensure_ascii=False),
+            job.start_dt.timestamp() if job.start_dt else None, job.state, job.result,
+            json.dumps(job.attempts, ensure_ascii=False), json.dumps(job.timings),
+            job.deadline_seconds, job.stagger_ms, int(job.profiling), int(job.recording), time.time(),
+        ))
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        placeholders = ", ".join("?" for _ in self._COLUMNS)
+        sql = f"INSERT OR REPLACE INTO jobs ({', '.join(self._COLUMNS)}) VALUES ({placeholders})"
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.flush_interval
+            # 在一个刷新周期内尽量收集更多写入，合并为一次提交
+            while batch[-1] is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0: break
+                try: batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty: break
+            rows = [row for row in batch if row is not None]
+            if rows:
+                try:
+                    with conn: conn.executemany(sql, rows)
+                except sqlite3.Error as e: print(f"任务存储写入失败 ({len(rows)} 条): {e}")
+            for _ in batch: self._queue.task_done()
+            if batch[-1] is None: conn.close(); return
+
+    def flush(self) -> None:
+        """等待队列中所有写入完成。"""
+        self._queue.join()
+
+    def close(self) -> None:
+        self._queue.put(None); self._writer.join(timeout=5)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """按 id 读取单个任务记录。"""
+        conn = self._connect(); conn.row_factory = sqlite3.Row
+        try: row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        finally: conn.close()
+        return dict(row) if row else None
+
+    def load(self, states: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """读取任务记录，可按状态过滤。"""
+        conn = self._connect(); conn.row_factory = sqlite3.Row
+        try:
+            if states:
+                rows = conn.execute(f"SELECT * FROM jobs WHERE state IN ({', '.join('?' for _ in states)}) ORDER BY fire_at", states).fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM jobs ORDER BY fire_at").fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+
+def job_from_record(record: Dict[str, Any]) -> SeatJob:
+    """根据 JobStore (或共享任务表) 中的记录重建 SeatJob；fire_at 已包含调度器加上的错开量 stagger_ms。"""
+    fire_at = record.get("fire_at")
+    job = SeatJob(int(record["mode"]), record["cookie"], int(record["lib_id"]),
+                  [tuple(target) for target in json.loads(record["seat_targets"] or "[]")],
+                  datetime.datetime.fromtimestamp(fire_at) if fire_at else None,
+                  name=record.get("name"), job_id=record["job_id"],
+                  deadline_seconds=record.get("deadline_seconds") or JOB_DEADLINE_SECONDS)
+    job.stagger_ms = record.get("stagger_ms") or 0
+    if record.get("profiling") is not None: job.profiling = bool(record["profiling"])
+    if record.get("recording") is not None: job.recording = bool(record["recording"])
+    job.attempts = json.loads(record.get("attempts") or "[]")
+    job.timings.update(json.loads(record.get("timings") or "{}"))
+    return job
+
+
+class AdmissionError(Exception):
+    """任务未被接纳：容量已满 (429) 或与已有任务冲突 (409)。retry_after 为建议的重试秒数。"""
+    def __init__(self, message: str, status_code: int = 429, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def job_dedup_key(job: SeatJob, seat_key: Optional[str] = None) -> Tuple[int, str, int]:
+    """任务去重键 (lib_id, seat_key, 执行时刻 [秒，不含错开量])，立即执行的任务按当前秒计算。"""
+    fire_ts = job.start_dt.timestamp() - job.stagger_ms / 1000 if job.start_dt else time.time()
+    return job.lib_id, seat_key or job.seat_targets[0][1], int(fire_ts)
+
+
+class JobScheduler:
+    """
+    共享的任务调度器：按执行时间排序的堆 + 单个派发线程 + 工作线程池。
+    任务在执行时间前 prewarm_seconds 秒交给工作线程，由 perform_seat_operation 完成精确倒计时，
+    避免大量线程长时间空等。
+    """
+    def __init__(self, max_workers: int = JOB_MAX_WORKERS, prewarm_seconds: float = JOB_PREWARM_SECONDS,
+                 store: Optional[JobStore] = None, max_running: Optional[int] = None,
+                 max_scheduled: Optional[int] = None, stagger_ms: int = JOB_STAGGER_MS,
+                 runner: Optional[Callable[[SeatJob], str]] = None, retention_seconds: float = JOB_RETENTION_SECONDS):
+        self.prewarm_seconds = prewarm_seconds
+        self.store = store
+        self.runner = runner or run_seat_job # 执行单个任务并返回结果，可替换为 ProcessJobPool
+        self.max_running = max_running # None 表示不限制
+        self.max_scheduled = max_scheduled
+        self.stagger_ms = stagger_ms
+        self.retention_seconds = retention_seconds
+        self.jobs: Dict[str, SeatJob] = {} # 未结束及最近 retention_seconds 秒内结束的任务
+        self._finished: Deque[Tuple[float, SeatJob]] = collections.deque() # (结束时间, 任务)，按结束顺序淘汰
+        self._live: Dict[str, SeatJob] = {} # 尚未结束的任务 (scheduled/running)
+        self._seat_claims: Dict[Tuple[int, str, int], SeatJob] = {} # 去重键 -> 占用该座位/时刻的任务
+        self._fire_slots: Dict[int, int] = collections.Counter() # 执行时刻 (秒) -> 已安排的任务数
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="seat-job")
+        self._heap: List[Tuple[float, int, SeatJob]] = []
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="job-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, job: SeatJob) -> SeatJob:
+        return self.submit_many([job])[0]
+
+    def _admit(self, jobs: List[SeatJob], now_ts: float) -> List[SeatJob]:
+        """
+        准入控制 (调用方持有锁)：检查容量，合并重复任务，返回实际需要入队的任务列表。
+        同一账号对同一 (阅览室, 首选座位, 时刻) 的重复提交，候选座位完全相同时合并到已有任务，否则拒绝 (409)；
+        其他账号抢同一座位时，将该座位移到候选列表末尾，没有其他候选则拒绝 (409)。
+        任何一个任务被拒绝时整批都不入队。
+        """
+        accepted: List[SeatJob] = []; pending_claims: Dict[Tuple[int, str, int], SeatJob] = {}
+        for job in jobs:
+            claims = {**self._seat_claims, **pending_claims}
+            existing = claims.get(job_dedup_key(job))
+            if existing is not None and existing.cookie == job.cookie:
+                if existing.mode != job.mode or list(existing.seat_targets) != list(job.seat_targets):
+                    raise AdmissionError("该账号在同一时刻已有首选相同座位但候选座位不同的任务，请先取消已有任务。", status_code=409)
+                job.coalesced_into = existing; continue
+            contended = [target for target in job.seat_targets if job_dedup_key(job, target[1]) in claims]
+            if contended:
+                if len(contended) == len(job.seat_targets):
+                    seats = "、".join(number if number != "未知" else key for number, key in contended)
+                    raise AdmissionError(f"座位 {seats} 在同一时刻已有其他任务，请选择其他座位。", status_code=409)
+                job.seat_targets = [t for t in job.seat_targets if t not in contended] + contended
+            pending_claims[job_dedup_key(job)] = job
+            accepted.append(job)
+
+        if self.max_scheduled is not None and len(self._live) + len(accepted) > self.max_scheduled:
+            next_fire = min((j.start_dt.timestamp() for j in self._live.values() if j.start_dt), default=now_ts)
+            raise AdmissionError(f"任务队列已满 (上限 {self.max_scheduled})，请稍后重试。",
+                                 retry_after=max(1, int(next_fire - now_ts + JOB_TYPICAL_DURATION)))
+        if self.max_running is not None:
+            soon = lambda j: not j.start_dt or j.start_dt.timestamp() - now_ts <= self.prewarm_seconds
+            if sum(1 for j in self._live.values() if j.state == "running" or soon(j)) + sum(1 for j in accepted if soon(j)) > self.max_running:
+                raise AdmissionError(f"同时执行的任务已达上限 ({self.max_running})，请稍后重试。", retry_after=JOB_TYPICAL_DURATION)
+        return accepted
+
+    def _stagger(self, job: SeatJob, restored: bool = False) -> None:
+        """同一秒内执行的任务依次错开 stagger_ms 毫秒 (调用方持有锁)。恢复的任务保留原有的错开量，只登记所在时刻。"""
+        if not job.start_dt: return
+        if restored: self._fire_slots[int(job.start_dt.timestamp() - job.stagger_ms / 1000)] += 1; return
+        if not self.stagger_ms: return
+        slot = int(job.start_dt.timestamp())
+        index = self._fire_slots[slot]; self._fire_slots[slot] += 1
+        if index:
+            job.stagger_ms = index * self.stagger_ms
+            job.start_dt += datetime.timedelta(milliseconds=job.stagger_ms)
+
+    def submit_many(self, jobs: List[SeatJob], restored: bool = False) -> List[SeatJob]:
+        """
+        一次性提交多个任务 (在同一把锁内准入并入队，要么全部接纳，要么抛出 AdmissionError)。
+        返回与输入对应的任务列表；被合并的重复任务返回已有任务 (job.coalesced_into)。
+        restored 表示从任务存储恢复的任务，执行时间已经错开过，不再重复错开。
+        """
+        with self._cond:
+            if self._closed: raise RuntimeError("调度器已关闭")
+            now_ts = time.time()
+            accepted = self._admit(jobs, now_ts)
+            for job in accepted:
+                self._seat_claims[job_dedup_key(job)] = job
+                self._stagger(job, restored)
+                self._live[job.job_id] = job
+                job.set_state("scheduled"); job.timings["submitted_at"] = now_ts
+                dispatch_ts = job.start_dt.timestamp() - self.prewarm_seconds if job.start_dt else now_ts
+                self._seq += 1
+                heapq.heappush(self._heap, (dispatch_ts, self._seq, job))
+                self.jobs[job.job_id] = job
+                if self.store: self.store.save(job)
+            self._cond.notify()
+        return [job.coalesced_into or job for job in jobs]
+
+    def _release(self, job: SeatJob) -> None:
+        """任务结束后释放其占用的容量和座位 (调用方持有锁)。"""
+        self._live.pop(job.job_id, None)
+        for key, claimant in list(self._seat_claims.items()):
+            if claimant is job: del self._seat_claims[key]
+        if job.start_dt:
+            slot = int(job.start_dt.timestamp() - job.stagger_ms / 1000)
+            self._fire_slots[slot] -= 1
+            if self._fire_slots[slot] <= 0: del self._fire_slots[slot]
+
+    def _retire(self, job: SeatJob) -> None:
+        """登记已结束的任务，并从 jobs 中淘汰结束超过 retention_seconds 的任务 (调用方持有锁)。"""
+        now_ts = time.time()
+        self._finished.append((job.timings.get("finished_at", now_ts), job))
+        while self._finished and self._finished[0][0] <= now_ts - self.retention_seconds:
+            _, old = self._finished.popleft()
+            if self.jobs.get(old.job_id) is old: del self.jobs[old.job_id]
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed and (not self._heap or self._heap[0][0] > time.time()):
+                    self._cond.wait(self._heap[0][0] - time.time() if self._heap else None)
+                if self._closed: return
+                _, _, job = heapq.heappop(self._heap)
+                if job.state != "scheduled": continue # 已在等待期间被取消
+                job.set_state("running") # 持锁切换状态，cancel() 据此区分排队中/执行中
+            job.timings["dispatched_at"] = time.time()
+            self._executor.submit(self._run_job, job)
+
+    def _run_job(self, job: SeatJob) -> None:
+        job.timings["started_at"] = time.time()
+        job.arm_deadline()
+        if ADAPTIVE_FIRE_OFFSET and OUTCOME_RECORDING and job.start_dt and job.fire_decision is None:
+            try:
+                store = get_outcome_store()
+                job.fire_decision = store.decide_fire_lead(job.mode, outcome_window(job.start_dt))
+                job.fire_lead_ms = job.fire_decision["lead_ms"]
+                store.record_decision(job, job.fire_decision)
+            except (sqlite3.Error, OSError) as e: log.warning(f"[Job {job.name}] 无法计算提前量，按计划时间执行: {e}", extra={"job": job.job_id})
+        if self.store: self.store.save(job)
+        try:
+            job.result = self.runner(job)
+        except Exception as e:
+            job.result = f"发生未知错误: {type(e).__name__} - {e}"
+            log.error(f"[Job {job.name}] {job.result}", exc_info=True, extra={"job": job.job_id})
+        finally:
+            with self._cond: self._release(job)
+            self._finish(job)
+
+    def _finish(self, job: SeatJob) -> None:
+        """标记任务结束：记录结果事件、持久化并执行完成回调。"""
+        job.set_state("done"); job.timings["finished_at"] = time.time()
+        job.events.append("result", job_id=job.job_id, **job_result_payload(job))
+        if self.store: self.store.save(job)
+        with self._cond: self._retire(job)
+        job.done_event.set()
+        for callback in job.done_callbacks:
+            try: callback(job)
+            except Exception as cb_err: log.warning(f"[Job {job.name}] 完成回调出错: {cb_err}", extra={"job": job.job_id})
+
+    def cancel(self, job_id: str, reason: str = "用户取消") -> Optional[SeatJob]:
+        """
+        取消任务。排队中的任务立即结束并释放容量；执行中的任务触发取消令牌，
+        由工作线程在下一个检查点 (倒计时、重试等待、排队 WebSocket) 退出。
+        任务不存在返回 None；已结束的任务原样返回。
+        """
+        with self._cond:
+            job = self.jobs.get(job_id)
+            if job is None or job.state == "done": return job
+            was_scheduled = job.state == "scheduled"
+            if was_scheduled:
+                self._release(job) # 堆中的条目在派发时跳过
+                job.state = "cancelling"
+        job.cancel_token.cancel(reason)
+        if was_scheduled:
+            job.result = job.cancel_token.message()
+            job.report_status(f"❌ {job.result}")
+            self._finish(job)
+        return job
+
+    def cancel_all(self, reason: str = "用户取消") -> int:
+        """取消所有未结束的任务，返回取消的任务数。"""
+        with self._cond: job_ids = list(self._live)
+        for job_id in job_ids: self.cancel(job_id, reason)
+        return len(job_ids)
+
+    def wait_all(self, jobs: Optional[List[SeatJob]] = None, timeout: Optional[float] = None) -> bool:
+        """等待任务全部结束，超时返回 False。jobs 为 None 时等待调度器中当前未淘汰的任务。"""
+        deadline = time.time() + timeout if timeout is not None else None
+        for job in (jobs if jobs is not None else list(self.jobs.values())):
+            remaining = None if deadline is None else max(0.0, deadline - time.time())
+            if not job.done_event.wait(remaining): return False
+        return True
+
+    def restore_pending(self) -> Tuple[int, int]:
+        """
+        从任务存储中重新载入未完成的任务 (scheduled/running)。
+        执行时间已过超过 JOB_RESTORE_GRACE_SECONDS 的任务标记为过期；服务器停止时正在执行且可能已经发出请求
+        (已到执行时间减去最大提前量) 的任务结果未知，同样标记为完成，不重新执行。返回 (恢复数, 过期或结果未知数)。
+        """
+        if not self.store: return 0, 0
+        restored: List[SeatJob] = []; expired = 0
+        now_ts = time.time()
+        for record in self.store.load(states=["scheduled", "running"]):
+            if record["job_id"] in self.jobs: continue
+            job = job_from_record(record)
+            fire_ts = job.start_dt.timestamp() if job.start_dt else record.get("updated_at") or 0
+            if record["state"] == "running" and not (job.start_dt and fire_ts - FIRE_LEAD_MAX_MS / 1000 > now_ts):
+                job.result = "服务器停止时任务正在执行，结果未知，未重新执行。"
+            elif fire_ts < now_ts - JOB_RESTORE_GRACE_SECONDS:
+                job.result = "服务器重启时任务已过期，未执行。"
+            else:
+                restored.append(job); continue
+            job.set_state("done")
+            job.events.append("result", job_id=job.job_id, **job_result_payload(job))
+            job.timings["finished_at"] = now_ts
+            self.store.save(job); expired += 1
+            with self._cond: self.jobs[job.job_id] = job; self._retire(job)
+        if restored: self.submit_many(restored, restored=True)
+        return len(restored), expired
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._cond:
+            self._closed = True; self._cond.notify_all()
+        self._executor.shutdown(wait=wait)
+        if hasattr(self.runner, "close"): self.runner.close()
+        if self.store: self.store.flush()
+
+
+class _WorkerResultForwarder:
+    """
+    工作进程中代替 OutcomeStore 和 SeatMapLearner：尝试结果和收到的座位布局经 event_queue 交给主进程，
+    outcomes.db 和座位图文件 (含 .manifest.json) 只由主进程写入，多个工作进程之间不需要加锁。
+    """
+    def __init__(self, event_queue: Any):
+        self.event_queue = event_queue
+
+    def record(self, job: SeatJob, attempt: Dict[str, Any], message: str = "") -> None:
+        self.event_queue.put(("outcome", job.job_id, attempt, message))
+
+    def observe(self, lib_id: int, layout: Any) -> None:
+        if LEARN_SEAT_MAPS: self.event_queue.put(("layout", lib_id, layout))
+
+
+def _job_worker_main(worker_index: int, task_queue: Any, event_queue: Any, max_threads: int) -> None:
+    """
+    工作进程入口：从 task_queue 接收任务，用本进程自己的连接池执行，
+    状态消息、尝试结果和结果通过 event_queue 发回主进程。
+    """
+    global _outcome_store, seat_map_learner
+    live_jobs: Dict[str, SeatJob] = {}
+    futures: Dict[str, Future] = {} # 已提交但尚未结束的任务，退出时取消其中还没开始执行的
+    lock = threading.Lock()
+    executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix=f"worker{worker_index}-job")
+    get_http_session() # 预先创建本进程的连接池
+    load_mappings() # spawn 出的进程不继承主进程已加载的映射，状态消息中的阅览室名称和座位号需要本进程的快照
+    _outcome_store = seat_map_learner = _WorkerResultForwarder(event_queue) # type: ignore[assignment]
+
+    def run(job: SeatJob) -> None:
+        try: result = run_seat_job(job)
+        except Exception as e: result = f"发生未知错误: {type(e).__name__} - {e}"; traceback.print_exc()
+        with lock: live_jobs.pop(job.job_id, None); futures.pop(job.job_id, None)
+        event_queue.put(("done", job.job_id, result, job.attempts, job.profile))
+
+    while True:
+        message = task_queue.get()
+        if message is None: break
+        if message[0] == "run":
+            spec = message[1]
+            MAPPING_REGISTRY.reload() # 映射文件 (如主进程学习到的新座位图) 有变化时更新本进程的快照
+            job = SeatJob(spec["mode"], spec["cookie"], spec["lib_id"], [tuple(t) for t in spec["seat_targets"]],
+                          datetime.datetime.fromtimestamp(spec["fire_at"]) if spec["fire_at"] else None,
+                          name=spec["name"], job_id=spec["job_id"])
+            job.cancel_token.deadline = spec["deadline"]
+            job.fire_lead_ms, job.fire_decision = spec["fire_lead_ms"], spec["fire_decision"]
+            job.profiling, job.recording = spec["profiling"], spec["recording"]
+            job.status_callbacks.append(lambda msg, job_id=job.job_id: event_queue.put(("status", job_id, msg)))
+            with lock: live_jobs[job.job_id] = job; futures[job.job_id] = executor.submit(run, job)
+        elif message[0] == "cancel":
+            with lock: job = live_jobs.get(message[1])
+            if job: job.cancel_token.cancel(message[2])
+    with lock: pending = list(futures.values())
+    for future in pending: future.cancel() # 与 shutdown(cancel_futures=True) 相同，但该参数需要 Python 3.9
+    executor.shutdown(wait=False)
+
+
+class ProcessJobPool:
+    """
+    多进程执行模式：任务按 Cookie 固定路由到 N 个工作进程之一 (同一账号复用该进程中的热连接)，
+    状态消息经 IPC 队列回传，由主进程写入任务事件日志并转发给 WebSocket；
+    尝试结果和座位布局也经同一队列回传，由主进程写入 outcomes.db 和座位图。
+    作为 JobScheduler 的 runner 使用；调度、准入和持久化仍在主进程中完成。
+    """
+    def __init__(self, processes: int, threads_per_process: int = JOB_MAX_WORKERS):
+        self.threads_per_process = threads_per_process
+        self._ctx = multiprocessing.get_context("spawn") # 主进程已有多个线程，不能安全 fork
+        self._event_queue = self._ctx.Queue()
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Tuple[SeatJob, threading.Event, List[Any]]] = {}
+        self._workers = [self._spawn(index) for index in range(max(1, processes))]
+        self._listener = threading.Thread(target=self._listen_loop, name="job-worker-events", daemon=True)
+        self._listener.start()
+
+    def _spawn(self, index: int) -> Tuple[Any, Any]:
+        task_queue = self._ctx.Queue()
+        process = self._ctx.Process(target=_job_worker_main, name=f"{JOB_WORKER_PROCESS_PREFIX}-{index}", daemon=True,
+                                    args=(index, task_queue, self._event_queue, self.threads_per_process))
+        process.start()
+        return process, task_queue
+
+    def worker_for(self, cookie: str) -> int:
+        """同一 Cookie 总是路由到同一个工作进程 (crc32 在不同进程间稳定，不受 hash 随机化影响)。"""
+        return zlib.crc32(cookie.encode('utf-8')) % len(self._workers)
+
+    def __call__(self, job: SeatJob) -> str:
+        index = self.worker_for(job.cookie)
+        done, outcome = threading.Event(), []
+        with self._lock:
+            process, task_queue = self._workers[index]
+            if not process.is_alive():
+                print(f"工作进程 {index} 已退出，正在重新启动。")
+                process, task_queue = self._workers[index] = self._spawn(index)
+            self._pending[job.job_id] = (job, done, outcome)
+        task_queue.put(("run", {
+            "job_id": job.job_id, "name": job.name, "mode": job.mode, "cookie": job.cookie, "lib_id": job.lib_id,
+            "seat_targets": job.seat_targets, "fire_at": job.start_dt.timestamp() if job.start_dt else None,
+            "deadline": job.cancel_token.deadline, "fire_lead_ms": job.fire_lead_ms, "fire_decision": job.fire_decision,
+            "profiling": job.profiling, "recording": job.recording,
+        }))
+        forward_cancel = lambda: task_queue.put(("cancel", job.job_id, job.cancel_token.reason))
+        job.cancel_token.on_cancel(forward_cancel)
+        try:
+            while not done.wait(1.0):
+                if not process.is_alive(): return f"发生未知错误: 工作进程 {index} 异常退出 (exitcode={process.exitcode})"
+            result, job.attempts, profile = outcome
+            if profile: job.profile = profile
+            return result
+        finally:
+            job.cancel_token.remove_callback(forward_cancel)
+            with self._lock: self._pending.pop(job.job_id, None)
+
+    def _listen_loop(self) -> None:
+        while True:
+            message = self._event_queue.get()
+            if message is None: return
+            if message[0] == "layout": seat_map_learner.observe(message[1], message[2]); continue
+            with self._lock: pending = self._pending.get(message[1])
+            if not pending: continue
+            job, done, outcome = pending
+            if message[0] == "status": job.report_status(message[2])
+            elif message[0] == "outcome":
+                try: get_outcome_store().record(job, message[2], message[3])
+                except (sqlite3.Error, OSError) as e: log.warning(f"记录尝试结果失败: {e}", extra={"job": job.job_id})
+            elif message[0] == "done": outcome[:] = message[2:5]; done.set()
+
+    def close(self) -> None:
+        for process, task_queue in self._workers: task_queue.put(None)
+        for process, _ in self._workers:
+            process.join(timeout=5)
+            if process.is_alive(): process.terminate()
+        self._event_queue.put(None)
+
+
+_job_scheduler: Optional[JobScheduler] = None
+_job_scheduler_lock = threading.Lock()
+
+def get_job_scheduler() -> JobScheduler:
+    """返回进程内共享的任务调度器 (首次调用时创建，使用 JOB_DB_PATH 持久化任务，JOB_WORKER_PROCESSES > 0 时在工作进程中执行)。"""
+    global _job_scheduler
+    if _job_scheduler is None:
+        with _job_scheduler_lock:
+            if _job_scheduler is None:
+                store = None
+                try: store = JobStore(JOB_DB_PATH)
+                except sqlite3.Error as e: print(f"警告: 无法打开任务数据库 {JOB_DB_PATH}，任务将不会持久化: {e}")
+                runner = ProcessJobPool(JOB_WORKER_PROCESSES) if JOB_WORKER_PROCESSES > 0 else None
+                _job_scheduler = JobScheduler(store=store, max_running=MAX_RUNNING_JOBS, max_scheduled=MAX_SCHEDULED_JOBS, runner=runner)
+    return _job_scheduler
+
+
+# --- Seat Spatial Index ---
+parse_seat_key = mapping_bundle.parse_seat_key # 座位 Key "y,x" (可能带结尾的 ".") -> (x, y)，与映射包中的坐标一致
+
+
+class SeatGridIndex:
+    """
+    阅览室座位的网格分桶空间索引。座位按坐标放入 cell×cell 的桶中：
+    最近邻查询从目标所在的桶开始逐圈向外扩展，找够 n 个且下一圈不可能更近时停止；
+    矩形查询只检查矩形覆盖到的桶。
+    """
+    def __init__(self, seats: List[Tuple[str, str, int, int]], cell: int = SEAT_INDEX_CELL_SIZE):
+        self.cell = cell
+        self.seats = seats # [(座位号, 座位 Key, x, y), ...]
+        self.by_number = {number: i for i, (number, _, _, _) in enumerate(seats)}
+        self.by_key = {key: i for i, (_, key, _, _) in enumerate(seats)}
+        self._buckets: Dict[Tuple[int, int], List[int]] = collections.defaultdict(list)
+        for i, (_, _, x, y) in enumerate(seats): self._buckets[(x // cell, y // cell)].append(i)
+        self._buckets = dict(self._buckets)
+        bucket_xs = [bx for bx, _ in self._buckets] or [0]; bucket_ys = [by for _, by in self._buckets] or [0]
+        self._bounds = (min(bucket_xs), min(bucket_ys), max(bucket_xs), max(bucket_ys))
+
+    @classmethod
+    def from_seat_map(cls, seat_map: Dict[str, str], cell: int = SEAT_INDEX_CELL_SIZE) -> "SeatGridIndex":
+        """由座位图 { 座位号: 座位 Key } 建立索引。"""
+        seats = [(number, key, *xy) for number, key in seat_map.items() if (xy := parse_seat_key(key))]
+        return cls(seats, cell)
+
+    @classmethod
+    def from_layout_seats(cls, seats: List[Dict[str, Any]], cell: int = SEAT_INDEX_CELL_SIZE) -> "SeatGridIndex":
+        """由 summarize_layout 的座位列表建立索引 (使用 libLayout 返回的 x/y)。"""
+        return cls([(str(seat["name"]), seat["key"], int(seat["x"]), int(seat["y"]))
+                    for seat in seats if seat.get("x") is not None and seat.get("y") is not None], cell)
+
+    def locate(self, seat: str) -> Optional[Tuple[str, str, int, int]]:
+        """按座位号或座位 Key 查找座位。"""
+        i = self.by_number.get(seat)
+        if i is None: i = self.by_key.get(seat)
+        return self.seats[i] if i is not None else None
+
+    def nearest(self, x: int, y: int, n: int, accept: Optional[Callable[[str], bool]] = None,
+                exclude: Optional[set] = None) -> List[Tuple[str, str, int, int, float]]:
+        """
+        返回距 (x, y) 最近的 n 个座位 [(座位号, Key, x, y, 距离)]，按距离升序。
+        accept(key) 返回 False 的座位 (如已被占用) 和 exclude 中的 Key 不计入。
+        """
+        if n <= 0: return []
+        cx, cy = x // self.cell, y // self.cell
+        min_bx, min_by, max_bx, max_by = self._bounds
+        max_ring = max(cx - min_bx, max_bx - cx, cy - min_by, max_by - cy, 0)
+        found: List[Tuple[int, int]] = []; kth = None
+        buckets, seats = self._buckets, self.seats
+        for ring in range(max_ring + 1):
+            added = False
+            for bx in range(cx - ring, cx + ring + 1):
+                step = 1 if abs(bx - cx) == ring else 2 * ring # 只遍历这一圈上的桶
+                for by in range(cy - ring, cy + ring + 1, step or 1):
+                    for i in buckets.get((bx, by), ()):
+                        _, key, sx, sy = seats[i]
+                        if (exclude and key in exclude) or (accept and not accept(key)): continue
+                        found.append(((sx - x) ** 2 + (sy - y) ** 2, i)); added = True
+            if len(found) >= n:
+                if added: kth = heapq.nsmallest(n, found)[-1][0]
+                if kth <= (ring * self.cell) ** 2: break # 第 ring 圈之外的座位距离至少为 ring * cell
+        return [(*seats[i], round(d2 ** 0.5, 2)) for d2, i in heapq.nsmallest(n, found)]
+
+    def in_rect(self, x0: int, y0: int, x1: int, y1: int,
+                accept: Optional[Callable[[str], bool]] = None) -> List[Tuple[str, str, int, int]]:
+        """返回矩形 [x0, x1] × [y0, y1] 内的座位，按行、列排序。"""
+        x0, x1 = sorted((x0, x1)); y0, y1 = sorted((y0, y1))
+        result = []
+        for bx in range(x0 // self.cell, x1 // self.cell + 1):
+            for by in range(y0 // self.cell, y1 // self.cell + 1):
+                for i in self._buckets.get((bx, by), ()):
+                    _, key, sx, sy = self.seats[i]
+                    if x0 <= sx <= x1 and y0 <= sy <= y1 and (not accept or accept(key)): result.append(self.seats[i])
+        return sorted(result, key=lambda seat: (seat[3], seat[2]))
+
+
+def get_seat_index(room_name: str, mappings: Optional[MappingSnapshot] = None) -> Optional[SeatGridIndex]:
+    """返回由座位图建立的空间索引 (每个映射快照首次使用时构建)；没有座位图时返回 None。"""
+    mappings = mappings or current_mappings()
+    index = mappings.indexes.get(room_name)
+    if index is None and room_name in mappings.coords:
+        index = mappings.indexes[room_name] = SeatGridIndex(mappings.coords[room_name])
+    elif index is None and room_name in mappings.seats:
+        index = mappings.indexes[room_name] = SeatGridIndex.from_seat_map(mappings.seats[room_name])
+    return index
+
+
+# --- Seat Map Learning ---
+class SeatMapLearner:
+    """
+    从任务和实时座位状态查询已经收到的 libLayout 中学习 座位号 -> 座位 Key：
+    没有座位图的阅览室生成新的座位图，已有座位图的阅览室只补充缺少的座位号 (不修改已有条目)。
+    解析和写文件在后台线程中进行，不占用抢座的关键路径，也不会额外请求上游。
+    """
+    def __init__(self, output_dir: Optional[str] = None):
+        self.output_dir = output_dir # None 表示使用 SEAT_MAPPINGS_DIR
+        self._queue: "queue.Queue[Tuple[int, Any]]" = queue.Queue(maxsize=64)
+        self._seen: Dict[int, int] = {} # { lib_id: 上次处理的座位布局哈希 }，布局未变化时跳过
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def observe(self, lib_id: int, layout: Any) -> None:
+        """交给后台线程处理。layout 可以是 libLayout 字典或完整的响应文本；队列满时直接丢弃。"""
+        if not LEARN_SEAT_MAPS: return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="seat-map-learner", daemon=True); self._thread.start()
+        try: self._queue.put_nowait((lib_id, layout))
+        except queue.Full: pass
+
+    def flush(self) -> None:
+        self._queue.join()
+
+    def _run(self) -> None:
+        while True:
+            lib_id, layout = self._queue.get()
+            try: self.learn(lib_id, layout)
+            except Exception as e: print(f"根据座位布局生成阅览室 {lib_id} 的座位图失败: {type(e).__name__} - {e}")
+            finally: self._queue.task_done()
+
+    def learn(self, lib_id: int, layout: Any) -> int:
+        """处理一份座位布局，返回新写入座位图的座位数。"""
+        if isinstance(layout, str):
+            try: data = json.loads(layout)
+            except ValueError: return 0
+            layout = (((data.get("data") or {}).get("userAuth") or {}).get("prereserve") or {}).get("libLayout") if isinstance(data, dict) else None
+        if not isinstance(layout, dict): return 0
+        from data_process.seat import seat_json_convert # 与转换脚本使用相同的提取规则和输出格式
+        pairs = [pair for seat in layout.get("seats") or [] if (pair := seat_json_convert.seat_pair(seat))] # [(座位 Key, 座位号)]
+        layout_hash = hash(tuple(pairs))
+        if not pairs or self._seen.get(lib_id) == layout_hash: return 0
+        mappings = current_mappings(); room_name = mappings.rooms.get(str(lib_id))
+        if not room_name: return 0 # 座位图文件以阅览室名称命名，未知的阅览室即使写出也不会被加载
+        self._seen[lib_id] = layout_hash
+        if seat_json_convert.sanitize_filename(room_name) != room_name:
+            print(f"警告: 阅览室名称 '{room_name}' 不能直接用作文件名，无法自动生成座位图。"); return 0
+        existing = dict(mappings.seats.get(room_name) or {})
+        known_keys = {key.rstrip(".") for key in existing.values()}
+        new_pairs = [(key, number) for key, number in pairs if number not in existing and key.rstrip(".") not in known_keys]
+        if not new_pairs: return 0
+        output_dir = self.output_dir or SEAT_MAPPINGS_DIR
+        merged = [(key, number) for number, key in existing.items()] + new_pairs
+        entry = seat_json_convert.export_room({"lib_id": lib_id, "lib_name": room_name}, merged, 0, room_name, output_dir,
+                                              seat_json_convert.SUPPORTED_FORMATS, None, force=True)
+        manifest = seat_json_convert.load_manifest(output_dir)
+        manifest[str(lib_id)] = {**{k: v for k, v in entry.items() if k != "status"}, "source": "libLayout"}
+        seat_json_convert.save_manifest(output_dir, manifest)
+        print(f"已根据座位布局{'补充' if existing else '生成'} '{room_name}' 的座位图: 新增 {len(new_pairs)} 个座位，共 {entry['seats']} 个。")
+        MAPPING_REGISTRY.reload()
+        return len(new_pairs)
+
+
+seat_map_learner = SeatMapLearner()
+
+
+# --- Live Availability ---
+class TTLCache:
+    """
+    带过期时间的线程安全缓存，同一个 key 同时只有一个加载操作 (single-flight)：
+    缓存未命中时，并发的请求等待同一次加载的结果，而不是各自请求上游。加载失败不缓存。
+    """
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[Any, Tuple[float, Any]] = {} # key -> (过期时间, 值)
+        self._inflight: Dict[Any, Future] = {}
+        self.stats = {"hits": 0, "loads": 0, "joined": 0}
+
+    def put(self, key: Any, value: Any) -> None:
+        """直接写入缓存 (如后台记录器刚获取的新数据)。"""
+        with self._lock: self._entries[key] = (time.time() + self.ttl, value)
+
+    def peek(self, key: Any) -> Optional[Any]:
+        """返回未过期的缓存值 (不触发加载)。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry and entry[0] > time.time() else None
+
+    def get_or_load(self, key: Any, loader: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.time():
+                self.stats["hits"] += 1; return entry[1]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future(); self.stats["loads"] += 1
+            else: self.stats["joined"] += 1
+        if not owner: return future.result(timeout)
+        try:
+            value = loader()
+            with self._lock: self._entries[key] = (time.time() + self.ttl, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e); raise
+        finally:
+            with self._lock: self._inflight.pop(key, None)
+
+
+def fetch_lib_layout(cookie: str, lib_id: int, timeout: float = 10) -> Dict[str, Any]:
+    """请求单个阅览室的 libLayout，返回原始布局数据。失败时抛出 ValueError。"""
+    headers = pre_header_base.copy(); headers['Cookie'] = cookie
+    payload = json.loads(json.dumps(data_lib_chosen_template)); payload['variables']['libId'] = lib_id
+    try:
+        response = get_http_session().post(URL, headers=headers, json=payload, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        raise ValueError(f"获取阅览室 {lib_id} 座位布局失败: {e}")
+    layout = (((data.get("data") or {}).get("userAuth") or {}).get("prereserve") or {}).get("libLayout")
+    if not isinstance(layout, dict):
+        message = extract_error_msg(json.dumps(data, ensure_ascii=False))
+        if re.search(COOKIE_ERROR_PATTERN, message, re.IGNORECASE): message = f"Cookie失效或验证失败: {message}"
+        raise ValueError(f"阅览室 {lib_id} 未返回座位布局: {message}")
+    seat_map_learner.observe(lib_id, layout)
+    return layout
+
+
+def summarize_layout(lib_id: int, layout: Dict[str, Any]) -> Dict[str, Any]:
+    """把 libLayout 精简为座位统计和可选座位列表 (只保留 type 1 的座位)。status 为 true 表示已被占用或预约。"""
+    seats = [{"key": seat.get("key"), "name": seat.get("name"), "x": seat.get("x"), "y": seat.get("y"),
+              "seat_status": seat.get("seat_status"), "taken": bool(seat.get("status"))}
+             for seat in layout.get("seats") or [] if seat.get("type") == 1 and seat.get("name")]
+    return {
+        "lib_id": lib_id, "name": ROOM_ID_TO_NAME.get(str(lib_id), f"ID {lib_id}"),
+        "seats_total": layout.get("seats_total"), "seats_used": layout.get("seats_used"),
+        "seats_booking": layout.get("seats_booking"), "free": sum(1 for seat in seats if not seat["taken"]),
+        "max_x": layout.get("max_x"), "max_y": layout.get("max_y"),
+        "fetched_at": time.time(), "seats": seats,
+        # 以下划线开头的字段只在服务器内部使用，不返回给前端
+        "_index": SeatGridIndex.from_layout_seats(seats), "_taken": frozenset(seat["key"] for seat in seats if seat["taken"]),
+    }
+
+
+class AvailabilityService:
+    """
+    多阅览室实时座位状态：按阅览室缓存 AVAILABILITY_TTL_SECONDS 秒，并发刷新。
+    座位状态与账号无关，所有请求共用同一份缓存，缓存过期前每个阅览室最多请求上游一次。
+    """
+    def __init__(self, ttl: float = AVAILABILITY_TTL_SECONDS, max_concurrency: int = AVAILABILITY_MAX_CONCURRENCY,
+                 fetcher: Callable[[str, int], Dict[str, Any]] = fetch_lib_layout):
+        self.cache = TTLCache(ttl)
+        self.fetcher = fetcher
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="availability")
+
+    def room(self, lib_id: int, cookie: Optional[str]) -> Dict[str, Any]:
+        """返回单个阅览室的座位状态 (缓存命中时不需要 Cookie)。"""
+        def load() -> Dict[str, Any]:
+            if not cookie: raise ValueError("缓存已过期，需要有效的 Cookie 才能刷新座位状态")
+            return summarize_layout(lib_id, self.fetcher(cookie, lib_id))
+        return self.cache.get_or_load(lib_id, load)
+
+    def rooms(self, lib_ids: List[int], cookie: Optional[str]) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, str]]:
+        """并发获取多个阅览室的座位状态，返回 (结果, 错误)。"""
+        return self._gather(lib_ids, lambda lib_id: self.room(lib_id, cookie))
+
+    def refresh(self, lib_ids: List[int], cookie: str) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, str]]:
+        """不论缓存是否过期，并发重新获取多个阅览室的座位状态并写入缓存，返回 (结果, 错误)。"""
+        def load(lib_id: int) -> Dict[str, Any]:
+            room = summarize_layout(lib_id, self.fetcher(cookie, lib_id))
+            self.cache.put(lib_id, room)
+            return room
+        return self._gather(lib_ids, load)
+
+    def _gather(self, lib_ids: List[int], load: Callable[[int], Dict[str, Any]]) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, str]]:
+        futures = {lib_id: self._executor.submit(load, lib_id) for lib_id in lib_ids}
+        results: Dict[int, Dict[str, Any]] = {}; errors: Dict[int, str] = {}
+        for lib_id, future in futures.items():
+            try: results[lib_id] = future.result()
+            except Exception as e: errors[lib_id] = str(e)
+        return results, errors
+
+
+def find_nearby_seats(lib_id: int, seat: str, count: int, cookie: Optional[str] = None, free_only: bool = True,
+                      exclude: Optional[set] = None) -> List[Tuple[str, str, int, int, float]]:
+    """
+    返回距座位 seat (座位号或 Key) 最近的 count 个座位。
+    优先使用缓存的实时座位状态 (只返回空闲座位)；实时布局中找不到该座位时改用座位图坐标，仍按实时状态排除已占用的座位；
+    无法获取实时状态时才不判断是否空闲。
+    座位不存在时抛出 ValueError。
+    """
+    room_name = ROOM_ID_TO_NAME.get(str(lib_id), "")
+    index: Optional[SeatGridIndex] = None; taken: frozenset = frozenset()
+    try:
+        room = get_availability_service().room(lib_id, cookie)
+        index, taken = room["_index"], room["_taken"]
+    except Exception as e:
+        print(f"无法获取阅览室 {lib_id} 的实时座位状态，使用座位图坐标: {e}")
+    anchor = index.locate(seat) if index else None
+    if anchor is None:
+        index = get_seat_index(room_name) # 保留实时的 taken，座位图中的座位同样按 Key 判断是否已被占用
+        anchor = index.locate(seat) if index else None
+    if anchor is None: raise ValueError(f"在阅览室 '{room_name or lib_id}' 中未找到座位 '{seat}'")
+    exclude = set(exclude or ()) | {anchor[1]}
+    return index.nearest(anchor[2], anchor[3], count, accept=(lambda key: key not in taken) if free_only else None, exclude=exclude)
+
+
+def expand_seat_targets(lib_id: int, seat_targets: List[Tuple[str, str]], count: int, cookie: Optional[str]) -> List[Tuple[str, str]]:
+    """在候选座位列表末尾追加距首选座位最近的 count 个空闲座位，作为自动备选。"""
+    if count <= 0 or not seat_targets: return seat_targets
+    existing = {key for _, key in seat_targets}
+    nearby = find_nearby_seats(lib_id, seat_targets[0][1], count, cookie, exclude=existing)
+    return seat_targets + [(number, key) for number, key, _, _, _ in nearby]
+
+
+_availability_service: Optional[AvailabilityService] = None
+_availability_service_lock = threading.Lock()
+
+def get_availability_service() -> AvailabilityService:
+    global _availability_service
+    if _availability_service is None:
+        with _availability_service_lock:
+            if _availability_service is None: _availability_service = AvailabilityService()
+    return _availability_service
+
+
+# --- Occupancy Recorder ---
+def encode_taken_bitset(seat_keys: List[str], taken: frozenset) -> bytes:
+    """按 seat_keys 的顺序把占用状态编码为位图 (第 i 位为 1 表示第 i 个座位已被占用)。"""
+    bits = 0
+    for i, key in enumerate(seat_keys):
+        if key in taken: bits |= 1 << i
+    return bits.to_bytes((len(seat_keys) + 7) // 8, "little")
+
+
+class OccupancyStore:
+    """
+    历史座位占用记录 (SQLite)。每个阅览室的座位顺序保存为一个布局版本，
+    每条快照只保存一个位图 (280 个座位约 35 字节)，状态未变化时按 OCCUPANCY_KEYFRAME_SECONDS 间隔写入。
+    """
+    def __init__(self, db_path: str = OCCUPANCY_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._last: Dict[int, Tuple[int, bytes, float]] = {} # lib_id -> (布局版本, 上一次写入的位图, 写入时间)
+        self._layouts: Dict[int, Tuple[int, List[str]]] = {} # lib_id -> (最新布局版本, 座位 Key 顺序)
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS room_layouts (
+                lib_id INTEGER, version INTEGER, seat_keys TEXT, seat_names TEXT, created_at REAL, PRIMARY KEY (lib_id, version))""")
+            conn.execute("CREATE TABLE IF NOT EXISTS snapshots (lib_id INTEGER, version INTEGER, ts REAL, taken BLOB)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_snapshots_room_ts ON snapshots(lib_id, ts)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _layout_version(self, conn: sqlite3.Connection, lib_id: int, seats: List[Dict[str, Any]]) -> Tuple[int, List[str]]:
+        seat_keys = [seat["key"] for seat in seats]
+        cached = self._layouts.get(lib_id)
+        if cached and cached[1] == seat_keys: return cached
+        row = conn.execute("SELECT version, seat_keys FROM room_layouts WHERE lib_id = ? ORDER BY version DESC LIMIT 1", (lib_id,)).fetchone()
+        if row and json.loads(row[1]) == seat_keys: version = row[0]
+        else:
+            version = (row[0] + 1) if row else 1
+            conn.execute("INSERT INTO room_layouts VALUES (?, ?, ?, ?, ?)", (lib_id, version, json.dumps(seat_keys),
+                         json.dumps([seat["name"] for seat in seats], ensure_ascii=False), time.time()))
+        self._layouts[lib_id] = (version, seat_keys)
+        return version, seat_keys
+
+    def record(self, room: Dict[str, Any], ts: Optional[float] = None) -> bool:
+        """记录一个阅览室的快照 (summarize_layout 的结果)；与上次相同且未到关键帧间隔时跳过，返回是否写入。"""
+        ts = ts or room.get("fetched_at") or time.time()
+        lib_id = room["lib_id"]
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    version, seat_keys = self._layout_version(conn, lib_id, room["seats"])
+                    taken = encode_taken_bitset(seat_keys, room["_taken"])
+                    last = self._last.get(lib_id)
+                    if last and last[0] == version and last[1] == taken and ts - last[2] < OCCUPANCY_KEYFRAME_SECONDS: return False
+                    conn.execute("INSERT INTO snapshots VALUES (?, ?, ?, ?)", (lib_id, version, ts, taken))
+                self._last[lib_id] = (version, taken, ts)
+                return True
+            finally: conn.close()
+
+    def occupancy_by_time_of_day(self, lib_id: int, since_ts: float, bucket_minutes: int = 30,
+                                 max_gap: float = OCCUPANCY_KEYFRAME_SECONDS * 2) -> Dict[str, Any]:
+        """
+        统计每个座位在一天中各时间段的占用率。每条快照的状态持续到下一条快照 (最长 max_gap 秒，
+        超过视为记录中断)，持续时间计入快照开始时刻所在的时间段。
+        返回 {"buckets": [...], "seats": {座位号: [占用率或 None, ...]}, "samples": 快照数}。
+        """
+        conn = self._connect()
+        try:
+            layouts = {version: (json.loads(keys), json.loads(names)) for version, keys, names in
+                       conn.execute("SELECT version, seat_keys, seat_names FROM room_layouts WHERE lib_id = ?", (lib_id,))}
+            rows = conn.execute("SELECT version, ts, taken FROM snapshots WHERE lib_id = ? AND ts >= ? ORDER BY ts", (lib_id, since_ts)).fetchall()
+        finally: conn.close()
+        bucket_count = 24 * 60 // bucket_minutes
+        # 先按 (版本, 时间段, 位图) 合并持续时间，每个不同的位图只解码一次
+        weighted: Dict[Tuple[int, int, bytes], float] = collections.defaultdict(float)
+        observed: Dict[Tuple[int, int], float] = collections.defaultdict(float)
+        for (version, ts, taken), next_row in zip(rows, rows[1:] + [None]):
+            duration = min((next_row[1] if next_row else time.time()) - ts, max_gap)
+            if duration <= 0: continue
+            local = datetime.datetime.fromtimestamp(ts)
+            bucket = (local.hour * 60 + local.minute) // bucket_minutes
+            weighted[(version, bucket, taken)] += duration; observed[(version, bucket)] += duration
+        taken_time: Dict[str, List[float]] = {}; total_time: Dict[str, List[float]] = {}
+        for (version, bucket, taken), duration in weighted.items():
+            keys, names = layouts.get(version, ([], []))
+            bits = int.from_bytes(taken, "little")
+            for i, name in enumerate(names):
+                label = name or keys[i]
+                if label not in taken_time: taken_time[label] = [0.0] * bucket_count; total_time[label] = [0.0] * bucket_count
+                if bits >> i & 1: taken_time[label][bucket] += duration
+        for (version, bucket), duration in observed.items():
+            keys, names = layouts.get(version, ([], []))
+            for i, name in enumerate(names): total_time[name or keys[i]][bucket] += duration
+        return {
+            "buckets": [f"{b * bucket_minutes // 60:02d}:{b * bucket_minutes % 60:02d}" for b in range(bucket_count)],
+            "seats": {label: [round(taken_time[label][b] / total, 3) if (total := total_time[label][b]) else None for b in range(bucket_count)]
+                      for label in taken_time},
+            "samples": len(rows),
+        }
+
+
+def _parse_burst_windows(windows: List[Tuple[str, str, float]]) -> List[Tuple[datetime.time, datetime.time, float]]:
+    return [(datetime.datetime.strptime(start, "%H:%M:%S").time(), datetime.datetime.strptime(end, "%H:%M:%S").time(), float(interval))
+            for start, end, interval in windows]
+
+
+class OccupancyRecorder:
+    """
+    后台座位占用记录器：每隔 interval 秒 (在 OCCUPANCY_BURST_WINDOWS 时间段内使用更短的间隔)
+    并发获取各阅览室的 libLayout 写入 OccupancyStore，同时刷新实时座位状态缓存。
+    每轮使用最近获取的 Cookie。
+    """
+    def __init__(self, store: OccupancyStore, interval: float, lib_ids: Optional[List[int]] = None,
+                 burst_windows: Optional[List[Tuple[str, str, float]]] = None,
+                 cookie_provider: Callable[[], Optional[str]] = find_cookie):
+        self.store = store
+        self.interval = interval
+        self.lib_ids = lib_ids
+        self.burst_windows = _parse_burst_windows(burst_windows if burst_windows is not None else OCCUPANCY_BURST_WINDOWS)
+        self.cookie_provider = cookie_provider
+        self.stats = {"rounds": 0, "written": 0, "errors": 0}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def next_delay(self, now: Optional[datetime.datetime] = None) -> float:
+        """下一次采样前的等待时间：处于加密采样时间段内时使用该时间段的间隔。"""
+        now = now or datetime.datetime.now(); now_t = now.time()
+        for start, end, interval in self.burst_windows:
+            if start <= now_t <= end: return interval
+        delay = self.interval
+        for start, _, _ in self.burst_windows: # 不要错过即将开始的时间段
+            until_start = (datetime.datetime.combine(now.date(), start) - now).total_seconds()
+            if 0 < until_start < delay: delay = until_start
+        return delay
+
+    def record_once(self) -> int:
+        """采样一轮，返回写入的快照数。"""
+        cookie = self.cookie_provider()
+        if not cookie:
+            self.stats["errors"] += 1; print("座位占用记录: 没有可用的 Cookie，跳过本轮。"); return 0
+        lib_ids = self.lib_ids or [int(lib_id) for lib_id in ROOM_ID_TO_NAME]
+        results, errors = get_availability_service().refresh(lib_ids, cookie)
+        written = 0
+        for lib_id, room in results.items():
+            try:
+                if self.store.record(room): written += 1
+            except Exception as e: errors[lib_id] = str(e)
+        for lib_id, error in errors.items():
+            self.stats["errors"] += 1; print(f"座位占用记录: 阅览室 {lib_id} 采样失败: {error}")
+        self.stats["rounds"] += 1; self.stats["written"] += written
+        return written
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            started = time.time()
+            try: self.record_once()
+            except Exception as e: print(f"座位占用记录出错: {type(e).__name__} - {e}")
+            self._stop.wait(max(0.0, self.next_delay() - (time.time() - started)))
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive(): return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="occupancy-recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread: self._thread.join(timeout=5)
+
+
+# --- Outcome Analytics ---
+def classify_outcome(result: str) -> str:
+    """把尝试结果归类为 won / lost (座位被抢) / too_early (不在预约时间内) / cancelled / error。"""
+    if result.startswith("成功"): return "won"
+    if result == SEAT_TAKEN_ERROR_CODE: return "lost"
+    if "不在预约时间内" in result or "不在预约/抢座时间段内" in result: return "too_early"
+    if result.startswith(JOB_CANCELLED_PREFIX): return "cancelled"
+    return "error"
+
+
+def estimated_arrival_ms(offset_ms: Optional[float], latency_ms: Optional[float]) -> Optional[float]:
+    """主操作到达服务器的估计时间 (相对计划执行时间，毫秒)：发出时间偏移 + 一半的往返耗时。"""
+    if offset_ms is None or latency_ms is None: return None
+    return offset_ms + latency_ms / 2
+
+
+def outcome_window(start_dt: Optional[datetime.datetime]) -> str:
+    """尝试所属的时间窗口：计划执行时间精确到分钟 (HH:MM)，立即执行的任务为 "now"。"""
+    return start_dt.strftime('%H:%M') if start_dt else "now"
+
+
+class OutcomeStore:
+    """
+    每次尝试结果的记录 (SQLite)：座位、时间窗口、主操作发出时间相对计划时间的偏移、请求延迟和成败。
+    写入由后台线程完成，不会拖慢紧接着的下一个备选座位。
+    """
+    def __init__(self, db_path: str = OUTCOMES_DB_PATH):
+        self.db_path = db_path
+        self._queue: "queue.Queue[Tuple[Any, ...]]" = queue.Queue()
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS outcomes (
+                ts REAL, job_id TEXT, lib_id INTEGER, mode INTEGER, seat_key TEXT, seat_number TEXT, window TEXT,
+                scheduled_ts REAL, offset_ms REAL, latency_ms REAL, outcome TEXT, message TEXT, lead_ms REAL, first_attempt INTEGER)""")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(outcomes)")}
+            for column, column_type in (("lead_ms", "REAL"), ("first_attempt", "INTEGER")): # 旧版本数据库补充新列
+                if column not in columns: conn.execute(f"ALTER TABLE outcomes ADD COLUMN {column} {column_type}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outcomes_window ON outcomes(lib_id, mode, window, ts)")
+            conn.execute("""CREATE TABLE IF NOT EXISTS fire_decisions (
+                ts REAL, job_id TEXT, mode INTEGER, window TEXT, previous_lead_ms REAL, lead_ms REAL, reason TEXT, inputs TEXT)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_fire_decisions_window ON fire_decisions(mode, window, ts)")
+        threading.Thread(target=self._write_loop, name="outcome-writer", daemon=True).start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def record(self, job: "SeatJob", attempt: Dict[str, Any], message: str = "") -> None:
+        self._queue.put(("INSERT INTO outcomes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+            time.time(), job.job_id, job.lib_id, job.mode, attempt["key"], attempt["seat"], outcome_window(job.start_dt),
+            job.start_dt.timestamp() if job.start_dt else None, attempt.get("fire_offset_ms"), attempt.get("latency_ms"),
+            classify_outcome(attempt["result"]), message or attempt["result"], attempt.get("lead_ms", 0), int(bool(attempt.get("first_attempt"))))))
+
+    def record_decision(self, job: "SeatJob", decision: Dict[str, Any]) -> None:
+        self._queue.put(("INSERT INTO fire_decisions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (
+            time.time(), job.job_id, job.mode, decision["window"], decision["previous_lead_ms"], decision["lead_ms"],
+            decision["reason"], json.dumps(decision["inputs"], ensure_ascii=False))))
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        while True:
+            items = [self._queue.get()]
+            while True:
+                try: items.append(self._queue.get_nowait())
+                except queue.Empty: break
+            try:
+                with conn:
+                    for sql, row in items: conn.execute(sql, row)
+            except sqlite3.Error as e: print(f"尝试结果写入失败 ({len(items)} 条): {e}")
+            for _ in items: self._queue.task_done()
+
+    def flush(self) -> None:
+        self._queue.join()
+
+    def query(self, sql: str, params: Tuple[Any, ...]) -> List[sqlite3.Row]:
+        conn = self._connect(); conn.row_factory = sqlite3.Row
+        try: return conn.execute(sql, params).fetchall()
+        finally: conn.close()
+
+    def typical_arrival_ms(self, mode: int, window: str, since_days: float = OUTCOME_HISTORY_DAYS) -> Optional[float]:
+        """本工具在该窗口下第一次主操作的典型到达时间 (estimated_arrival_ms 的中位数)，没有记录时返回 None。"""
+        rows = self.query("""SELECT offset_ms + latency_ms / 2 AS arrival FROM outcomes WHERE mode = ? AND window = ? AND ts >= ?
+                             AND outcome IN ('won', 'lost', 'too_early') AND offset_ms IS NOT NULL AND latency_ms IS NOT NULL ORDER BY arrival""",
+                          (mode, window, time.time() - since_days * 86400))
+        return rows[len(rows) // 2]["arrival"] if rows else None
+
+    def seat_scores(self, lib_id: int, mode: int, window: str, arrival_ms: Optional[float] = None,
+                    since_days: float = OUTCOME_HISTORY_DAYS) -> Tuple[float, Dict[str, Dict[str, Any]]]:
+        """
+        每个座位在该窗口下的成功概率估计。给定 arrival_ms 时优先使用到达时间相近的记录；
+        各座位的成功率向整个窗口的成功率收缩 (OUTCOME_PRIOR_WEIGHT)。返回 (窗口整体成功率, {座位 Key: 统计})。
+        """
+        rows = self.query("""SELECT seat_key, seat_number, offset_ms, latency_ms, outcome FROM outcomes
+                             WHERE lib_id = ? AND mode = ? AND window = ? AND ts >= ? AND outcome IN ('won', 'lost')""",
+                          (lib_id, mode, window, time.time() - since_days * 86400))
+        wins = sum(1 for row in rows if row["outcome"] == "won")
+        prior = (wins + 1) / (len(rows) + 2)
+        per_seat: Dict[str, List[sqlite3.Row]] = collections.defaultdict(list)
+        for row in rows: per_seat[row["seat_key"]].append(row)
+        scores: Dict[str, Dict[str, Any]] = {}
+        for seat_key, seat_rows in per_seat.items():
+            near = [row for row in seat_rows if arrival_ms is not None and (arrival := estimated_arrival_ms(row["offset_ms"], row["latency_ms"])) is not None
+                    and abs(arrival - arrival_ms) <= OUTCOME_ARRIVAL_TOLERANCE_MS]
+            used = near or seat_rows
+            seat_wins = sum(1 for row in used if row["outcome"] == "won")
+            win_prob = (seat_wins + prior * OUTCOME_PRIOR_WEIGHT) / (len(used) + OUTCOME_PRIOR_WEIGHT)
+            scores[seat_key] = {"seat": seat_rows[0]["seat_number"], "win_prob": round(win_prob, 3), "contention": round(1 - win_prob, 3),
+                                "samples": len(seat_rows), "wins": sum(1 for row in seat_rows if row["outcome"] == "won"),
+                                "matched_latency": bool(near)}
+        return prior, scores
+
+    def decide_fire_lead(self, mode: int, window: str) -> Dict[str, Any]:
+        """
+        根据该窗口最近的首次尝试决定本次提前发出主操作的毫秒数 (到达时间为 estimated_arrival_ms):
+        上次 "不在预约时间内" -> 减少 FIRE_LEAD_BACKOFF_MS；在当前提前量下连续 FIRE_LEAD_LOSS_STREAK 次晚于开放时间到达且被抢
+        -> 最多增加 FIRE_LEAD_STEP_MS；其他情况保持不变。不会回到曾经导致 "不在预约时间内" 的提前量，
+        并限制在 [FIRE_LEAD_MIN_MS, FIRE_LEAD_MAX_MS]。
+        返回 {"lead_ms", "previous_lead_ms", "reason", "inputs", "window"}。
+        """
+        rows = self.query("""SELECT ts, lead_ms, offset_ms, latency_ms, outcome FROM outcomes
+                             WHERE mode = ? AND window = ? AND first_attempt = 1 AND outcome IN ('won', 'lost', 'too_early')
+                             ORDER BY ts DESC LIMIT ?""", (mode, window, FIRE_TUNING_HISTORY))
+        inputs = [{"ts": row["ts"], "lead_ms": row["lead_ms"] or 0, "outcome": row["outcome"],
+                   "arrival_ms": round(arrival, 1) if (arrival := estimated_arrival_ms(row["offset_ms"], row["latency_ms"])) is not None else None}
+                  for row in rows]
+        lost_late = lambda item: item["outcome"] == "lost" and item["arrival_ms"] is not None and item["arrival_ms"] > 0
+        if not inputs:
+            lead, previous, reason = FIRE_LEAD_MIN_MS, FIRE_LEAD_MIN_MS, "该窗口没有历史记录，使用最小提前量"
+        else:
+            last = inputs[0]; previous = lead = last["lead_ms"]
+            if last["outcome"] == "too_early":
+                lead = previous - FIRE_LEAD_BACKOFF_MS; reason = f"上次提前 {previous:.0f} ms 时收到 '不在预约时间内'，减少提前量"
+            elif lost_late(last):
+                streak = list(itertools.takewhile(lambda item: lost_late(item) and item["lead_ms"] == previous, inputs))
+                if len(streak) >= FIRE_LEAD_LOSS_STREAK:
+                    earliest = min(item["arrival_ms"] for item in streak)
+                    lead = previous + min(earliest, FIRE_LEAD_STEP_MS)
+                    reason = f"连续 {len(streak)} 次在开放后到达 (最早 {earliest:.0f} ms) 且座位被抢，增加提前量"
+                else: reason = f"在开放后 {last['arrival_ms']:.0f} ms 到达且座位被抢 (连续 {len(streak)}/{FIRE_LEAD_LOSS_STREAK} 次)，暂时保持提前量"
+            elif last["outcome"] == "lost": reason = "上次在开放前到达但座位被抢 (与时机无关)，保持提前量"
+            else: reason = "上次成功，保持提前量"
+            too_early_leads = [item["lead_ms"] for item in inputs if item["outcome"] == "too_early"]
+            if too_early_leads and lead > min(too_early_leads) - FIRE_LEAD_BACKOFF_MS:
+                lead = min(too_early_leads) - FIRE_LEAD_BACKOFF_MS; reason += f"；不超过曾导致提前过多的 {min(too_early_leads):.0f} ms"
+        lead = max(FIRE_LEAD_MIN_MS, min(FIRE_LEAD_MAX_MS, round(lead)))
+        return {"window": window, "lead_ms": lead, "previous_lead_ms": previous, "reason": reason, "inputs": inputs}
+
+    def recent_decisions(self, limit: int = 50) -> List[Dict[str, Any]]:
+        rows = self.query("SELECT * FROM fire_decisions ORDER BY ts DESC LIMIT ?", (limit,))
+        return [{**dict(row), "inputs": json.loads(row["inputs"] or "[]")} for row in rows]
+
+
+_outcome_store: Optional[OutcomeStore] = None
+_outcome_store_lock = threading.Lock()
+
+def get_outcome_store() -> OutcomeStore:
+    global _outcome_store
+    if _outcome_store is None:
+        with _outcome_store_lock:
+            if _outcome_store is None: _outcome_store = OutcomeStore(OUTCOMES_DB_PATH)
+    return _outcome_store
+
+
+def rank_seat_targets(lib_id: int, mode: int, start_dt: Optional[datetime.datetime],
+                      seat_targets: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+    """
+    按历史成功概率 (在本工具当前的典型到达时间下) 对候选座位排序，概率相同时保持原顺序。
+    返回 [{"seat", "key", "win_prob", "samples", ...}]；没有记录的座位使用窗口整体成功率。
+    """
+    store = get_outcome_store(); window = outcome_window(start_dt)
+    arrival_ms = store.typical_arrival_ms(mode, window)
+    prior, scores = store.seat_scores(lib_id, mode, window, arrival_ms)
+    ranked = [{"seat": number, "key": key, **{k: v for k, v in scores.get(key, {"win_prob": round(prior, 3), "samples": 0}).items() if k != "seat"}}
+              for number, key in seat_targets]
+    ranked.sort(key=lambda item: -item["win_prob"])
+    for item in ranked: item["typical_arrival_ms"] = arrival_ms
+    return ranked
+
+
+# --- Multi-Node Leases ---
+class LeaseBackend(ABC):
+    """
+    多节点共享任务表接口。节点通过限时租约领取任务，执行期间续约，结束后写回结果；
+    节点失联导致租约过期后，任务可被其他节点重新领取。实现需保证 claim/renew/complete/release 各自原子。
+    """
+    @abstractmethod
+    def add(self, job: SeatJob) -> bool:
+        """加入任务；同一账号、座位、执行时刻的任务已存在时返回 False。"""
+
+    @abstractmethod
+    def claim(self, node_id: str, horizon_ts: float, ttl: float, limit: int) -> List[SeatJob]:
+        """
+        领取执行时间不晚于 horizon_ts 的空闲任务，以及租约已过期但尚未到执行时间的任务；
+        租约过期时已过执行时间的任务 (持有节点可能已经发出请求) 结果未知，标记为完成，不重新执行。
+        """
+
+    @abstractmethod
+    def renew(self, node_id: str, job_ids: List[str], ttl: float) -> List[str]:
+        """续约，返回仍由本节点持有的任务 id。"""
+
+    @abstractmethod
+    def complete(self, node_id: str, job: SeatJob) -> bool:
+        """写回结果 (仅当本节点仍持有租约)。"""
+
+    @abstractmethod
+    def release(self, node_id: str, job_id: str) -> None:
+        """放弃租约，任务立即可被其他节点领取。"""
+
+    @abstractmethod
+    def list(self) -> List[Dict[str, Any]]:
+        """返回任务表中的全部任务记录。"""
+
+
+def lease_dedup_key(job: SeatJob) -> str:
+    """共享任务表的去重键：账号 (Cookie 摘要) + 阅览室 + 首选座位 + 执行时刻 (秒)。"""
+    cookie_digest = hashlib.sha1(job.cookie.encode('utf-8')).hexdigest()[:16]
+    lib_id, seat_key, fire_second = job_dedup_key(job)
+    return f"{cookie_digest}:{lib_id}:{seat_key}:{fire_second}"
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """
+    基于 SQLite 文件的共享任务表，可放在多台机器都能访问的共享磁盘上 (单机时即为本地替身)。
+    领取、续约都是带条件的 UPDATE，并在 BEGIN IMMEDIATE 事务中执行。
+    共享磁盘 (NFS/SMB) 上无法使用 WAL 所需的共享内存，因此保持默认的回滚日志模式。
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS shared_jobs (
+                job_id TEXT PRIMARY KEY, dedup_key TEXT UNIQUE, name TEXT, mode INTEGER, cookie TEXT, lib_id INTEGER,
+                seat_targets TEXT, fire_at REAL, deadline_seconds REAL, state TEXT, owner TEXT, lease_until REAL,
+                claims INTEGER DEFAULT 0, result TEXT, attempts TEXT, timings TEXT, updated_at REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_shared_jobs_state ON shared_jobs(state, fire_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None) # 手动控制事务
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def add(self, job: SeatJob) -> bool:
+        now_ts = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                """INSERT OR IGNORE INTO shared_jobs (job_id, dedup_key, name, mode, cookie, lib_id, seat_targets, fire_at,
+                   deadline_seconds, state, attempts, timings, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'open', '[]', '{}', ?)""",
+                (job.job_id, lease_dedup_key(job), job.name, job.mode, job.cookie, job.lib_id,
+                 json.dumps(job.seat_targets, ensure_ascii=False), job.start_dt.timestamp() if job.start_dt else now_ts,
+                 job.deadline_seconds, now_ts))
+            return cursor.rowcount == 1
+        finally: conn.close()
+
+    def claim(self, node_id: str, horizon_ts: float, ttl: float, limit: int) -> List[SeatJob]:
+        if limit <= 0: return []
+        now_ts = time.time(); claimed: List[SeatJob] = []
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("""SELECT * FROM shared_jobs WHERE fire_at <= ? AND (state = 'open' OR (state = 'leased' AND lease_until < ?))
+                                   ORDER BY fire_at LIMIT ?""", (horizon_ts, now_ts, limit)).fetchall()
+            for row in rows:
+                if row["state"] == "leased" and row["fire_at"] <= now_ts:
+                    # 持有节点在执行时间之后失联，可能已经发出请求，结果未知，不能重复执行
+                    conn.execute("UPDATE shared_jobs SET state = 'done', result = ?, updated_at = ? WHERE job_id = ?",
+                                 (f"节点 {row['owner']} 的租约已过期且已过执行时间，结果未知，未重新执行。", now_ts, row["job_id"]))
+                    continue
+                conn.execute("UPDATE shared_jobs SET state = 'leased', owner = ?, lease_until = ?, claims = claims + 1, updated_at = ? WHERE job_id = ?",
+                             (node_id, now_ts + ttl, now_ts, row["job_id"]))
+                claimed.append(job_from_record(dict(row)))
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction: conn.execute("ROLLBACK")
+            raise
+        finally: conn.close()
+        return claimed
+
+    def renew(self, node_id: str, job_ids: List[str], ttl: float) -> List[str]:
+        if not job_ids: return []
+        placeholders = ", ".join("?" for _ in job_ids)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(f"UPDATE shared_jobs SET lease_until = ? WHERE owner = ? AND state = 'leased' AND job_id IN ({placeholders})",
+                         (time.time() + ttl, node_id, *job_ids))
+            held = [row[0] for row in conn.execute(
+                f"SELECT job_id FROM shared_jobs WHERE owner = ? AND state = 'leased' AND job_id IN ({placeholders})", (node_id, *job_ids))]
+            conn.execute("COMMIT")
+            return held
+        except BaseException:
+            if conn.in_transaction: conn.execute("ROLLBACK")
+            raise
+        finally: conn.close()
+
+    def complete(self, node_id: str, job: SeatJob) -> bool:
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE shared_jobs SET state = 'done', result = ?, attempts = ?, timings = ?, updated_at = ? WHERE job_id = ? AND owner = ? AND state = 'leased'",
+                (job.result, json.dumps(job.attempts, ensure_ascii=False), json.dumps(job.timings), time.time(), job.job_id, node_id))
+            return cursor.rowcount == 1
+        finally: conn.close()
+
+    def release(self, node_id: str, job_id: str) -> None:
+        conn = self._connect()
+        try: conn.execute("UPDATE shared_jobs SET state = 'open', owner = NULL, lease_until = NULL, updated_at = ? WHERE job_id = ? AND owner = ? AND state = 'leased'",
+                          (time.time(), job_id, node_id))
+        finally: conn.close()
+
+    def list(self) -> List[Dict[str, Any]]:
+        conn = self._connect()
+        try: return [dict(row) for row in conn.execute("SELECT * FROM shared_jobs ORDER BY fire_at")]
+        finally: conn.close()
+
+
+class LeaseNode:
+    """
+    多节点模式中的一个节点：定期从共享任务表领取即将执行的任务，交给本地调度器执行，
+    倒计时和执行期间持续续约；续约失败 (租约被其他节点接管或长时间无法访问任务表) 时取消本地任务。
+    """
+    def __init__(self, backend: LeaseBackend, node_id: Optional[str] = None, ttl: float = LEASE_TTL_SECONDS,
+                 max_workers: int = JOB_MAX_WORKERS):
+        self.backend = backend
+        self.node_id = node_id or f"{os.uname().nodename if hasattr(os, 'uname') else 'node'}-{os.getpid()}"
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.scheduler = JobScheduler(max_workers=max_workers)
+        self.held: Dict[str, Tuple[SeatJob, float]] = {} # job_id -> (任务, 本节点所知的租约到期时间)
+        self._lock = threading.Lock()
+        self.finished: List[SeatJob] = []
+
+    def poll_once(self) -> int:
+        """领取执行时间临近的任务并提交给本地调度器，返回领取数。"""
+        with self._lock: capacity = self.max_workers - len(self.held)
+        now_ts = time.time()
+        jobs = self.backend.claim(self.node_id, now_ts + self.scheduler.prewarm_seconds + self.ttl, self.ttl, capacity)
+        for job in jobs:
+            with self._lock: self.held[job.job_id] = (job, now_ts + self.ttl)
+            job.done_callbacks.append(self._on_done)
+            print(f"[{self.node_id}] 领取任务 {job.name} ({job.job_id})")
+            try: self.scheduler.submit(job)
+            except AdmissionError as e:
+                job.result = f"任务未被接纳: {e}"
+                with self._lock: self.held.pop(job.job_id, None)
+                self.backend.complete(self.node_id, job)
+        return len(jobs)
+
+    def renew_once(self) -> None:
+        with self._lock: job_ids = list(self.held)
+        if not job_ids: return
+        now_ts = time.time()
+        try: still_held = set(self.backend.renew(self.node_id, job_ids, self.ttl))
+        except sqlite3.Error as e:
+            print(f"[{self.node_id}] 续约失败: {e}"); still_held = None
+        for job_id in job_ids:
+            with self._lock:
+                entry = self.held.get(job_id)
+                if entry is None: continue
+                job, lease_until = entry
+                if still_held is not None and job_id in still_held: self.held[job_id] = (job, now_ts + self.ttl); continue
+            if still_held is not None: self.scheduler.cancel(job_id, "租约已被其他节点接管")
+            elif now_ts >= lease_until: self.scheduler.cancel(job_id, "长时间无法续约，租约可能已失效")
+
+    def _on_done(self, job: SeatJob) -> None:
+        with self._lock: self.held.pop(job.job_id, None)
+        self.finished.append(job)
+        try:
+            if job.cancelled and job.start_dt and job.start_dt.timestamp() > time.time():
+                self.backend.release(self.node_id, job.job_id) # 尚未到执行时间，交还给其他节点
+            elif not self.backend.complete(self.node_id, job): print(f"[{self.node_id}] 任务 {job.name} 的租约已失效，结果未写回。")
+        except sqlite3.Error as e: print(f"[{self.node_id}] 写回任务 {job.name} 结果失败: {e}")
+
+    def run(self, until_empty: bool = False) -> None:
+        """运行节点直到 Ctrl-C (until_empty 时在任务表中没有未完成任务后退出)。"""
+        next_renew = 0.0
+        try:
+            while True:
+                try: self.poll_once()
+                except sqlite3.Error as e: print(f"[{self.node_id}] 领取任务失败: {e}")
+                if time.time() >= next_renew: self.renew_once(); next_renew = time.time() + self.ttl / 3
+                if until_empty and not self.held and not any(r["state"] != "done" for r in self.backend.list()): break
+                time.sleep(LEASE_POLL_INTERVAL)
+        except KeyboardInterrupt:
+            print(f"\n[{self.node_id}] 收到中断，取消 {self.scheduler.cancel_all('节点退出')} 个任务并交还租约...")
+        finally:
+            self.scheduler.wait_all(timeout=5)
+            self.scheduler.shutdown(wait=False)
+
+
+# --- Job Spec Validation ---
+def resolve_room(room: Any) -> Tuple[int, str]:
+    """把阅览室名称或 ID 解析为 (lib_id, 阅览室名称)，无效时抛出 ValueError。"""
+    room_str = str(room).strip(); mappings = current_mappings()
+    if room_str in mappings.rooms: return int(room_str), mappings.rooms[room_str]
+    if room_str in mappings.room_ids: return int(mappings.room_ids[room_str]), room_str
+    raise ValueError(f"无效阅览室 '{room_str}'")
+
+
+def resolve_seat_targets(room_name: str, seat_numbers: List[Any], seat_keys: Optional[List[Any]] = None) -> List[Tuple[str, str]]:
+    """把座位号列表 (按优先级) 解析为 [(座位号, 座位 Key)]；没有座位图的阅览室可直接提供 seat_keys。"""
+    targets: List[Tuple[str, str]] = []
+    seat_map_for_room = current_mappings().seats.get(room_name)
+    for seat_number in seat_numbers or []:
+        seat_number_str = str(seat_number).strip()
+        if not seat_map_for_room: raise ValueError(f"未找到阅览室 '{room_name}' 座位图，请改用 seat_keys")
+        seat_key = seat_map_for_room.get(seat_number_str)
+        if seat_key is None: raise ValueError(f"在 '{room_name}' 中未找到座位号 '{seat_number_str}'")
+        targets.append((seat_number_str, seat_key))
+    for seat_key in seat_keys or []:
+        seat_key_str = str(seat_key).strip()
+        if not seat_key_str: raise ValueError("座位 Key 不能为空")
+        targets.append(("未知", seat_key_str))
+    if not targets: raise ValueError("至少需要一个座位号或座位 Key")
+    return targets
+
+
+def resolve_execution_dt(mode: int, time_str: str) -> Optional[datetime.datetime]:
+    """按模式解析执行时间：明日预约必须在窗口内；抢座留空表示立即执行。无效时抛出 ValueError。"""
+    time_str = (time_str or "").strip()
+    if mode == 1:
+        if not time_str: raise ValueError('明日预约模式必须提供执行时间 (HH:MM:SS)')
+        if not validate_time_format(time_str): raise ValueError('时间格式错误')
+        exec_dt = calculate_execution_dt(time_str, check_window=True)
+        if exec_dt is None: raise ValueError(f"预约时间 '{time_str}' 无效或不在窗口内/已过")
+        return exec_dt
+    if mode == 2:
+        if not time_str: return None
+        if not validate_time_format(time_str): raise ValueError('时间格式错误')
+        exec_dt = calculate_execution_dt(time_str, check_window=False)
+        if exec_dt is None: raise ValueError(f"抢座时间 '{time_str}' 无效或已过")
+        return exec_dt
+    raise ValueError('模式必须是 1 或 2')
+
+
+def build_job_from_spec(spec: Dict[str, Any], index: int) -> SeatJob:
+    """
+    根据任务描述创建 SeatJob，字段:
+    name, mode (1/2), cookie 或 cookie_identity, room (名称或 ID), seats (座位号列表), seat_keys, time (HH:MM:SS),
+    deadline (可选，执行时间之后最多运行的秒数), nearby (可选，自动追加距首选座位最近的 N 个空闲座位),
+    reorder (可选，按历史成功概率重新排列候选座位), profile (可选，对该任务做性能分析),
+    record (可选，录制该任务与服务器的交换，供离线回放)。
+    无效时抛出 ValueError。
+    """
+    if not isinstance(spec, dict): raise ValueError("任务描述必须是 JSON 对象")
+    try: mode = int(spec.get("mode"))
+    except (TypeError, ValueError): raise ValueError("mode 必须是 1 或 2")
+    if mode not in [1, 2]: raise ValueError("mode 必须是 1 或 2")
+    cookie = str(spec.get("cookie") or "").strip()
+    if not cookie and spec.get("cookie_identity"):
+        cookie = find_cookie(identity=str(spec["cookie_identity"])) or ""
+        if not cookie: raise ValueError(f"Cookie 映射中未找到账号 '{spec['cookie_identity']}'")
+    if not cookie: raise ValueError("必须提供 cookie 或 cookie_identity")
+    if "room" not in spec: raise ValueError("缺少 room")
+    lib_id, room_name = resolve_room(spec["room"])
+    seats = spec.get("seats") or []
+    if not isinstance(seats, list): seats = [seats]
+    seat_keys = spec.get("seat_keys") or []
+    if not isinstance(seat_keys, list): seat_keys = [seat_keys]
+    seat_targets = resolve_seat_targets(room_name, seats, seat_keys)
+    try: nearby = int(spec.get("nearby") or 0)
+    except (TypeError, ValueError): raise ValueError("nearby 必须是整数")
+    if nearby: seat_targets = expand_seat_targets(lib_id, seat_targets, nearby, cookie)
+    start_dt = resolve_execution_dt(mode, str(spec.get("time") or ""))
+    if spec.get("reorder") and len(seat_targets) > 1:
+        seat_targets = [(item["seat"], item["key"]) for item in rank_seat_targets(lib_id, mode, start_dt, seat_targets)]
+    try: deadline_seconds = float(spec.get("deadline") or JOB_DEADLINE_SECONDS)
+    except (TypeError, ValueError): raise ValueError("deadline 必须是秒数")
+    if deadline_seconds <= 0: raise ValueError("deadline 必须大于 0")
+    job = SeatJob(mode, cookie, lib_id, seat_targets, start_dt, name=str(spec.get("name") or f"job-{index + 1}"),
+                  deadline_seconds=deadline_seconds)
+    if spec.get("profile"): job.profiling = True
+    if spec.get("record"): job.recording = True
+    return job
+
+
 # --- CLI Functions ---
 def auto_get_cookie_cli() -> Optional[str]:
     """
@@ -779,6 +3125,12 @@ def auto_get_cookie_cli() -> Optional[str]:
 
     cookie_content = None
     while time.time() - start_time < MAX_WAIT_TIME:
+        # 优先读取多账号 Cookie 映射中本次等待期间新获取的 Cookie
+        mapped_cookie = find_cookie(since=start_time)
+        if mapped_cookie:
+            print(f"\n检测到 '{COOKIE_MAP_FILENAME}' 中的新 Cookie！")
+            cookie_content = mapped_cookie
+            break
         if os.path.exists(COOKIE_FILE_PATH):
             try:
                 current_mtime = os.stat(COOKIE_FILE_PATH)[stat.ST_MTIME]
@@ -909,7 +3261,11 @@ def run_cli():
                      if len(available_keys) < 50: print(f"可用座位号: {', '.join(sorted(available_keys))}")
 
         # --- Start Operation ---
-        final_result = perform_seat_operation(mode, cookie_str, lib_id_int, seat_key, start_action_dt) # No callback needed for CLI
+        cancel_token = CancelToken()
+        try: final_result = perform_seat_operation(mode, cookie_str, lib_id_int, seat_key, start_action_dt, cancel_token=cancel_token) # No callback needed for CLI
+        except KeyboardInterrupt:
+            cancel_token.cancel("用户按下 Ctrl-C") # 中断排队连接
+            final_result = cancel_token.message(); print()
 
         # --- Handle Result ---
         if final_result == SEAT_TAKEN_ERROR_CODE: print("\n座位已被占用或预约，请重新选择。\n" + "="*40)
@@ -919,6 +3275,247 @@ def run_cli():
             if try_again != 'y': break # Exit main CLI loop
 
 
+def load_job_specs(jobs_path: str) -> List[Dict[str, Any]]:
+    """读取批量任务文件：任务描述列表，或 {"jobs": [...]}。"""
+    with open(jobs_path, 'r', encoding='utf-8') as f: data = json.load(f)
+    if isinstance(data, dict): data = data.get("jobs")
+    if not isinstance(data, list): raise ValueError("任务文件必须是任务列表或包含 'jobs' 列表的对象")
+    return data
+
+
+def run_batch(jobs_path: str, results_path: Optional[str] = None, max_workers: int = JOB_MAX_WORKERS, processes: int = 0) -> int:
+    """
+    非交互批量模式：读取任务文件，预先校验全部任务，通过共享调度器并发执行，
+    最后写出包含每个任务耗时的 JSON 结果文件。返回进程退出码。
+    """
+    print("欢迎使用 图书馆抢座助手 (批量模式)")
+    print("========================================")
+    if not load_mappings() or not ROOM_ID_TO_NAME:
+        print("错误：加载映射失败，无法继续。"); return 2
+    try: specs = load_job_specs(jobs_path)
+    except (OSError, ValueError) as e:
+        print(f"错误: 无法读取任务文件 {jobs_path}: {e}"); return 2
+
+    # --- 预先校验全部任务，任意一个无效则全部不执行 ---
+    jobs: List[SeatJob] = []; errors: List[str] = []
+    for index, spec in enumerate(specs):
+        try: jobs.append(build_job_from_spec(spec, index))
+        except ValueError as e:
+            name = spec.get("name") if isinstance(spec, dict) else None
+            errors.append(f"  任务 {index + 1}{f' ({name})' if name else ''}: {e}")
+    if errors:
+        print(f"错误: {len(errors)} 个任务校验失败，未执行任何任务:"); print("\n".join(errors)); return 2
+    if not jobs: print("任务文件中没有任务。"); return 0
+
+    print(f"校验通过，共 {len(jobs)} 个任务:")
+    for job in jobs:
+        fire_str = job.start_dt.strftime('%Y-%m-%d %H:%M:%S') if job.start_dt else "立即执行"
+        seats_str = ", ".join(number if number != "未知" else key for number, key in job.seat_targets)
+        print(f"  [{job.name}] {'明日预约' if job.mode == 1 else '立即抢座'} | {ROOM_ID_TO_NAME.get(str(job.lib_id))} | 座位: {seats_str} | 时间: {fire_str}")
+
+    runner = ProcessJobPool(min(processes, len(jobs)), threads_per_process=max_workers) if processes > 0 else None
+    scheduler = JobScheduler(max_workers=max(1, min(max_workers * max(1, processes), len(jobs))), runner=runner)
+    batch_started_at = time.time(); interrupted = False
+    try:
+        scheduled_jobs = scheduler.submit_many(jobs)
+        jobs = list({id(job): job for job in scheduled_jobs}.values()) # 合并后的重复任务只执行一次
+        try: scheduler.wait_all(jobs)
+        except KeyboardInterrupt:
+            print(f"\n收到中断，正在取消 {scheduler.cancel_all('用户按下 Ctrl-C')} 个未完成的任务...")
+            interrupted = True
+            scheduler.wait_all(jobs, timeout=5)
+    except AdmissionError as e:
+        print(f"错误: {e}"); return 2
+    finally:
+        scheduler.shutdown(wait=not interrupted)
+
+    succeeded = sum(1 for job in jobs if job.succeeded)
+    results = {
+        "jobs_file": os.path.abspath(jobs_path),
+        "started_at": batch_started_at, "finished_at": time.time(),
+        "summary": {"total": len(jobs), "succeeded": succeeded, "failed": len(jobs) - succeeded},
+        "jobs": [job.to_dict() for job in jobs],
+    }
+    results_path = results_path or os.path.splitext(jobs_path)[0] + ".results.json"
+    try:
+        with open(results_path, 'w', encoding='utf-8') as f: json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入: {results_path}")
+    except OSError as e: print(f"\n错误: 无法写入结果文件 {results_path}: {e}")
+
+    print("\n--- 批量任务结束 ---")
+    for job in jobs: print(f"  [{job.name}] {job.result}")
+    print(f"成功 {succeeded}/{len(jobs)}")
+    if interrupted: return 130
+    return 0 if succeeded == len(jobs) else 1
+
+
+def run_batch_cli(argv: List[str]) -> int:
+    """解析 `beta.py batch` 的命令行参数并运行批量模式。"""
+    import argparse
+    parser = argparse.ArgumentParser(prog="beta.py batch", description="批量执行预约/抢座任务")
+    parser.add_argument("jobs_file", help="任务描述 JSON 文件")
+    parser.add_argument("-o", "--output", help="结果文件路径 (默认: <任务文件>.results.json)")
+    parser.add_argument("-w", "--workers", type=int, default=JOB_MAX_WORKERS, help="最大并发任务数 (多进程时为每个进程的并发数)")
+    parser.add_argument("-p", "--processes", type=int, default=0, help="工作进程数，同一 Cookie 的任务固定在同一进程 (默认 0: 单进程)")
+    parser.add_argument("--profile", action="store_true", help=f"对所有任务做性能分析，结果写入 {JOB_PROFILE_DIR}")
+    parser.add_argument("--record", action="store_true", help=f"录制所有任务与服务器的交换，写入 {RECORDINGS_DIR}")
+    args = parser.parse_args(argv)
+    global JOB_PROFILING, RECORD_EXCHANGES
+    JOB_PROFILING, RECORD_EXCHANGES = JOB_PROFILING or args.profile, RECORD_EXCHANGES or args.record
+    return run_batch(args.jobs_file, args.output, args.workers, args.processes)
+
+
+def run_node_cli(argv: List[str]) -> int:
+    """`beta.py node add|run|status <共享任务表>`：多节点模式的命令行入口。"""
+    import argparse
+    parser = argparse.ArgumentParser(prog="beta.py node", description="多节点共享任务表 (租约)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add_parser = sub.add_parser("add", help="校验任务文件并加入共享任务表")
+    add_parser.add_argument("db", help="共享任务表 (SQLite 文件，可位于共享磁盘)")
+    add_parser.add_argument("jobs_file", help="任务描述 JSON 文件 (格式同批量模式)")
+    run_parser = sub.add_parser("run", help="作为节点领取并执行任务")
+    run_parser.add_argument("db")
+    run_parser.add_argument("--node-id", help="节点名称 (默认: 主机名-进程号)")
+    run_parser.add_argument("--lease", type=float, default=LEASE_TTL_SECONDS, help="租约有效期 (秒)")
+    run_parser.add_argument("-w", "--workers", type=int, default=JOB_MAX_WORKERS, help="本节点最大并发任务数")
+    run_parser.add_argument("--until-empty", action="store_true", help="任务表中没有未完成任务时退出")
+    status_parser = sub.add_parser("status", help="查看共享任务表")
+    status_parser.add_argument("db")
+    args = parser.parse_args(argv)
+
+    backend = SQLiteLeaseBackend(args.db)
+    if args.command == "status":
+        for row in backend.list():
+            fire_str = datetime.datetime.fromtimestamp(row["fire_at"]).strftime('%Y-%m-%d %H:%M:%S') if row["fire_at"] else "-"
+            print(f"  [{row['name']}] {row['state']:<6} | 节点: {row['owner'] or '-'} | 时间: {fire_str} | 领取 {row['claims']} 次 | {row['result'] or ''}")
+        return 0
+    if not load_mappings() or not ROOM_ID_TO_NAME:
+        print("错误：加载映射失败，无法继续。"); return 2
+    if args.command == "add":
+        try: specs = load_job_specs(args.jobs_file)
+        except (OSError, ValueError) as e: print(f"错误: 无法读取任务文件 {args.jobs_file}: {e}"); return 2
+        jobs: List[SeatJob] = []; errors: List[str] = []
+        for index, spec in enumerate(specs):
+            try: jobs.append(build_job_from_spec(spec, index))
+            except ValueError as e: errors.append(f"  任务 {index + 1}: {e}")
+        if errors: print(f"错误: {len(errors)} 个任务校验失败，未加入任何任务:"); print("\n".join(errors)); return 2
+        added = sum(1 for job in jobs if backend.add(job))
+        print(f"已加入 {added} 个任务，{len(jobs) - added} 个与已有任务重复 (同一账号、座位和时刻)。")
+        return 0
+    node = LeaseNode(backend, node_id=args.node_id, ttl=args.lease, max_workers=args.workers)
+    print(f"节点 {node.node_id} 已启动，共享任务表: {os.path.abspath(args.db)}")
+    node.run(until_empty=args.until_empty)
+    return 0
+
+
+def run_contention_cli(argv: List[str]) -> int:
+    """`beta.py contention`：按历史成功概率给候选座位排序。"""
+    import argparse
+    parser = argparse.ArgumentParser(prog="beta.py contention", description="根据历史尝试结果给候选座位排序")
+    parser.add_argument("room", help="阅览室名称或 ID")
+    parser.add_argument("mode", type=int, choices=[1, 2], help="1-明日预约, 2-立即抢座")
+    parser.add_argument("time", help="执行时间 HH:MM:SS (立即执行填 now)")
+    parser.add_argument("seats", nargs="+", help="候选座位号")
+    args = parser.parse_args(argv)
+    if not load_mappings() or not ROOM_ID_TO_NAME:
+        print("错误：加载映射失败，无法继续。"); return 2
+    try:
+        lib_id, room_name = resolve_room(args.room)
+        targets = resolve_seat_targets(room_name, args.seats)
+        start_dt = None if args.time == "now" else resolve_execution_dt(args.mode, args.time)
+    except ValueError as e: print(f"错误: {e}"); return 2
+    ranked = rank_seat_targets(lib_id, args.mode, start_dt, targets)
+    arrival = ranked[0]["typical_arrival_ms"] if ranked else None
+    print(f"{room_name} | 窗口 {outcome_window(start_dt)} | 典型到达时间: {f'{arrival:.0f} ms' if arrival is not None else '无记录'}")
+    for rank, item in enumerate(ranked, 1):
+        print(f"  {rank}. 座位 {item['seat']:<6} 成功概率 {item['win_prob']:.0%}  (记录 {item['samples']} 次)")
+    print("建议顺序: " + ", ".join(item["seat"] for item in ranked))
+    if ADAPTIVE_FIRE_OFFSET and start_dt:
+        decision = get_outcome_store().decide_fire_lead(args.mode, outcome_window(start_dt))
+        print(f"下次提前量: {decision['lead_ms']:.0f} ms ({decision['reason']})")
+    return 0
+
+
+def run_record_cli(argv: List[str]) -> int:
+    """`beta.py record`：在前台运行座位占用记录器。"""
+    import argparse
+    parser = argparse.ArgumentParser(prog="beta.py record", description="定时记录各阅览室的座位占用状态")
+    parser.add_argument("--interval", type=float, default=OCCUPANCY_RECORD_INTERVAL or 60, help="采样间隔 (秒)")
+    parser.add_argument("--rooms", help="只记录这些阅览室 (逗号分隔的名称或 ID，默认全部)")
+    parser.add_argument("--db", default=OCCUPANCY_DB_PATH, help="记录数据库路径")
+    parser.add_argument("--identity", help="使用 Cookie 映射中指定账号的 Cookie (默认: 最近获取的 Cookie)")
+    parser.add_argument("--once", action="store_true", help="只采样一轮")
+    args = parser.parse_args(argv)
+    if not load_mappings() or not ROOM_ID_TO_NAME:
+        print("错误：加载映射失败，无法继续。"); return 2
+    try: lib_ids = [resolve_room(part.strip())[0] for part in args.rooms.split(",") if part.strip()] if args.rooms else None
+    except ValueError as e: print(f"错误: {e}"); return 2
+    recorder = OccupancyRecorder(OccupancyStore(args.db), args.interval, lib_ids, cookie_provider=lambda: find_cookie(identity=args.identity))
+    if args.once:
+        print(f"写入 {recorder.record_once()} 条快照。"); return 0
+    print(f"开始记录 {len(lib_ids) if lib_ids else len(ROOM_ID_TO_NAME)} 个阅览室，间隔 {args.interval} 秒，按 Ctrl-C 停止。")
+    recorder.start()
+    try:
+        while True: time.sleep(60); print(f"已采样 {recorder.stats['rounds']} 轮，写入 {recorder.stats['written']} 条快照，失败 {recorder.stats['errors']} 次。")
+    except KeyboardInterrupt: recorder.stop()
+    return 0
+
+
+def replay_recording(path: str, speed: float = 1.0) -> Tuple[str, SeatJob, float, int, Optional[Dict[str, Any]]]:
+    """
+    用录制文件中的交换代替服务器，重新执行一次录制的任务。计划执行时间按录制时距执行时间的间隔 (除以 speed) 设置，
+    提前量与录制时相同。返回 (结果, 任务, 耗时秒数, 未使用的交换数, 录制的结束记录)。
+    """
+    header, events, end = read_recording(path)
+    fire_at, started_at = header.get("fire_at"), header.get("started_at") or time.time()
+    start_dt = None
+    if fire_at:
+        pre_fire = (fire_at - started_at) / speed if speed > 0 else 0.0
+        start_dt = datetime.datetime.now() + datetime.timedelta(seconds=max(pre_fire, (header.get("fire_lead_ms") or 0) / 1000 + 0.05))
+    job = SeatJob(int(header["mode"]), "Authorization=<redacted>", int(header["lib_id"]), [tuple(target) for target in header["seat_targets"]],
+                  start_dt, name=f"replay-{header.get('name') or header['job_id']}")
+    job.fire_lead_ms = header.get("fire_lead_ms") or 0
+    job.recording, job.transport = False, ReplayTransport(events, speed)
+    job.arm_deadline()
+    started = time.perf_counter()
+    result = run_seat_job(job)
+    elapsed = time.perf_counter() - started
+    unused = sum(1 for event in events[job.transport.position:] if event["kind"] not in ("ws_send", "ws_close"))
+    return result, job, elapsed, unused, end
+
+
+def run_replay_cli(argv: List[str]) -> int:
+    """`beta.py replay <录制文件>`：离线回放录制的任务，检查结果是否与录制时一致，并测量耗时。"""
+    import argparse
+    parser = argparse.ArgumentParser(prog="beta.py replay", description="回放录制的服务器交换 (不访问网络)")
+    parser.add_argument("recording", help=f"录制文件 (默认写在 {RECORDINGS_DIR})")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速度倍数: 1 为原始速度，10 为快 10 倍，0 为不等待")
+    parser.add_argument("--runs", type=int, default=1, help="重复回放的次数 (用于基准测试)")
+    parser.add_argument("--quiet", action="store_true", help="只输出每次回放的结果 (不输出任务执行日志)")
+    args = parser.parse_args(argv)
+    global OUTCOME_RECORDING, LEARN_SEAT_MAPS
+    OUTCOME_RECORDING = LEARN_SEAT_MAPS = False # 回放不写入尝试结果，也不根据录制的响应更新座位图
+    if args.quiet: setup_logging("WARNING")
+    try: header, events, end = read_recording(args.recording)
+    except (OSError, ValueError) as e: print(f"错误: 无法读取录制文件 {args.recording}: {e}"); return 2
+    fire_at = datetime.datetime.fromtimestamp(header["fire_at"]).strftime('%Y-%m-%d %H:%M:%S') if header.get("fire_at") else "立即执行"
+    print(f"录制的任务: {header.get('name')} (模式 {header['mode']}, 阅览室 {header['lib_id']}, 计划执行 {fire_at}, 提前量 {header.get('fire_lead_ms') or 0:.0f} ms)")
+    print(f"  {len(events)} 次交换，录制结果: {end['result'] if end else '未知 (录制未正常结束)'}")
+    timings: List[float] = []; mismatched = 0
+    for run in range(1, args.runs + 1):
+        result, job, elapsed, unused, _ = replay_recording(args.recording, args.speed)
+        timings.append(elapsed)
+        same = end is not None and result == end.get("result")
+        mismatched += not same
+        flush_logging(); setup_logging("WARNING" if args.quiet else None) # 先写出本次回放的日志
+        print(f"第 {run} 次回放: {result} | 耗时 {elapsed:.3f} s | {'与录制一致' if same else '与录制不一致'}" + (f" | {unused} 次录制的交换未被使用" if unused else ""))
+        if job.profile: print(f"  性能分析: {job.profile}")
+    if args.runs > 1:
+        timings.sort()
+        print(f"耗时: 最佳 {timings[0]:.3f} s, 中位数 {timings[len(timings) // 2]:.3f} s, 最差 {timings[-1]:.3f} s")
+    return 1 if mismatched else 0
+
+
 # --- Web Server Code (Only if dependencies met) ---
 # Global manager instance and templates defined conditionally
 manager = None
@@ -927,6 +3524,10 @@ templates = None
 if WEB_DEPENDENCIES_MET and app: # Check if FastAPI and dependencies were imported AND app was initialized
     print("Web 依赖项已找到。Web 服务器功能已启用。")
 
+    async def run_in_thread(func: Callable[..., Any], *args: Any) -> Any:
+        """在默认线程池中执行阻塞调用，不阻塞事件循环 (asyncio.to_thread 需要 Python 3.9)。"""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
     # --- Setup Jinja2 Templates ---
     if not os.path.isdir(TEMPLATES_DIR):
          print(f"警告: Templates 目录 '{TEMPLATES_DIR}' 未找到。Web 界面将无法加载。")
@@ -948,32 +3549,131 @@ if WEB_DEPENDENCIES_MET and app: # Check if FastAPI and dependencies were import
                 try: await websocket.send_json(payload)
                 except Exception as e: print(f"Error sending WS ({payload.get('type', 'message')}) to {client_id}: {e}"); self.disconnect(client_id)
         async def send_status_update(self, client_id: str, message: str): await self._send_json_safe(client_id, {"type": "status", "message": message})
-        async def send_final_result(self, client_id: str, status: str, message: str, error_code: Optional[str] = None):
+        async def send_final_result(self, client_id: str, status: str, message: str, error_code: Optional[str] = None, job_id: Optional[str] = None):
             payload = {"type": "result", "status": status, "message": message};
             if error_code: payload["error_code"] = error_code
+            if job_id: payload["job_id"] = job_id
             await self._send_json_safe(client_id, payload)
         async def send_cookie_update(self, client_id: str, cookie: str): await self._send_json_safe(client_id, {"type": "cookie_update", "cookie": cookie})
 
     if WebSocket and asyncio: manager = ConnectionManager() # Instantiate manager
     else: manager = None; print("错误：无法初始化 ConnectionManager (缺少 WebSocket 或 asyncio)")
 
+    # --- Precomputed Responses ---
+    class CachedResponse:
+        """
+        预先编码好的响应体 (及其 gzip 版本) 和强 ETag。
+        客户端带 If-None-Match 重新验证且内容未变时直接返回 304，不再序列化或渲染。
+        """
+        __slots__ = ("body", "gzipped", "etag", "media_type")
+
+        def __init__(self, body: bytes, media_type: str):
+            self.body, self.media_type = body, media_type
+            gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+            self.gzipped = gzipped if len(gzipped) < len(body) else None # 很小的响应压缩后反而更大
+            self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+        @staticmethod
+        def _accepts_gzip(accept_encoding: str) -> bool:
+            for part in accept_encoding.lower().split(","):
+                coding, _, params = part.partition(";")
+                if coding.strip() in ("gzip", "*"): return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+            return False
+
+        def respond(self, request: Request) -> Response: # type: ignore
+            use_gzip = self.gzipped is not None and self._accepts_gzip(request.headers.get("accept-encoding", ""))
+            etag = f'{self.etag[:-1]}-gzip"' if use_gzip else self.etag # 两种编码的字节不同，强 ETag 也必须不同
+            headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"} # no-cache: 可以缓存，但每次使用前重新验证
+            if_none_match = request.headers.get("if-none-match")
+            if if_none_match:
+                tags = {tag[2:] if tag.startswith("W/") else tag for tag in (part.strip() for part in if_none_match.split(","))} # 弱比较
+                if "*" in tags or self.etag in tags or f'{self.etag[:-1]}-gzip"' in tags:
+                    return Response(status_code=304, headers=headers)
+            if use_gzip: headers["Content-Encoding"] = "gzip"
+            return Response(content=self.gzipped if use_gzip else self.body, media_type=self.media_type, headers=headers)
+
+    def cached_json_response(mappings: MappingSnapshot, key: str, build: Callable[[], Any]) -> CachedResponse:
+        """按快照缓存的 JSON 响应：同一快照只序列化一次，映射重载后自动失效 (随旧快照一起丢弃)。"""
+        cached = mappings.responses.get(key)
+        if cached is None: # 并发时可能重复生成，结果相同，无需加锁
+            body = json.dumps(build(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            cached = mappings.responses[key] = CachedResponse(body, "application/json")
+        return cached
+
+    def mappings_response(mappings: MappingSnapshot) -> CachedResponse:
+        return cached_json_response(mappings, "rooms", lambda: {
+            "rooms": dict(sorted(mappings.rooms.items(), key=lambda item: item[1])), "version": mappings.version})
+
+    MAPPING_REGISTRY.add_listener(mappings_response) # 加载映射时就生成 /api/mappings 的响应
+
+    # --- Startup / Shutdown: persisted jobs ---
+    @app.on_event("startup")
+    async def restore_persisted_jobs():
+        """Re-arms jobs that were still pending when the server last stopped."""
+        if not ROOM_ID_TO_NAME: load_mappings()
+        MAPPING_REGISTRY.watch() # 映射文件变化后自动重载，无需重启
+        if templates:
+            try: render_index_page(app.root_path) # 预先渲染主页
+            except Exception as e: print(f"预先渲染主页失败: {type(e).__name__} - {e}")
+        restored, expired = get_job_scheduler().restore_pending()
+        if restored or expired: print(f"已从任务数据库恢复 {restored} 个待执行任务，{expired} 个任务已过期或结果未知，未执行。")
+
+    occupancy_recorder: Optional[OccupancyRecorder] = None
+
+    @app.on_event("startup")
+    async def start_occupancy_recorder():
+        """Starts the background occupancy recorder when OCCUPANCY_RECORD_INTERVAL > 0."""
+        global occupancy_recorder
+        if OCCUPANCY_RECORD_INTERVAL > 0 and occupancy_recorder is None:
+            occupancy_recorder = OccupancyRecorder(OccupancyStore(OCCUPANCY_DB_PATH), OCCUPANCY_RECORD_INTERVAL)
+            occupancy_recorder.start(); print(f"座位占用记录已启动，间隔 {OCCUPANCY_RECORD_INTERVAL} 秒。")
+
+    @app.on_event("shutdown")
+    async def flush_job_store():
+        if occupancy_recorder: occupancy_recorder.stop()
+        MAPPING_REGISTRY.stop()
+        scheduler = get_job_scheduler()
+        if scheduler.store: scheduler.store.flush()
+        if hasattr(scheduler.runner, "close"): scheduler.runner.close() # 停止工作进程
+
     # --- API Endpoint for Mappings ---
     @app.get("/api/mappings")
-    async def get_mappings():
+    async def get_mappings(request: Request): # type: ignore
+        """Room list sorted by name; served from the bytes encoded when the mappings were loaded (ETag / 304, gzip)."""
         if not ROOM_ID_TO_NAME:
              if not load_mappings(): raise HTTPException(status_code=500, detail="服务器无法加载阅览室映射数据。")
-        sorted_rooms = dict(sorted(ROOM_ID_TO_NAME.items(), key=lambda item: item[1]))
-        return {"rooms": sorted_rooms}
+        return mappings_response(current_mappings()).respond(request)
+
+    @app.get("/api/rooms/{lib_id}/seats")
+    async def get_room_seats(lib_id: str, request: Request): # type: ignore
+        """Seat map of one room ({seat_number: seat_key}), so the page can check seat numbers before submitting."""
+        mappings = current_mappings()
+        room_name = mappings.rooms.get(lib_id)
+        if not room_name: raise HTTPException(status_code=404, detail=f"无效阅览室 ID ({lib_id})")
+        if room_name not in mappings.seats: raise HTTPException(status_code=404, detail=f"未找到阅览室 '{room_name}' 座位图")
+        return cached_json_response(mappings, f"seats:{lib_id}", lambda: {
+            "libId": lib_id, "room": room_name, "seats": mappings.seats[room_name], "version": mappings.version}).respond(request)
+
+    @app.post("/api/mappings/reload")
+    async def reload_mappings():
+        """Re-reads the mapping files now instead of waiting for the watcher; jobs already submitted keep their snapshot."""
+        changed = await run_in_thread(MAPPING_REGISTRY.reload, True)
+        mappings = current_mappings()
+        if not mappings.rooms: raise HTTPException(status_code=500, detail="服务器无法加载阅览室映射数据。")
+        return {"reloaded": changed, "version": mappings.version, "rooms": len(mappings.rooms), "seat_maps": len(mappings.seats)}
 
     # --- Pydantic Model ---
     if BaseModel and Field and validator: # Check required Pydantic parts
         class SeatRequestWeb(BaseModel):
             mode: int = Field(..., description="操作模式: 1-明日预约, 2-立即抢座")
-            cookieStr: str = Field(..., description="用户 Cookie")
+            cookieStr: str = Field("", description="用户 Cookie (与 cookieIdentity 二选一)")
+            cookieIdentity: str = Field("", description="Cookie 映射中的账号身份，cookieStr 为空时使用")
             timeStr: str = Field("", description="执行时间 (HH:MM:SS)")
             libId: int = Field(..., description="阅览室 ID")
             seatNumber: str = Field(..., description="用户输入的座位号")
             clientId: str = Field(..., description="WebSocket 客户端 ID")
+            profile: bool = Field(False, description="对该任务做性能分析 (结果见 /api/jobs/{job_id}/profile)")
+            record: bool = Field(False, description="录制该任务与服务器的交换 (见 beta.py replay)")
             @validator('mode')
             def mode_must_be_1_or_2(cls, v):
                 # 1. Check if None (e.g., if frontend sent null explicitly)
@@ -1005,41 +3705,67 @@ if WEB_DEPENDENCIES_MET and app: # Check if FastAPI and dependencies were import
                     exec_dt = calculate_execution_dt(time_str, check_window=False)
                     if exec_dt is None: raise ValueError(f"抢座时间 '{time_str}' 无效或已过")
                 return time_str
-    else: SeatRequestWeb = None; print("警告：Pydantic 模型未定义 (缺少依赖)")
 
-    # --- Background Task Wrapper for Seat Operation ---
-    # Needs BackgroundTasks, manager, perform_seat_operation
-    if BackgroundTasks and manager and callable(perform_seat_operation):
-        def run_seat_operation_task(client_id: str, mode: int, cookie: str, lib_id: int, seat_key: str, start_dt: Optional[datetime.datetime], background_tasks: BackgroundTasks): # type: ignore
-            """Wrapper to run seat operation and send updates via WS."""
+        class SeatBatchItemWeb(BaseModel):
+            name: str = Field("", description="任务名称 (可选，用于区分结果)")
+            mode: int = Field(..., description="操作模式: 1-明日预约, 2-立即抢座")
+            cookieStr: str = Field("", description="用户 Cookie (与 cookieIdentity 二选一)")
+            cookieIdentity: str = Field("", description="Cookie 映射中的账号身份")
+            timeStr: str = Field("", description="执行时间 (HH:MM:SS)")
+            libId: int = Field(..., description="阅览室 ID")
+            seatNumbers: List[str] = Field(default_factory=list, description="按优先级排列的座位号")
+            seatKeys: List[str] = Field(default_factory=list, description="直接指定的座位 Key (无座位图时使用)")
+            nearby: int = Field(0, description="自动追加距首选座位最近的 N 个空闲座位作为备选")
+            reorder: bool = Field(False, description="按历史成功概率重新排列候选座位")
+            profile: bool = Field(False, description="对该任务做性能分析")
+            record: bool = Field(False, description="录制该任务与服务器的交换")
+
+        class SeatBatchRequestWeb(BaseModel):
+            clientId: str = Field("", description="接收所有任务状态的 WebSocket 客户端 ID (可选)")
+            items: List[SeatBatchItemWeb] = Field(..., description="任务列表")
+    else: SeatRequestWeb = None; SeatBatchRequestWeb = None; print("警告：Pydantic 模型未定义 (缺少依赖)")
+
+    def admission_error_response(error: AdmissionError) -> JSONResponse: # type: ignore
+        """429 (容量已满，带 Retry-After) 或 409 (座位冲突) 响应。"""
+        headers = {"Retry-After": str(error.retry_after)} if error.retry_after else None
+        print(f"任务未被接纳 ({error.status_code}): {error}")
+        return JSONResponse(status_code=error.status_code, headers=headers,
+                            content={"status": "rejected", "detail": str(error), "retry_after": error.retry_after})
+
+    # --- Job -> WebSocket Bridge ---
+    # Jobs run in scheduler worker threads; status is forwarded to the event loop thread-safely.
+    if manager and callable(perform_seat_operation):
+        def attach_job_to_websocket(job: SeatJob, client_id: str, loop: asyncio.AbstractEventLoop, prefix: str = "") -> None:
+            """
+            Routes a job's status updates and final result to a WebSocket client. Callbacks
+            are added alongside existing ones, so a coalesced duplicate does not take over
+            the first submitter's updates; attaching the same client twice is a no-op.
+            """
+            if any(getattr(callback, "client_id", None) == client_id for callback in job.status_callbacks): return
             def ws_status_callback_sync(message: str):
-                if manager: background_tasks.add_task(manager.send_status_update, client_id, message)
-
-            print(f"[Task {client_id}] Starting background operation...")
-            final_result = perform_seat_operation(mode, cookie, lib_id, seat_key, start_dt, ws_status_callback_sync)
-            print(f"[Task {client_id}] Background operation finished with result: {final_result}")
-
-            status_code_ws = "success" if final_result.startswith("成功") else "error"
-            user_message = final_result; error_code_ws = None
-            if final_result == SEAT_TAKEN_ERROR_CODE:
-                status_code_ws = "error"
-                room_name_for_msg = ROOM_ID_TO_NAME.get(str(lib_id), f"ID {lib_id}")
-                seat_num_for_msg = "[未知Key]"
-                if room_name_for_msg in SEAT_MAPPINGS:
-                     reverse_map = {v: k for k, v in SEAT_MAPPINGS[room_name_for_msg].items()}
-                     seat_num_for_msg = reverse_map.get(seat_key, "[未知Key]")
-                user_message = f"该座位 (阅览室: {room_name_for_msg}, 座位号: {seat_num_for_msg}) 已被占用，请重选。"
-                error_code_ws = SEAT_TAKEN_ERROR_CODE
-            if manager: background_tasks.add_task(manager.send_final_result, client_id, status_code_ws, user_message, error_code_ws)
-    else: run_seat_operation_task = None; print("警告：座位操作后台任务包装器未定义 (缺少依赖)")
+                if manager: asyncio.run_coroutine_threadsafe(manager.send_status_update(client_id, f"{prefix}{message}"), loop)
+
+            def ws_final_result(finished_job: SeatJob):
+                print(f"[Job {finished_job.job_id}] Client={client_id} finished with result: {finished_job.result}")
+                payload = job_result_payload(finished_job)
+                if manager:
+                    asyncio.run_coroutine_threadsafe(
+                        manager.send_final_result(client_id, payload["status"], f"{prefix}{payload['message']}", payload.get("error_code"), finished_job.job_id), loop)
+
+            ws_status_callback_sync.client_id = client_id # type: ignore[attr-defined]
+            job.status_callbacks.append(ws_status_callback_sync)
+            job.done_callbacks.append(ws_final_result)
+    else: attach_job_to_websocket = None; print("警告：任务 WebSocket 推送未定义 (缺少依赖)")
 
     # --- Background Task for Cookie Watching ---
     # Needs asyncio, os, time, stat, manager, etc.
     if asyncio and manager:
-        async def watch_cookie_file_task(client_id: str):
+        async def watch_cookie_file_task(client_id: str, client_host: Optional[str] = None):
             """
             Starts mitmproxy IF NEEDED, guides user, monitors cookie file,
-            and sends updates via WS.
+            and sends updates via WS. client_host is the browser's address; cookies
+            captured from the same address are preferred when several accounts share
+            the proxy, which only helps when the browser and WeChat run on one machine.
             """
             # --- 1. 尝试启动 mitmproxy (同步调用) ---
             # 注意：在异步函数中直接调用可能阻塞事件循环，但启动过程通常很快
@@ -1074,6 +3800,14 @@ if WEB_DEPENDENCIES_MET and app: # Check if FastAPI and dependencies were import
 
             while time.time() - start_time < MAX_WAIT_TIME and not cookie_found:
                 await asyncio.sleep(FILE_CHECK_INTERVAL) # 异步等待
+                mapped_cookie = find_cookie(client_host=client_host, since=start_time)
+                if mapped_cookie:
+                    if manager:
+                        await manager.send_status_update(client_id, "Cookie 读取成功！")
+                        await manager.send_cookie_update(client_id, mapped_cookie)
+                        await manager.send_status_update(client_id, "Cookie 已自动填充。")
+                        await manager.send_status_update(client_id, "提示：可取消系统代理。")
+                    cookie_found = True; break
                 if os.path.exists(COOKIE_FILE_PATH):
                     try:
                         current_mtime = os.stat(COOKIE_FILE_PATH)[stat.ST_MTIME]
@@ -1118,22 +3852,28 @@ if WEB_DEPENDENCIES_MET and app: # Check if FastAPI and dependencies were import
     else: watch_cookie_file_task = None; print("警告：Cookie监控后台任务未定义 (缺少依赖)")
 
     # --- API Endpoint for Seat Request ---
-    if SeatRequestWeb and BackgroundTasks and run_seat_operation_task and HTTPException and JSONResponse and manager:
+    if SeatRequestWeb and attach_job_to_websocket and HTTPException and JSONResponse and manager:
         @app.post("/api/submit_request")
-        async def handle_seat_request(request: SeatRequestWeb, background_tasks: BackgroundTasks): # type: ignore
-            """Handles seat request, validates, starts background task."""
+        async def handle_seat_request(request: SeatRequestWeb): # type: ignore
+            """Handles seat request, validates, enqueues it into the job scheduler."""
             # Print received data with type check for mode
             print(f"\n收到 Web 请求: Client={request.clientId}, Mode={request.mode} (Type: {type(request.mode)}), LibID={request.libId}, SeatNo='{request.seatNumber}', Time='{request.timeStr}'")
             if not manager: raise HTTPException(status_code=503, detail="WebSocket管理器未初始化")
 
-            lib_id_str = str(request.libId); room_name = ROOM_ID_TO_NAME.get(lib_id_str)
+            lib_id_str = str(request.libId); mappings = current_mappings(); room_name = mappings.rooms.get(lib_id_str)
             if not room_name: raise HTTPException(status_code=404, detail=f"无效阅览室 ID ({request.libId})")
-            seat_map_for_room = SEAT_MAPPINGS.get(room_name)
+            seat_map_for_room = mappings.seats.get(room_name)
             if not seat_map_for_room: raise HTTPException(status_code=404, detail=f"未找到阅览室 '{room_name}' 座位图")
             seat_number_as_key = request.seatNumber.strip(); found_coordinate_key = seat_map_for_room.get(seat_number_as_key)
 
             if found_coordinate_key is None:
                 raise HTTPException(status_code=404, detail=f"在 '{room_name}' 中未找到座位号 '{seat_number_as_key}'")
+            cookie_str = request.cookieStr.strip()
+            if not cookie_str and request.cookieIdentity:
+                if not WEB_SHARE_COOKIE_IDENTITIES: raise HTTPException(status_code=403, detail="服务器未开启 WEB_SHARE_COOKIE_IDENTITIES，不能使用 cookieIdentity")
+                cookie_str = find_cookie(identity=request.cookieIdentity) or ""
+                if not cookie_str: raise HTTPException(status_code=404, detail=f"Cookie 映射中未找到账号 '{request.cookieIdentity}'")
+            if not cookie_str: raise HTTPException(status_code=400, detail="必须提供 cookieStr 或 cookieIdentity")
             print(f"查找成功: Room='{room_name}', SeatNo='{seat_number_as_key}' -> Key='{found_coordinate_key}'")
             start_action_dt_web = None
             try:
@@ -1145,11 +3885,271 @@ if WEB_DEPENDENCIES_MET and app: # Check if FastAPI and dependencies were import
                     if start_action_dt_web is None: raise ValueError(f"抢座时间 '{request.timeStr}' 无效")
             except ValueError as e: raise HTTPException(status_code=400, detail=str(e))
 
-            background_tasks.add_task( run_seat_operation_task, request.clientId, request.mode, request.cookieStr, request.libId, found_coordinate_key, start_action_dt_web, background_tasks)
-            print(f"任务已添加: Client={request.clientId}, Key={found_coordinate_key}")
-            return JSONResponse(content={"status": "processing", "message": "请求已提交后台处理，请通过 WebSocket 查看状态。"})
+            job = SeatJob(request.mode, cookie_str, request.libId, [(seat_number_as_key, found_coordinate_key)], start_action_dt_web)
+            job.profiling, job.recording = job.profiling or request.profile, job.recording or request.record
+            loop = asyncio.get_running_loop()
+            attach_job_to_websocket(job, request.clientId, loop)
+            try: scheduled_job = get_job_scheduler().submit(job)
+            except AdmissionError as e: return admission_error_response(e)
+            if scheduled_job is not job:
+                attach_job_to_websocket(scheduled_job, request.clientId, loop)
+                print(f"重复任务已合并: Client={request.clientId}, Job={scheduled_job.job_id}")
+                return JSONResponse(content={"status": "processing", "job_id": scheduled_job.job_id, "coalesced": True, "message": "相同账号已提交过该座位/时刻的任务，已合并到现有任务。"})
+            print(f"任务已添加: Client={request.clientId}, Job={job.job_id}, Key={found_coordinate_key}")
+            return JSONResponse(content={"status": "processing", "job_id": job.job_id, "message": "请求已提交后台处理，请通过 WebSocket 查看状态。"})
     else: print("警告：座位请求 API 端点 (/api/submit_request) 未定义 (缺少依赖)")
 
+    # --- API Endpoint for Batch Seat Requests ---
+    if SeatBatchRequestWeb and attach_job_to_websocket and HTTPException and JSONResponse:
+        @app.post("/api/submit_batch")
+        async def handle_seat_batch(request: SeatBatchRequestWeb): # type: ignore
+            """
+            Validates all items in one pass against the loaded mappings, then enqueues
+            them atomically: either every item is scheduled or none is.
+            """
+            print(f"\n收到批量 Web 请求: Client={request.clientId or '-'}, Items={len(request.items)}")
+            if not request.items: raise HTTPException(status_code=400, detail="items 不能为空")
+            if not WEB_SHARE_COOKIE_IDENTITIES and any(item.cookieIdentity and not item.cookieStr.strip() for item in request.items):
+                raise HTTPException(status_code=403, detail="服务器未开启 WEB_SHARE_COOKIE_IDENTITIES，不能使用 cookieIdentity")
+            jobs: List[SeatJob] = []; errors: List[Dict[str, Any]] = []
+            def validate_items() -> None: # nearby 可能需要请求实时座位状态，放到线程中执行
+                for index, item in enumerate(request.items):
+                    spec = {"name": item.name, "mode": item.mode, "cookie": item.cookieStr, "cookie_identity": item.cookieIdentity,
+                            "room": item.libId, "seats": item.seatNumbers, "seat_keys": item.seatKeys, "time": item.timeStr,
+                            "nearby": item.nearby, "reorder": item.reorder, "profile": item.profile,
+                            "record": item.record}
+                    try: jobs.append(build_job_from_spec(spec, index))
+                    except ValueError as e: errors.append({"index": index, "name": item.name, "error": str(e)})
+            await run_in_thread(validate_items)
+            if errors:
+                return JSONResponse(status_code=400, content={"status": "rejected", "message": f"{len(errors)} 个任务校验失败，未提交任何任务。", "errors": errors})
+
+            loop = asyncio.get_running_loop()
+            if request.clientId:
+                for job in jobs: attach_job_to_websocket(job, request.clientId, loop, prefix=f"[{job.name}] ")
+            try: scheduled_jobs = get_job_scheduler().submit_many(jobs)
+            except AdmissionError as e: return admission_error_response(e)
+            if request.clientId:
+                for job, scheduled_job in zip(jobs, scheduled_jobs):
+                    if scheduled_job is not job: attach_job_to_websocket(scheduled_job, request.clientId, loop, prefix=f"[{job.name}] ")
+            print(f"批量任务已添加: {len(jobs)} 个, Client={request.clientId or '-'}")
+            return JSONResponse(content={
+                "status": "processing", "message": f"{len(jobs)} 个任务已提交后台处理。",
+                "jobs": [{"index": index, "name": job.name, "job_id": scheduled_job.job_id, "coalesced": scheduled_job is not job,
+                          "seats": [number for number, _ in scheduled_job.seat_targets], "stagger_ms": scheduled_job.stagger_ms}
+                         for index, (job, scheduled_job) in enumerate(zip(jobs, scheduled_jobs))],
+            })
+    else: print("警告：批量请求 API 端点 (/api/submit_batch) 未定义 (缺少依赖)")
+
+    # --- Job Status & Event Log Endpoints ---
+    def _find_job(job_id: str) -> Optional[SeatJob]:
+        scheduler = get_job_scheduler()
+        job = scheduler.jobs.get(job_id)
+        if job is None and scheduler.store:
+            record = scheduler.store.get(job_id)
+            if record:
+                job = job_from_record(record); job.state = record["state"]; job.result = record["result"]
+                if job.state == "done": job.events.append("result", job_id=job.job_id, **job_result_payload(job)) # 事件日志只在内存中
+        return job
+
+    @app.get("/api/jobs/{job_id}")
+    async def get_job_status(job_id: str, since: int = 0):
+        """Returns the job's current state plus logged events newer than `since`."""
+        job = _find_job(job_id)
+        if not job: raise HTTPException(status_code=404, detail=f"任务 '{job_id}' 不存在")
+        events, dropped = job.events.since(since)
+        return {**job.to_dict(), "last_event_id": job.events.last_id, "events": events, "events_dropped": dropped}
+
+    @app.get("/api/jobs/{job_id}/profile")
+    async def get_job_profile(job_id: str, format: str = "file"):
+        """
+        Downloads the job's profile (.prof for cProfile, .folded stacks for the sampler).
+        format=text returns the 40 most expensive functions of a .prof by cumulative time.
+        """
+        path = find_profile_file(job_id)
+        if not path:
+            job = _find_job(job_id)
+            if job and job.profiling and job.state != "done": raise HTTPException(status_code=409, detail=f"任务 '{job_id}' 尚未结束，性能分析文件还未生成")
+            raise HTTPException(status_code=404, detail=f"任务 '{job_id}' 没有性能分析文件")
+        if format == "text" and path.endswith(".prof"):
+            import io, pstats
+            out = io.StringIO()
+            pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(40)
+            return Response(content=out.getvalue(), media_type="text/plain; charset=utf-8")
+        return FileResponse(path, filename=os.path.basename(path), media_type="application/octet-stream")
+
+    @app.delete("/api/jobs/{job_id}")
+    async def cancel_job(job_id: str):
+        """
+        Cancels a scheduled or running job. Scheduled jobs end immediately; running jobs
+        stop at their next checkpoint (countdown, retry wait or queue socket) and the
+        response reports state "running" until the worker has exited.
+        """
+        scheduler = get_job_scheduler()
+        job = scheduler.cancel(job_id, "用户通过 API 取消")
+        if job is None:
+            if _find_job(job_id): raise HTTPException(status_code=409, detail=f"任务 '{job_id}' 已结束，无法取消")
+            raise HTTPException(status_code=404, detail=f"任务 '{job_id}' 不存在")
+        if job.state == "done" and not job.cancelled:
+            raise HTTPException(status_code=409, detail=f"任务 '{job_id}' 已结束，无法取消")
+        await run_in_thread(job.done_event.wait, 2) # 给执行中的任务一点时间退出，多数情况下可直接返回最终状态
+        return {"job_id": job.job_id, "state": job.state, "result": job.result, "cancelled": job.cancel_token.cancelled}
+
+    if StreamingResponse:
+        @app.get("/api/jobs/{job_id}/events")
+        async def stream_job_events(job_id: str, request: Request, last_event_id: int = 0): # type: ignore
+            """
+            Server-sent event stream of the job's event log. Resumes after the
+            Last-Event-ID header (sent automatically by EventSource on reconnect)
+            or the last_event_id query parameter; ends after the result event.
+            """
+            job = _find_job(job_id)
+            if not job: raise HTTPException(status_code=404, detail=f"任务 '{job_id}' 不存在")
+            header_id = request.headers.get("last-event-id", "")
+            start_id = int(header_id) if header_id.isdigit() else last_event_id
+
+            async def event_stream():
+                seen_id = start_id
+                yield f"retry: 3000\n\n"
+                while True:
+                    events, dropped = job.events.since(seen_id)
+                    if dropped: yield f"event: gap\ndata: {json.dumps({'type': 'gap', 'after': seen_id})}\n\n"
+                    for event in events:
+                        seen_id = event["id"]
+                        yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+                        if event["type"] == "result": return
+                    if job.state == "done" and job.events.last_id <= seen_id:
+                        # 结果事件已不在日志中 (如服务器重启后客户端带着旧的 Last-Event-ID 重连)：仍发送结果，否则 EventSource 会不断重连
+                        yield f"event: result\ndata: {json.dumps({'type': 'result', 'job_id': job.job_id, **job_result_payload(job)}, ensure_ascii=False)}\n\n"
+                        return
+                    if await request.is_disconnected(): return
+                    if not await job.events.wait(seen_id, SSE_KEEPALIVE_SECONDS): yield ": keep-alive\n\n"
+
+            return StreamingResponse(event_stream(), media_type="text/event-stream",
+                                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    # --- API Endpoint for Cookie Identities ---
+    @app.get("/api/cookies")
+    async def list_cookie_identities():
+        """
+        Identities in the cookie map (never any part of the cookie). Only available
+        when WEB_SHARE_COOKIE_IDENTITIES is enabled, since the API is unauthenticated.
+        """
+        if not WEB_SHARE_COOKIE_IDENTITIES: raise HTTPException(status_code=403, detail="服务器未开启 WEB_SHARE_COOKIE_IDENTITIES")
+        identities = [
+            {"identity": identity, "client": entry.get("client"), "updated_at": entry.get("updated_at")}
+            for identity, entry in load_cookie_map().items() if isinstance(entry, dict)
+        ]
+        identities.sort(key=lambda item: item["updated_at"] or 0, reverse=True)
+        return {"identities": identities}
+
+    # --- API Endpoint for Live Availability ---
+    def _availability_cookie(request: Request, identity: str) -> Optional[str]: # type: ignore
+        header_cookie = request.headers.get("x-igolib-cookie", "").strip()
+        if header_cookie or not WEB_SHARE_COOKIE_IDENTITIES: return header_cookie or None
+        return find_cookie(identity=identity or None)
+
+    @app.get("/api/availability")
+    async def get_availability(request: Request, libIds: str = "", seats: bool = False, identity: str = ""):
+        """
+        Live seat counts for the given rooms (comma-separated libIds, default: all rooms),
+        optionally with per-seat status. Results are shared by all clients and cached for
+        AVAILABILITY_TTL_SECONDS. Refreshing needs a cookie: the X-Igolib-Cookie header or,
+        with WEB_SHARE_COOKIE_IDENTITIES, the `identity` from the cookie map (else the most
+        recently captured cookie).
+        """
+        if not ROOM_ID_TO_NAME and not load_mappings(): raise HTTPException(status_code=500, detail="服务器无法加载阅览室映射数据。")
+        try: lib_ids = [int(part) for part in libIds.split(",") if part.strip()] or [int(lib_id) for lib_id in ROOM_ID_TO_NAME]
+        except ValueError: raise HTTPException(status_code=400, detail="libIds 必须是逗号分隔的阅览室 ID")
+        unknown = [lib_id for lib_id in lib_ids if str(lib_id) not in ROOM_ID_TO_NAME]
+        if unknown: raise HTTPException(status_code=404, detail=f"未知的阅览室 ID: {unknown}")
+        cookie = _availability_cookie(request, identity)
+        results, errors = await run_in_thread(get_availability_service().rooms, lib_ids, cookie)
+        now_ts = time.time()
+        rooms = {str(lib_id): {**{k: v for k, v in room.items() if not k.startswith("_") and (k != "seats" or seats)},
+                               "age_s": round(now_ts - room["fetched_at"], 2)}
+                 for lib_id, room in results.items()}
+        if errors and not results: raise HTTPException(status_code=502, detail=next(iter(errors.values())))
+        return {"ttl": get_availability_service().cache.ttl, "rooms": rooms, "errors": {str(k): v for k, v in errors.items()}}
+
+    @app.get("/api/availability/{lib_id}/nearest")
+    async def get_nearest_seats(lib_id: int, request: Request, seat: str, n: int = 5, identity: str = ""):
+        """The n free seats closest to `seat` (seat number or key), nearest first."""
+        if str(lib_id) not in ROOM_ID_TO_NAME: raise HTTPException(status_code=404, detail=f"未知的阅览室 ID: {lib_id}")
+        if not 1 <= n <= 100: raise HTTPException(status_code=400, detail="n 必须在 1-100 之间")
+        cookie = _availability_cookie(request, identity)
+        try: nearby = await run_in_thread(find_nearby_seats, lib_id, seat, n, cookie)
+        except ValueError as e: raise HTTPException(status_code=404, detail=str(e))
+        live = get_availability_service().cache.peek(lib_id) is not None
+        return {"lib_id": lib_id, "seat": seat, "live": live,
+                "seats": [{"number": number, "key": key, "x": x, "y": y, "distance": distance} for number, key, x, y, distance in nearby]}
+
+    @app.get("/api/availability/{lib_id}/region")
+    async def get_free_seats_in_region(lib_id: int, request: Request, x0: int, y0: int, x1: int, y1: int, identity: str = ""):
+        """Free seats inside the layout rectangle [x0, x1] x [y0, y1], ordered by row."""
+        if str(lib_id) not in ROOM_ID_TO_NAME: raise HTTPException(status_code=404, detail=f"未知的阅览室 ID: {lib_id}")
+        cookie = _availability_cookie(request, identity)
+        try: room = await run_in_thread(get_availability_service().room, lib_id, cookie)
+        except ValueError as e: raise HTTPException(status_code=502, detail=str(e))
+        taken = room["_taken"]
+        seats = room["_index"].in_rect(x0, y0, x1, y1, accept=lambda key: key not in taken)
+        return {"lib_id": lib_id, "seats": [{"number": number, "key": key, "x": x, "y": y} for number, key, x, y in seats]}
+
+    # --- API Endpoint for Seat Contention ---
+    @app.get("/api/contention/{lib_id}")
+    async def get_seat_contention(lib_id: int, mode: int, timeStr: str = "", seats: str = ""):
+        """
+        Candidate seats (comma-separated numbers, default: every seat with history) ranked by
+        estimated win probability in the given window at our typical measured arrival time.
+        """
+        if str(lib_id) not in ROOM_ID_TO_NAME: raise HTTPException(status_code=404, detail=f"未知的阅览室 ID: {lib_id}")
+        if mode not in [1, 2]: raise HTTPException(status_code=400, detail="mode 必须是 1 或 2")
+        try: start_dt = resolve_execution_dt(mode, timeStr) if timeStr else None
+        except ValueError as e: raise HTTPException(status_code=400, detail=str(e))
+        store = get_outcome_store()
+        if seats:
+            try: targets = resolve_seat_targets(ROOM_ID_TO_NAME[str(lib_id)], [part for part in seats.split(",") if part.strip()])
+            except ValueError as e: raise HTTPException(status_code=400, detail=str(e))
+        else:
+            _, scores = await run_in_thread(store.seat_scores, lib_id, mode, outcome_window(start_dt))
+            targets = [(score["seat"], key) for key, score in scores.items()]
+        ranked = await run_in_thread(rank_seat_targets, lib_id, mode, start_dt, targets)
+        return {"lib_id": lib_id, "mode": mode, "window": outcome_window(start_dt), "seats": ranked}
+
+    # --- API Endpoint for Fire Offset Tuning ---
+    @app.get("/api/fire_offsets")
+    async def get_fire_offsets(mode: Optional[int] = None, timeStr: str = "", limit: int = 50):
+        """
+        Recent fire-lead decisions with the outcome history each was based on. With `mode` and
+        `timeStr`, also previews the lead the next job in that window would use.
+        """
+        store = get_outcome_store()
+        result: Dict[str, Any] = {"enabled": ADAPTIVE_FIRE_OFFSET, "bounds_ms": [FIRE_LEAD_MIN_MS, FIRE_LEAD_MAX_MS],
+                                  "decisions": await run_in_thread(store.recent_decisions, max(1, min(limit, 500)))}
+        if mode is not None:
+            if mode not in [1, 2]: raise HTTPException(status_code=400, detail="mode 必须是 1 或 2")
+            try: start_dt = resolve_execution_dt(mode, timeStr) if timeStr else None
+            except ValueError as e: raise HTTPException(status_code=400, detail=str(e))
+            result["next"] = await run_in_thread(store.decide_fire_lead, mode, outcome_window(start_dt))
+        return result
+
+    # --- API Endpoint for Occupancy History ---
+    @app.get("/api/occupancy/{lib_id}")
+    async def get_occupancy_history(lib_id: int, days: float = 30, bucket_minutes: int = 30, seat: str = ""):
+        """
+        Per-seat occupancy rate by time of day over the last `days`, from the
+        occupancy recorder's history. `seat` limits the result to comma-separated seat numbers.
+        """
+        if str(lib_id) not in ROOM_ID_TO_NAME: raise HTTPException(status_code=404, detail=f"未知的阅览室 ID: {lib_id}")
+        if bucket_minutes <= 0 or 1440 % bucket_minutes: raise HTTPException(status_code=400, detail="bucket_minutes 必须能整除 1440")
+        if not os.path.exists(OCCUPANCY_DB_PATH): raise HTTPException(status_code=404, detail="尚无座位占用记录 (请设置 OCCUPANCY_RECORD_INTERVAL 或运行 beta.py record)")
+        store = OccupancyStore(OCCUPANCY_DB_PATH)
+        stats = await run_in_thread(store.occupancy_by_time_of_day, lib_id, time.time() - days * 86400, bucket_minutes)
+        if seat:
+            wanted = {part.strip() for part in seat.split(",") if part.strip()}
+            stats["seats"] = {label: rates for label, rates in stats["seats"].items() if label in wanted}
+        return {"lib_id": lib_id, "name": ROOM_ID_TO_NAME.get(str(lib_id)), "days": days, **stats}
+
     # --- API Endpoint for Auto Cookie Get ---
     if BackgroundTasks and watch_cookie_file_task and manager and HTTPException and JSONResponse:
         @app.post("/api/start_auto_cookie_watch/{client_id}")
@@ -1158,7 +4158,9 @@ if WEB_DEPENDENCIES_MET and app: # Check if FastAPI and dependencies were import
             print(f"收到自动获取 Cookie 请求: Client={client_id}")
             if not manager: raise HTTPException(status_code=503, detail="WebSocket管理器未初始化")
             if client_id not in manager.active_connections: raise HTTPException(status_code=404, detail="客户端 WebSocket 未连接")
-            background_tasks.add_task(watch_cookie_file_task, client_id)
+            client_ws = manager.active_connections[client_id]
+            client_host = client_ws.client.host if client_ws.client else None
+            background_tasks.add_task(watch_cookie_file_task, client_id, client_host)
             print(f"已为 Client={client_id} 添加 Cookie 监控任务。")
             return JSONResponse(content={"status": "watching", "message": "已启动 Cookie 文件监控，请查看状态区域指南。"})
     else: print("警告：自动 Cookie 获取 API 端点 (/api/start_auto_cookie_watch) 未定义 (缺少依赖)")
@@ -1176,17 +4178,27 @@ if WEB_DEPENDENCIES_MET and app: # Check if FastAPI and dependencies were import
     else: print("警告：WebSocket 端点 (/ws/{client_id}) 未定义 (缺少依赖)")
 
     # --- HTML Frontend Endpoint ---
+    index_pages: Dict[str, Tuple[float, CachedResponse]] = {} # { root_path: (模板修改时间, 渲染结果) }
+
+    def render_index_page(root_path: str) -> CachedResponse:
+        """页面只依赖配置常量和 root_path，渲染一次后缓存；模板文件修改后重新渲染。"""
+        try: template_mtime = os.stat(os.path.join(TEMPLATES_DIR, "index.html")).st_mtime
+        except OSError: template_mtime = 0.0
+        cached = index_pages.get(root_path)
+        if cached is None or cached[0] != template_mtime:
+            context = { "root_path": root_path, "mappings_url": root_path + app.url_path_for('get_mappings'),
+                        "TOMORROW_RESERVE_WINDOW_START_STR": TOMORROW_RESERVE_WINDOW_START.strftime('%H:%M:%S'),
+                        "TOMORROW_RESERVE_WINDOW_END_STR": TOMORROW_RESERVE_WINDOW_END.strftime('%H:%M:%S'),
+                        "SEAT_TAKEN_ERROR_CODE": SEAT_TAKEN_ERROR_CODE }
+            html = templates.get_template("index.html").render(context)
+            cached = index_pages[root_path] = (template_mtime, CachedResponse(html.encode("utf-8"), "text/html; charset=utf-8"))
+        return cached[1]
+
     if Request and Jinja2Templates and templates and HTTPException:
         @app.get("/")
         async def get_index(request: Request): # type: ignore
              if not templates: raise HTTPException(status_code=500, detail="模板引擎未初始化。")
-             try: mappings_url = str(request.url_for('get_mappings'))
-             except Exception: mappings_url = "/api/mappings" # Fallback
-             context = { "request": request, "mappings_url": mappings_url,
-                         "TOMORROW_RESERVE_WINDOW_START_STR": TOMORROW_RESERVE_WINDOW_START.strftime('%H:%M:%S'),
-                         "TOMORROW_RESERVE_WINDOW_END_STR": TOMORROW_RESERVE_WINDOW_END.strftime('%H:%M:%S'),
-                         "SEAT_TAKEN_ERROR_CODE": SEAT_TAKEN_ERROR_CODE }
-             return templates.TemplateResponse("index.html", context)
+             return render_index_page(request.scope.get("root_path", "")).respond(request)
     else: print("警告：主页 HTML 端点 (/) 未定义 (缺少依赖)")
 
 # --- End of 'if WEB_DEPENDENCIES_MET and app:' block ---
@@ -1194,7 +4206,22 @@ if WEB_DEPENDENCIES_MET and app: # Check if FastAPI and dependencies were import
 # --- Main Execution Block ---
 if __name__ == "__main__":
     run_web_flag = '--web' in sys.argv
-    if run_web_flag:
+    if len(sys.argv) >= 2 and sys.argv[1] == 'batch': # Batch Mode
+        print("-" * 50); print("--- 批量任务模式 ---")
+        try: sys.exit(run_batch_cli(sys.argv[2:]))
+        except KeyboardInterrupt: print("\n操作被用户中断。"); sys.exit(130)
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'contention': # Seat Contention Ranking
+        sys.exit(run_contention_cli(sys.argv[2:]))
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'record': # Occupancy Recorder
+        print("-" * 50); print("--- 座位占用记录模式 ---")
+        sys.exit(run_record_cli(sys.argv[2:]))
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'replay': # Offline Replay
+        print("-" * 50); print("--- 回放模式 ---")
+        sys.exit(run_replay_cli(sys.argv[2:]))
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'node': # Multi-Node Mode
+        print("-" * 50); print("--- 多节点模式 ---")
+        sys.exit(run_node_cli(sys.argv[2:]))
+    elif run_web_flag:
         print("-" * 50); print("--- Web 服务器模式 ---")
         if not WEB_DEPENDENCIES_MET: sys.exit(1) # Message already printed
         if not app: print("\n❌ 错误：FastAPI 应用未能初始化。"); sys.exit(1)
@@ -1,11 +1,19 @@
 from mitmproxy import http
-from mitmproxy import ctx
+import base64
+import json
+import logging
 import re
 import os
+import tempfile
+import time
+
+# mitmproxy 9+ 推荐使用标准 logging 输出插件日志 (ctx.log 已在新版本中移除)
+logger = logging.getLogger(__name__)
 
 # --- 配置 ---
 # 监听设置新 Cookie 的那个 URL 的响应
 # 使用路径的关键部分进行匹配
+TARGET_HOST = "libseats.ldu.edu.cn"
 TARGET_URL_PATTERN = "/index.php/index/boot" # <--- 修改这里！
 # 要提取的 Cookie 名称
 TARGET_COOKIE_NAME = "Authorization"
@@ -14,87 +22,174 @@ OUTPUT_FILE = "latest_cookie.txt"
 # 获取脚本所在的目录来保存文件
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 OUTPUT_PATH = os.path.join(SCRIPT_DIR, OUTPUT_FILE)
+# 多账号 Cookie 映射文件 { 身份: {"cookie", "client", "updated_at"} }，供 beta.py 读取
+COOKIE_MAP_FILE = "latest_cookies.json"
+COOKIE_MAP_PATH = os.path.join(SCRIPT_DIR, COOKIE_MAP_FILE)
+# 用于识别账号的字段名 (依次在 Cookie 的 JWT 载荷和 boot 响应体中查找)
+IDENTITY_FIELDS = ("user_id", "userId", "uid", "openid", "sub")
+# 非目标流量的响应体直接流式转发，不在 mitmproxy 中缓存 (会导致 mitmweb 中看不到这些响应体)
+STREAM_NON_TARGET_BODIES = True
+
+# --- 预编译匹配器 ---
+# 主机名精确匹配 (允许带端口)，路径包含目标模式即可，避免对每个响应重复做子串查找
+TARGET_HOST_RE = re.compile(rf"^{re.escape(TARGET_HOST)}(?::\d+)?$", re.IGNORECASE)
+TARGET_PATH_RE = re.compile(re.escape(TARGET_URL_PATTERN))
+TARGET_COOKIE_RE = re.compile(rf"^\s*{re.escape(TARGET_COOKIE_NAME)}=([^;]+)", re.IGNORECASE)
+# 写在 flow.metadata 中的标记，表示该 flow 需要检查响应
+FLOW_MARK = "igolib_target"
 
 # 用于存储最新获取的 Cookie，防止重复写入相同内容
 last_extracted_cookie = None
+# 按账号身份保存的 Cookie，多个微信客户端共用一个代理时互不覆盖
+cookie_map = {}
+# 代理重启后保留之前已获取的其他账号的 Cookie
+try:
+    with open(COOKIE_MAP_PATH, "r", encoding='utf-8') as _f:
+        _existing = json.load(_f)
+    if isinstance(_existing, dict): cookie_map.update(_existing)
+except (OSError, ValueError):
+    pass
+
+# 统计计数器: seen = 经过代理的请求数, inspected = 实际检查响应的请求数
+stats = {"seen": 0, "inspected": 0, "extracted": 0}
+
+
+def is_target(host: str, path: str) -> bool:
+    """判断请求是否为需要提取 Cookie 的目标请求。"""
+    return TARGET_HOST_RE.match(host) is not None and TARGET_PATH_RE.search(path) is not None
+
+
+# mitmproxy 的事件钩子：收到完整请求头时触发，只在这里做一次匹配
+def requestheaders(flow: http.HTTPFlow) -> None:
+    stats["seen"] += 1
+    if is_target(flow.request.host, flow.request.path):
+        flow.metadata[FLOW_MARK] = True
+
+
+# mitmproxy 的事件钩子：收到响应头时触发，非目标流量不缓存响应体
+def responseheaders(flow: http.HTTPFlow) -> None:
+    if STREAM_NON_TARGET_BODIES and not flow.metadata.get(FLOW_MARK) and flow.response:
+        flow.response.stream = True
+
+
+def extract_cookie(flow: http.HTTPFlow):
+    """从目标响应的 Set-Cookie 中提取 Cookie 字符串，未找到时返回 None。"""
+    cookies_set = flow.response.cookies # 解析后的 cookie 字典
+
+    # 优先从解析后的字典提取
+    if cookies_set and TARGET_COOKIE_NAME in cookies_set:
+        cookie_value = cookies_set[TARGET_COOKIE_NAME][0]
+        logger.debug(f"提取到目标 Cookie (来自字典)，属性: {cookies_set[TARGET_COOKIE_NAME][1]}")
+        return f"{TARGET_COOKIE_NAME}={cookie_value}"
+
+    # 如果字典没有，尝试从原始头解析 (以防万一)
+    for header in flow.response.headers.get_all("Set-Cookie"):
+        match = TARGET_COOKIE_RE.match(header)
+        if match:
+            logger.debug("提取到目标 Cookie (来自原始头)")
+            return f"{TARGET_COOKIE_NAME}={match.group(1)}"
+    return None
+
+
+def _find_identity_field(data, depth: int = 0):
+    """在 JSON 对象中 (有限深度) 查找第一个可作为账号标识的字段值。"""
+    if not isinstance(data, dict) or depth > 4:
+        return None
+    for field in IDENTITY_FIELDS:
+        value = data.get(field)
+        if isinstance(value, (str, int)) and str(value):
+            return str(value)
+    for value in data.values():
+        found = _find_identity_field(value, depth + 1)
+        if found:
+            return found
+    return None
+
+
+def client_address(flow: http.HTTPFlow) -> str:
+    peername = flow.client_conn.peername
+    return peername[0] if peername else "unknown"
+
+
+def identify_account(flow: http.HTTPFlow, cookie_string: str) -> str:
+    """
+    确定 Cookie 所属的账号身份。
+    依次尝试: Cookie 值的 JWT 载荷 -> boot 响应体 JSON -> 客户端地址。
+    """
+    cookie_value = cookie_string.split("=", 1)[-1]
+    parts = cookie_value.split(".")
+    if len(parts) == 3: # 形如 header.payload.signature 的 JWT
+        try:
+            payload = parts[1] + "=" * (-len(parts[1]) % 4)
+            found = _find_identity_field(json.loads(base64.urlsafe_b64decode(payload)))
+            if found: return f"user:{found}"
+        except (ValueError, TypeError):
+            pass
+    try:
+        found = _find_identity_field(json.loads(flow.response.get_text(strict=False) or "null"))
+        if found: return f"user:{found}"
+    except (ValueError, TypeError):
+        pass
+    return f"client:{client_address(flow)}"
+
+
+def write_cookie_map() -> None:
+    """原子地写出 Cookie 映射文件 (先写临时文件再替换)，读取方不会读到写了一半的内容。"""
+    fd, tmp_path = tempfile.mkstemp(prefix=".latest_cookies.", dir=os.path.dirname(COOKIE_MAP_PATH))
+    try:
+        with os.fdopen(fd, "w", encoding='utf-8') as f:
+            json.dump(cookie_map, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, COOKIE_MAP_PATH)
+    except BaseException:
+        try: os.unlink(tmp_path)
+        except OSError: pass
+        raise
+
 
 # mitmproxy 的事件钩子：当收到服务器响应时触发
 def response(flow: http.HTTPFlow) -> None:
     global last_extracted_cookie
 
-    # --- 修改 URL 匹配逻辑 ---
-    # 检查请求的主机和路径是否匹配
-    request_host = flow.request.host
-    request_path = flow.request.path
-
-    # 确保主机是目标主机，路径包含目标模式
-    if "libseats.ldu.edu.cn" in request_host and TARGET_URL_PATTERN in request_path:
-        ctx.log.info(f"检查来自 {flow.request.pretty_url} 的响应...")
-
-        # --- 强制打印所有响应头用于调试 (如果需要可以取消注释) ---
-        # ctx.log.info("--- Response Headers ---")
-        # for name, value in flow.response.headers.fields:
-        #     try:
-        #         header_name = name.decode('utf-8', 'replace')
-        #         header_value = value.decode('utf-8', 'replace')
-        #         ctx.log.info(f"  {header_name}: {header_value}")
-        #     except Exception as e:
-        #          ctx.log.warn(f"无法解码响应头: {e}")
-        # ctx.log.info("-----------------------")
-        # --- 结束强制打印 ---
-
-        cookies_set = flow.response.cookies # 解析后的 cookie 字典
-        set_cookie_headers = flow.response.headers.get_all("Set-Cookie") # 原始头部列表
-
-        # --- 增加日志 (如果需要可以取消注释) ---
-        # if cookies_set: ctx.log.info(f"解析后的 Cookies 字典: {cookies_set}")
-        # else: ctx.log.info("flow.response.cookies 为空。")
-        # if set_cookie_headers: ctx.log.info(f"原始 Set-Cookie 头部列表: {set_cookie_headers}")
-        # else: ctx.log.info("响应头中没有找到 Set-Cookie。")
-        # --- 结束增加日志 ---
-
-        # --- 尝试提取目标 Cookie ---
-        found_cookie = False
-        current_cookie_string = None
-
-        # 优先从解析后的字典提取
-        if cookies_set and TARGET_COOKIE_NAME in cookies_set:
-            cookie_value = cookies_set[TARGET_COOKIE_NAME][0]
-            cookie_attributes = cookies_set[TARGET_COOKIE_NAME][1] # 可以获取属性信息
-            current_cookie_string = f"{TARGET_COOKIE_NAME}={cookie_value}"
-            ctx.log.info(f"提取到目标 Cookie (来自字典): {current_cookie_string}")
-            ctx.log.info(f"  属性: {cookie_attributes}")
-            found_cookie = True
-
-        # 如果字典没有，尝试从原始头解析 (以防万一)
-        elif set_cookie_headers:
-            ctx.log.info(f"未能从 flow.response.cookies 字典中找到 '{TARGET_COOKIE_NAME}'，尝试解析原始 Set-Cookie 头...")
-            for header in set_cookie_headers:
-                 if header.strip().lower().startswith(f"{TARGET_COOKIE_NAME.lower()}="):
-                     match = re.match(rf"{re.escape(TARGET_COOKIE_NAME)}=([^;]+)", header.strip(), re.IGNORECASE)
-                     if match:
-                         cookie_value = match.group(1)
-                         current_cookie_string = f"{TARGET_COOKIE_NAME}={cookie_value}"
-                         ctx.log.info(f"提取到目标 Cookie (来自原始头): {current_cookie_string}")
-                         found_cookie = True
-                         break # 找到第一个就够了
-
-        # --- 处理找到的 Cookie ---
-        if found_cookie and current_cookie_string:
-            if current_cookie_string != last_extracted_cookie:
-                try:
-                    with open(OUTPUT_PATH, "w", encoding='utf-8') as f:
-                        f.write(current_cookie_string)
-                    ctx.log.warn(f"*** 新的 Cookie 已保存到: {OUTPUT_PATH} ***")
-                    last_extracted_cookie = current_cookie_string
-                except IOError as e:
-                    ctx.log.error(f"无法将 Cookie 写入文件 {OUTPUT_PATH}: {e}")
-            else:
-                ctx.log.info("提取到的 Cookie 与上次相同，未写入文件。")
-        elif not found_cookie:
-            # 如果执行到这里，说明响应是匹配了 URL，但响应头里确实没有 Set-Cookie: Authorization=...
-            ctx.log.warn(f"响应 URL 匹配，但在其 Set-Cookie 中未找到 '{TARGET_COOKIE_NAME}' Cookie。")
-
-    # （可选）处理其他 URL 的逻辑可以在这里添加
-    # elif "other.domain.com" in flow.request.host:
-    #     pass
\ No newline at end of file
+    # 快速路径：只有在 requestheaders 中被标记的 flow 才需要处理
+    if not flow.metadata.get(FLOW_MARK) or flow.response is None:
+        return
+    stats["inspected"] += 1
+    logger.info(f"检查来自 {flow.request.pretty_url} 的响应...")
+
+    current_cookie_string = extract_cookie(flow)
+
+    # --- 处理找到的 Cookie ---
+    if current_cookie_string:
+        stats["extracted"] += 1
+        identity = identify_account(flow, current_cookie_string)
+        previous = cookie_map.get(identity)
+        if not previous or previous["cookie"] != current_cookie_string:
+            cookie_map[identity] = {
+                "cookie": current_cookie_string,
+                "client": client_address(flow),
+                "updated_at": time.time(),
+            }
+            try:
+                write_cookie_map()
+                logger.warning(f"*** 账号 {identity} 的新 Cookie 已保存到: {COOKIE_MAP_PATH} ***")
+            except OSError as e:
+                logger.error(f"无法写入 Cookie 映射文件 {COOKIE_MAP_PATH}: {e}")
+        # 单 Cookie 文件仍保存最近一次提取的结果，兼容单账号使用方式
+        if current_cookie_string != last_extracted_cookie:
+            try:
+                with open(OUTPUT_PATH, "w", encoding='utf-8') as f:
+                    f.write(current_cookie_string)
+                logger.warning(f"*** 新的 Cookie 已保存到: {OUTPUT_PATH} ***")
+                last_extracted_cookie = current_cookie_string
+            except IOError as e:
+                logger.error(f"无法将 Cookie 写入文件 {OUTPUT_PATH}: {e}")
+        else:
+            logger.info("提取到的 Cookie 与上次相同，未写入文件。")
+    else:
+        # 如果执行到这里，说明响应是匹配了 URL，但响应头里确实没有 Set-Cookie: Authorization=...
+        logger.warning(f"响应 URL 匹配，但在其 Set-Cookie 中未找到 '{TARGET_COOKIE_NAME}' Cookie。")
+
+
+# mitmproxy 的事件钩子：代理退出时输出统计信息
+def done() -> None:
+    logger.info(f"Cookie 提取器统计: 经过 {stats['seen']} 个请求, 检查 {stats['inspected']} 个, 提取 {stats['extracted']} 次")
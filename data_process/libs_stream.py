@@ -0,0 +1,214 @@
+"""
+Incremental reader for captured libs dumps (data.userAuth.reserve.libs).
+
+The file is read in fixed-size chunks and only one seat record is decoded at a time, so peak
+memory does not grow with the size of the dump. Values outside the libs path are skipped
+without being decoded.
+"""
+import json
+import re
+
+LIBS_PATH = ('data', 'userAuth', 'reserve', 'libs')
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+# Everything up to the next bracket, with complete strings consumed whole (so brackets inside strings are ignored)
+_FLAT_RE = re.compile(r'(?:[^"{}\[\]]+|"[^"\\]*(?:\\.[^"\\]*)*")*', re.DOTALL)
+_STRING_TAIL_RE = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_SCALAR_END_RE = re.compile(r'[ \t\n\r,\]}]')
+_DECODER = json.JSONDecoder()
+
+
+class JsonStreamReader:
+    """A pull-style JSON reader over a text file object, backed by a small sliding buffer."""
+
+    def __init__(self, fp, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.consumed = 0 # Characters dropped from the front of the buffer, for error positions
+        self.eof = False
+
+    def _fill(self):
+        """Appends the next chunk, dropping what has already been consumed. Returns False at end of file."""
+        if self.eof:
+            return False
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.consumed += self.pos
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _error(self, message):
+        return ValueError(f"{message} (位置 {self.consumed + self.pos})")
+
+    def peek(self):
+        """Skips whitespace and returns the next character without consuming it ('' at end of file)."""
+        while True:
+            self.pos = _WHITESPACE_RE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise self._error(f"期望 {char!r}，实际为 {found or '文件结尾'!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decodes the next complete value."""
+        if self.peek() not in ('"', '{', '['):
+            # A number or literal is only complete once its delimiter is in the buffer ("-25" may continue as "-2500.5")
+            while _SCALAR_END_RE.search(self.buf, self.pos) is None and self._fill():
+                pass
+        while True:
+            try:
+                obj, end = _DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                if self._fill():
+                    continue
+                raise self._error(f"无效的 JSON 数据: {e.msg}") from None
+            self.pos = end
+            return obj
+
+    def skip(self):
+        """Consumes the next value without building it."""
+        first = self.peek()
+        if first == '"':
+            self.pos += 1
+            self._skip_string_tail()
+        elif first in ('{', '['):
+            depth = 0
+            while True:
+                self.pos = _FLAT_RE.match(self.buf, self.pos).end()
+                # Stopped at the end of the buffer or at a string that continues in the next chunk
+                if self.pos == len(self.buf) or self.buf[self.pos] == '"':
+                    if not self._fill():
+                        raise self._error("JSON 数据不完整")
+                    continue
+                char = self.buf[self.pos]
+                self.pos += 1
+                if char in '{[':
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        return
+        else:
+            self.value()
+
+    def _skip_string_tail(self):
+        while True:
+            match = _STRING_TAIL_RE.match(self.buf, self.pos)
+            if match is not None:
+                self.pos = match.end()
+                return
+            if not self._fill():
+                raise self._error("字符串不完整")
+
+    def iter_object(self):
+        """Yields the keys of the next object; the caller must consume each key's value before resuming."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise self._error("对象的键必须是字符串")
+            key = self.value()
+            self.expect(':')
+            yield key
+            separator = self.peek()
+            self.pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise self._error(f"对象中出现意外的字符 {separator or '文件结尾'!r}")
+
+    def iter_array(self):
+        """Yields once per element of the next array; the caller must consume each element before resuming."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            separator = self.peek()
+            self.pos += 1
+            if separator == ']':
+                return
+            if separator != ',':
+                raise self._error(f"数组中出现意外的字符 {separator or '文件结尾'!r}")
+
+
+def iter_lib_events(fp, with_seats=True, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Streams the libs of a captured dump as events, in file order:
+
+        ("seat", lib_index, seat_dict)  for every entry of lib_layout.seats (only when with_seats)
+        ("lib", lib_index, lib)         after each lib; lib_layout no longer contains 'seats'.
+                                        Non-dict entries of the libs list are passed through as-is.
+
+    Raises:
+        ValueError: If the JSON is invalid or 'data.userAuth.reserve.libs' is missing or not a list.
+    """
+    reader = JsonStreamReader(fp, chunk_size)
+    found = []
+
+    def read_lib(lib_index):
+        lib = {}
+        for key in reader.iter_object():
+            if key != 'lib_layout' or reader.peek() != '{':
+                lib[key] = reader.value()
+                continue
+            layout = lib['lib_layout'] = {}
+            for layout_key in reader.iter_object():
+                if layout_key != 'seats' or reader.peek() != '[':
+                    layout[layout_key] = reader.value()
+                elif not with_seats:
+                    reader.skip()
+                else:
+                    for _ in reader.iter_array():
+                        yield ("seat", lib_index, reader.value())
+        yield ("lib", lib_index, lib)
+
+    def descend(depth):
+        for key in reader.iter_object():
+            if key != LIBS_PATH[depth]:
+                reader.skip()
+            elif depth + 1 < len(LIBS_PATH):
+                if reader.peek() != '{':
+                    reader.skip() # Same shape rule as .get() chains: a non-object here means the path is absent
+                    continue
+                yield from descend(depth + 1)
+            else:
+                if reader.peek() != '[':
+                    raise reader._error("'data.userAuth.reserve.libs' 的值不是列表")
+                found.append(True)
+                for lib_index in reader.iter_array():
+                    if reader.peek() == '{':
+                        yield from read_lib(lib_index)
+                    else:
+                        yield ("lib", lib_index, reader.value())
+
+    if reader.peek() != '{':
+        raise reader._error("顶层结构不是一个 JSON 对象")
+    yield from descend(0)
+    if reader.peek():
+        raise reader._error("JSON 数据之后还有多余内容")
+    if not found:
+        raise ValueError("在 JSON 结构中未找到 'data.userAuth.reserve.libs'")
+
+
+def iter_libs(fp, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields each entry of the libs list with the seat arrays skipped (room-level fields only)."""
+    for _, _, lib in iter_lib_events(fp, with_seats=False, chunk_size=chunk_size):
+        yield lib
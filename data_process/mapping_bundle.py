@@ -0,0 +1,226 @@
+"""
+Compiled mapping bundle: room names, seat maps, their reverse maps and parsed seat coordinates
+in one file, so beta.load_mappings can start with a single read instead of parsing every JSON file.
+
+Layout (little-endian):
+
+    magic "IGLBUNDL" | format version (u16) | marshal version (u16)
+    source fingerprint (32 bytes) | payload sha256 (32 bytes) | index length (u64)
+    index (marshal): rooms, reverse room map, skipped files, {room_name: (offset, length, seat count)}
+    one marshal blob per room: (seat numbers, seat keys, x array, y array)
+
+Only the index is decoded at load time; a room's seat maps are decoded the first time they are used.
+The source fingerprint covers the name, size and mtime of room_mappings.json and every seat
+*.json file, so a bundle older than its sources is detected from a few stat() calls.
+"""
+import array
+import glob
+import hashlib
+import json
+import marshal
+import os
+import struct
+import tempfile
+import threading
+from collections.abc import Mapping
+
+MAGIC = b"IGLBUNDL"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sHH32s32sQ")
+NO_COORDINATE = -2 ** 31 # Stored in the x/y arrays for keys that do not parse as "y,x"
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ROOM_FILE = os.path.join(DATA_DIR, 'room', 'output', 'room_mappings.json')
+DEFAULT_SEAT_DIR = os.path.join(DATA_DIR, 'seat', 'output')
+DEFAULT_BUNDLE_PATH = os.path.join(DATA_DIR, 'mappings.bundle')
+
+
+def parse_seat_key(seat_key):
+    """Seat keys look like "row,col" ("y,x", reservation keys may end with "."); returns (x, y) or None."""
+    parts = seat_key.rstrip(".").split(",")
+    if len(parts) != 2:
+        return None
+    try:
+        return int(parts[1]), int(parts[0])
+    except ValueError:
+        return None
+
+
+def source_files(room_file, seat_dir):
+    return [room_file] + sorted(glob.glob(os.path.join(seat_dir, '*.json')))
+
+
+def source_fingerprint(room_file, seat_dir):
+    """Hash of the name, size and mtime of every source file (no file contents are read)."""
+    digest = hashlib.sha256()
+    for path in source_files(room_file, seat_dir):
+        try:
+            st = os.stat(path)
+            digest.update(f"{os.path.basename(path)}\0{st.st_size}\0{st.st_mtime_ns}\n".encode('utf-8'))
+        except OSError:
+            digest.update(f"{os.path.basename(path)}\0missing\n".encode('utf-8'))
+    return digest.digest()
+
+
+def read_sources(room_file, seat_dir):
+    """
+    Reads the JSON mapping files. Seat files whose room is not in the room mappings, or whose
+    content is not an object, are left out and described in the returned 'skipped' list.
+
+    Returns:
+        tuple: (rooms {lib_id: name}, seat maps {room_name: {seat_number: seat_key}}, skipped)
+    """
+    with open(room_file, 'r', encoding='utf-8') as f:
+        rooms = json.load(f)
+    if not isinstance(rooms, dict):
+        raise ValueError(f"阅览室映射文件内容格式不正确: {room_file}")
+    room_names = set(rooms.values())
+    seat_maps, skipped = {}, []
+    for seat_file in sorted(glob.glob(os.path.join(seat_dir, '*.json'))):
+        room_name = os.path.splitext(os.path.basename(seat_file))[0]
+        if room_name not in room_names:
+            skipped.append(f"座位文件 '{os.path.basename(seat_file)}' 对应的阅览室 '{room_name}' 未找到")
+            continue
+        with open(seat_file, 'r', encoding='utf-8') as f:
+            seat_map = json.load(f)
+        if not isinstance(seat_map, dict):
+            skipped.append(f"座位文件 '{os.path.basename(seat_file)}' 内容格式不正确")
+            continue
+        seat_maps[room_name] = seat_map
+    return rooms, seat_maps, skipped
+
+
+def _encode_room(seat_map):
+    numbers, keys = list(seat_map.keys()), list(seat_map.values())
+    xs, ys = array.array('i'), array.array('i')
+    for key in keys:
+        xy = parse_seat_key(key)
+        xs.append(xy[0] if xy else NO_COORDINATE)
+        ys.append(xy[1] if xy else NO_COORDINATE)
+    return marshal.dumps((numbers, keys, xs.tobytes(), ys.tobytes()))
+
+
+def write_bundle(bundle_path=DEFAULT_BUNDLE_PATH, room_file=DEFAULT_ROOM_FILE, seat_dir=DEFAULT_SEAT_DIR):
+    """Builds the bundle from the JSON files and replaces bundle_path atomically. Returns the loaded bundle."""
+    fingerprint = source_fingerprint(room_file, seat_dir)
+    rooms, seat_maps, skipped = read_sources(room_file, seat_dir)
+    blobs, offsets, offset = [], {}, 0
+    for room_name, seat_map in seat_maps.items():
+        blob = _encode_room(seat_map)
+        offsets[room_name] = (offset, len(blob), len(seat_map))
+        blobs.append(blob); offset += len(blob)
+    index = marshal.dumps({"rooms": rooms, "room_ids": {name: room_id for room_id, name in rooms.items()},
+                           "skipped": skipped, "offsets": offsets})
+    payload = index + b"".join(blobs)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, marshal.version, fingerprint, hashlib.sha256(payload).digest(), len(index))
+    fd, tmp_path = tempfile.mkstemp(prefix='.mappings.', dir=os.path.dirname(os.path.abspath(bundle_path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header + payload)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, bundle_path)
+    except BaseException:
+        try: os.unlink(tmp_path)
+        except OSError: pass
+        raise
+    return MappingBundle(marshal.loads(index), memoryview(payload)[len(index):])
+
+
+class MappingBundle:
+    """
+    A loaded bundle. rooms / room_ids are plain dicts; seats, seat_keys and coords are read-only
+    mappings keyed by room name that decode a room's blob on first access (thread-safe).
+    """
+    def __init__(self, index, blobs):
+        self.rooms = index["rooms"]
+        self.room_ids = index["room_ids"]
+        self.skipped = index["skipped"]
+        self._offsets = index["offsets"]
+        self._blobs = blobs
+        self._decoded = {}
+        self._lock = threading.Lock()
+        self.seats = _RoomView(self, 0)     # {room_name: {seat_number: seat_key}}
+        self.seat_keys = _RoomView(self, 1) # {room_name: {seat_key: seat_number}}
+        self.coords = _RoomView(self, 2)    # {room_name: [(seat_number, seat_key, x, y), ...]}
+
+    def seat_count(self):
+        return sum(count for _, _, count in self._offsets.values())
+
+    def _room(self, room_name):
+        decoded = self._decoded.get(room_name)
+        if decoded is None:
+            offset, length, _ = self._offsets[room_name]
+            with self._lock:
+                decoded = self._decoded.get(room_name)
+                if decoded is None:
+                    numbers, keys, xs, ys = marshal.loads(self._blobs[offset:offset + length])
+                    xs, ys = array.array('i', xs), array.array('i', ys)
+                    decoded = self._decoded[room_name] = (
+                        dict(zip(numbers, keys)), dict(zip(keys, numbers)),
+                        [seat for seat in zip(numbers, keys, xs, ys) if seat[2] != NO_COORDINATE])
+        return decoded
+
+
+class _RoomView(Mapping):
+    def __init__(self, bundle, part):
+        self._bundle = bundle
+        self._part = part
+
+    def __getitem__(self, room_name):
+        return self._bundle._room(room_name)[self._part]
+
+    def __contains__(self, room_name):
+        return room_name in self._bundle._offsets
+
+    def __iter__(self):
+        return iter(self._bundle._offsets)
+
+    def __len__(self):
+        return len(self._bundle._offsets)
+
+
+def read_bundle(bundle_path=DEFAULT_BUNDLE_PATH, room_file=DEFAULT_ROOM_FILE, seat_dir=DEFAULT_SEAT_DIR):
+    """
+    Loads the bundle with a single read.
+
+    Returns:
+        tuple: (MappingBundle, None) on success, or (None, reason) if the bundle is missing, stale or damaged.
+    """
+    try:
+        with open(bundle_path, 'rb') as f:
+            blob = f.read()
+    except OSError:
+        return None, "映射包不存在"
+    if len(blob) < HEADER.size:
+        return None, "映射包已损坏"
+    magic, version, marshal_version, fingerprint, payload_hash, index_length = HEADER.unpack_from(blob)
+    if magic != MAGIC or version != FORMAT_VERSION or marshal_version != marshal.version:
+        return None, "映射包版本不匹配"
+    if fingerprint != source_fingerprint(room_file, seat_dir):
+        return None, "映射文件已更新"
+    payload = memoryview(blob)[HEADER.size:]
+    if len(payload) < index_length or hashlib.sha256(payload).digest() != payload_hash:
+        return None, "映射包已损坏"
+    try:
+        return MappingBundle(marshal.loads(payload[:index_length]), payload[index_length:]), None
+    except (ValueError, EOFError, TypeError, KeyError):
+        return None, "映射包已损坏"
+
+
+def load_or_rebuild(bundle_path=DEFAULT_BUNDLE_PATH, room_file=DEFAULT_ROOM_FILE, seat_dir=DEFAULT_SEAT_DIR):
+    """
+    Returns (bundle, status): status is "loaded" for an up-to-date bundle, otherwise the bundle is rebuilt
+    from the JSON files and status explains why.
+    """
+    bundle, reason = read_bundle(bundle_path, room_file, seat_dir)
+    if bundle is not None:
+        return bundle, "loaded"
+    return write_bundle(bundle_path, room_file, seat_dir), f"{reason}，已重新生成"
+
+
+if __name__ == "__main__":
+    bundle = write_bundle()
+    print(f"映射包已生成: {DEFAULT_BUNDLE_PATH} ({os.path.getsize(DEFAULT_BUNDLE_PATH)} 字节)")
+    print(f"  {len(bundle.rooms)} 个阅览室, {len(bundle.seats)} 个座位图, {bundle.seat_count()} 个座位")
+    for message in bundle.skipped:
+        print(f"  警告: {message}，已跳过。")
@@ -1,6 +1,12 @@
 import json
 import csv
+import itertools
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import libs_stream
+import mapping_bundle
 
 def extract_library_mappings(input_filepath, output_filepath, output_format='json'):
     """
@@ -29,33 +35,25 @@ def extract_library_mappings(input_filepath, output_filepath, output_format='jso
              return False
 
         with open(input_filepath, 'r', encoding='utf-8') as f:
+            # --- Stream the 'libs' array (data -> userAuth -> reserve -> libs) ---
+            # Seat layouts are skipped without being decoded, so large captures do not need to fit in memory
             try:
-                full_data = json.load(f)
-            except json.JSONDecodeError as e:
-                print(f"\n错误: 文件 {input_filepath} 包含无效的 JSON 数据: {e}")
-                return False
-
-            if not isinstance(full_data, dict):
-                print(f"错误: 文件 {input_filepath} 的顶层结构不是一个 JSON 对象。")
-                return False
-
-            # --- Navigate to the 'libs' array ---
-            # Path: data -> userAuth -> reserve -> libs
-            libs_list = full_data.get('data', {}).get('userAuth', {}).get('reserve', {}).get('libs')
-
-            if not isinstance(libs_list, list):
-                print(f"错误: 在 JSON 结构中未找到 'data.userAuth.reserve.libs' 或其值不是列表。")
+                libs_list = libs_stream.iter_libs(f)
+                first_lib = next(libs_list, None)
+            except ValueError as e:
+                print(f"\n错误: 文件 {input_filepath} 无法解析: {e}")
                 return False
 
-            if not libs_list:
+            if first_lib is None:
                 print("警告: 'data.userAuth.reserve.libs' 列表为空，没有可处理的图书馆信息。")
                 # Proceed to potentially write an empty file
-
-            libs_encountered = len(libs_list)
-            print(f"找到 {libs_encountered} 个图书馆条目，开始提取 ID 和名称...")
+            else:
+                print(f"开始提取图书馆 ID 和名称...")
+            libs_list = itertools.chain([first_lib], libs_list) if first_lib is not None else []
 
             # --- Iterate through each library entry ---
             for index, lib_data in enumerate(libs_list):
+                libs_encountered += 1
                 if not isinstance(lib_data, dict):
                     print(f"警告: 'libs' 列表中的第 {index + 1} 个元素不是字典，已跳过。")
                     skipped_count += 1
@@ -206,4 +204,12 @@ else: print("CSV 导出操作失败或未执行。")
 if success_txt: print(f"TXT 导出完成。查看文件: {output_file_base}.txt")
 else: print("TXT 导出操作失败或未执行。")
 if not success_json or not success_csv or not success_txt:
-    print("\n警告：至少有一个导出步骤失败。请检查上面的错误信息。")
\ No newline at end of file
+    print("\n警告：至少有一个导出步骤失败。请检查上面的错误信息。")
+
+# 6. 更新 beta.py 启动时读取的映射包 (只在写入默认位置时)
+if success_json and os.path.abspath(f"{output_file_base}.json") == mapping_bundle.DEFAULT_ROOM_FILE:
+    try:
+        mapping_bundle.write_bundle()
+        print(f"映射包已更新: {mapping_bundle.DEFAULT_BUNDLE_PATH}")
+    except (OSError, ValueError) as e:
+        print(f"警告: 无法更新映射包 ({e})，beta.py 启动时会自动重新生成。")
@@ -1,7 +1,21 @@
 import json
 import csv
+import hashlib
 import os
 import re # Import the regular expression module for filename sanitization
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+if __name__ == "__main__" and not __package__:
+    # Run as a plain script: make the repository root importable so the package-relative imports below resolve
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    __package__ = "data_process.seat"
+from .. import libs_stream, mapping_bundle
+
+SUPPORTED_FORMATS = ('json', 'csv', 'txt')
+# Records the input hash of every exported room, so unchanged rooms are skipped on the next run
+MANIFEST_FILENAME = '.manifest.json'
 
 def sanitize_filename(name):
     """Removes characters invalid for filenames and replaces spaces."""
@@ -16,224 +30,212 @@ def sanitize_filename(name):
     # Ensure the filename is not empty after sanitization
     return name if name else "unknown_library"
 
-def extract_and_export_mappings(input_filepath, output_directory, output_format='json'):
+def seat_pair(item):
     """
-    Reads JSON, extracts coordinate-to-seat_name mappings, REVERSES them to
-    seat_name-to-coordinate, and exports the reversed mappings to a file
-    named after the 'lib_name' in the specified output directory.
-
-    Args:
-        input_filepath (str): Path to the input JSON file.
-        output_directory (str): Path to the directory where output files will be saved.
-        output_format (str): Format for the output file ('json', 'csv', 'txt').
-
-    Returns:
-        bool: True if successful, False otherwise.
+    Returns the (coordinate, seat_name) pair of one seat entry, or None for entries without a key
+    or a name (aisles, tables and other non-seat cells).
     """
-    print(f"开始处理输入文件: {input_filepath}")
-    # This dictionary will initially store {coordinate: seat_name} during extraction
-    original_mappings = {}
-    processed_count = 0
-    skipped_null_empty_count = 0
-    skipped_missing_key_count = 0
-    skipped_not_dict_count = 0
-    libs_processed_count = 0
-    base_output_filename = "output"
-
-    # --- 1. Read, Parse, Find Library Name, and Extract ORIGINAL Mappings ---
-    try:
-        if not os.path.exists(input_filepath):
-             print(f"错误: 输入文件未找到 {input_filepath}")
-             return False
-
-        with open(input_filepath, 'r', encoding='utf-8') as f:
-            try:
-                full_data = json.load(f)
-            except json.JSONDecodeError as e:
-                print(f"\n错误: 文件 {input_filepath} 包含无效的 JSON 数据: {e}")
-                return False
-
-            if not isinstance(full_data, dict):
-                print(f"错误: 文件 {input_filepath} 的顶层结构不是一个 JSON 对象。")
-                return False
-
-            libs_list = full_data.get('data', {}).get('userAuth', {}).get('reserve', {}).get('libs')
-
-            if not isinstance(libs_list, list):
-                print(f"错误: 在 JSON 结构中未找到 'data.userAuth.reserve.libs' 或其值不是列表。")
-                return False
-
-            # Determine Output Filename from the first library
-            if libs_list:
-                 first_lib_data = libs_list[0]
-                 if isinstance(first_lib_data, dict):
-                     lib_name = first_lib_data.get('lib_name')
-                     base_output_filename = sanitize_filename(lib_name)
-                     print(f"信息: 将使用第一个自习室名称 '{lib_name}' (处理后为 '{base_output_filename}') 作为输出文件名。")
-                 else:
-                     print("警告: 'libs' 列表的第一个元素不是字典，将使用默认输出文件名 'output'。")
-            else:
-                print("警告: 'libs' 列表为空，将使用默认输出文件名 'output'。")
-
-            # Construct the full output path
-            output_filepath = os.path.join(output_directory, f"{base_output_filename}.{output_format}")
-            print(f"信息: 完整输出文件路径将是: {output_filepath}")
-
-            # Process seats from ALL libraries to populate original_mappings
-            if not libs_list:
-                 print("警告: 'libs' 列表为空，没有可处理的自习室信息。")
-
-            for lib_index, lib_data in enumerate(libs_list):
-                if not isinstance(lib_data, dict):
-                    print(f"警告: 'libs' 列表中的第 {lib_index + 1} 个元素不是字典，已跳过。")
-                    continue
-
-                libs_processed_count += 1
-                current_lib_name = lib_data.get('lib_name', f'未命名自习室 {lib_index + 1}')
-                seats_list = lib_data.get('lib_layout', {}).get('seats')
-
-                if not isinstance(seats_list, list):
-                    # print(f"警告: 自习室 '{current_lib_name}' 中未找到 'lib_layout.seats' 或其值不是列表。跳过处理。") # Reduce noise
-                    continue
-                if not seats_list:
-                     continue
-
-                for seat_index, item in enumerate(seats_list):
-                    if isinstance(item, dict):
-                        coord_key = item.get('key')
-                        seat_name = item.get('name') # This is the seat number (e.g., "211")
-                        # Ensure seat_name is a string before using it as a key later
-                        if isinstance(seat_name, (int, float)):
-                            seat_name = str(seat_name)
-
-                        if coord_key is not None and seat_name and isinstance(seat_name, str):
-                            if coord_key in original_mappings:
-                                print(f"  警告: 坐标键 '{coord_key}' 重复 (之前 '{original_mappings[coord_key]}', 现在 '{seat_name}' 来自 '{current_lib_name}'). 已覆盖。")
-                            original_mappings[coord_key] = seat_name # Store original mapping
-                            processed_count += 1
-                        elif coord_key is None:
-                             skipped_missing_key_count +=1
-                        elif seat_name is None or seat_name == "":
-                             skipped_null_empty_count += 1
-                        else:
-                             skipped_missing_key_count += 1 # Covers case where seat_name isn't stringifiable implicitly
-                    else:
-                        skipped_not_dict_count += 1
-
-    except FileNotFoundError:
-        print(f"错误: 输入文件未找到 {input_filepath}")
-        return False
-    except Exception as e:
-        print(f"读取或解析文件 {input_filepath} 时发生意外错误: {e}")
-        return False
-
-    # --- Summary (Based on original extraction) ---
-    total_skipped = skipped_null_empty_count + skipped_missing_key_count + skipped_not_dict_count
-    print(f"\n--- 数据提取总结 (原始: 坐标 -> 座位号) ---")
-    print(f"  处理的自习室数量: {libs_processed_count}")
-    print(f"  成功提取的原始映射数量: {processed_count} (来自 {len(original_mappings)} 个唯一坐标)")
-    print(f"  跳过的座位条目总数: {total_skipped}")
-    # ... (skipped counts remain the same) ...
-
-    if not original_mappings and processed_count == 0:
-         print("警告: 未能从输入文件中提取任何有效的 key-name 映射。无法继续导出。")
-         # Try to create an empty file based on lib_name? Or just return False?
-         # Let's try creating empty file for consistency, but warn heavily.
-         try:
-             os.makedirs(output_directory, exist_ok=True)
-             with open(output_filepath, 'w', encoding='utf-8', newline='') as f:
-                 if output_format == 'json':
-                     f.write("{\n}") # Empty JSON object
-                 elif output_format == 'csv':
-                     writer = csv.writer(f)
-                     writer.writerow(['seat_name', 'coordinate']) # Still write header
-                 # TXT will just be empty
-             print(f"警告: 由于未提取到数据，已创建空的输出文件: {output_filepath}")
-             return True # Return True because file creation was attempted
-         except Exception as e_empty:
-             print(f"尝试创建空输出文件时出错: {e_empty}")
-             return False
-
-
-    # --- <<< REVERSE THE MAPPINGS >>> ---
-    print("\n正在反转映射关系 (座位号 -> 坐标)...")
+    if not isinstance(item, dict):
+        return None
+    coord_key = item.get('key')
+    seat_name = item.get('name') # This is the seat number (e.g., "211")
+    if isinstance(seat_name, (int, float)):
+        seat_name = str(seat_name)
+    if coord_key is not None and seat_name and isinstance(seat_name, str):
+        return (coord_key, seat_name)
+    return None
+
+def reverse_pairs(pairs, room_name):
+    """Builds the seat_name -> coordinate mapping; later duplicates win, as in the original converter."""
     reversed_mappings = {}
-    duplicate_seat_number_count = 0
-    for coord_key, seat_name in original_mappings.items():
-        # seat_name (e.g., "211") becomes the key
-        # coord_key (e.g., "44,11") becomes the value
-        if seat_name in reversed_mappings:
-            print(f"  警告: 座位号 '{seat_name}' 在多个坐标键中重复出现 (之前 '{reversed_mappings[seat_name]}', 现在 '{coord_key}')。将使用后出现的坐标键 '{coord_key}'。")
-            duplicate_seat_number_count += 1
+    for coord_key, seat_name in pairs:
+        if seat_name in reversed_mappings and reversed_mappings[seat_name] != coord_key:
+            print(f"  警告: '{room_name}' 中座位号 '{seat_name}' 在多个坐标键中重复出现 (之前 '{reversed_mappings[seat_name]}', 现在 '{coord_key}')。将使用后出现的坐标键。")
         reversed_mappings[seat_name] = coord_key
+    return reversed_mappings
 
-    print(f"  成功反转 {len(reversed_mappings)} 个唯一座位号的映射。")
-    if duplicate_seat_number_count > 0:
-        print(f"  注意: 检测到 {duplicate_seat_number_count} 个重复的座位号，已使用最后遇到的坐标键进行映射。")
-    # --- End Reversal ---
+def room_input_hash(pairs, output_formats):
+    """Hash of everything that affects a room's output files (seat status changes do not)."""
+    payload = json.dumps({"pairs": pairs, "formats": sorted(output_formats)}, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
 
-    # --- 2. Export REVERSED Mappings using the generated output_filepath ---
-    print(f"\n准备将 {len(reversed_mappings)} 个 *反转后* 的映射 (座位号 -> 坐标) 导出到: {output_filepath} (格式: {output_format})")
+def write_mapping_file(reversed_mappings, output_filepath, output_format):
+    """Writes one mapping file atomically (temporary file + replace), so readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(prefix='.seat_map.', dir=os.path.dirname(output_filepath))
     try:
-        os.makedirs(output_directory, exist_ok=True)
-        print(f"确保输出目录存在: {output_directory}")
-
-        with open(output_filepath, 'w', encoding='utf-8', newline='') as f:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
             if output_format == 'json':
-                # Dump the reversed dictionary
                 json.dump(reversed_mappings, f, ensure_ascii=False, indent=4)
             elif output_format == 'csv':
                 writer = csv.writer(f)
-                # Update headers to reflect the new order
                 writer.writerow(['seat_name', 'coordinate'])
-                # Iterate through the reversed dictionary
                 for seat_name, coord_key in reversed_mappings.items():
-                    writer.writerow([seat_name, coord_key]) # Write in seat_name, coordinate order
+                    writer.writerow([seat_name, coord_key])
             elif output_format == 'txt':
-                 # Iterate through the reversed dictionary
-                 for seat_name, coord_key in reversed_mappings.items():
-                     f.write(f"{seat_name} : {coord_key}\n") # Write in seat_name : coordinate order
-            else:
-                print(f"错误: 不支持的输出格式 '{output_format}'.")
-                return False
-
-        print(f"结果已成功导出到: {output_filepath}")
-        return True
-
-    except IOError as e:
-        print(f"错误: 无法写入输出文件 {output_filepath}. 错误信息: {e}")
-        return False
-    except Exception as e:
-        print(f"导出结果时发生意外错误: {e}")
-        return False
-
-# --- Usage Example (remains the same) ---
-
-# 1. Specify input file
-input_json_file = 'seat_data_array.json'
-
-# 2. Specify output directory
-output_dir = 'output/'
-
-# 3. (Optional) Create sample input file
-
-# 4. Call the function
-print("-" * 30)
-success_json = extract_and_export_mappings(input_json_file, output_dir, output_format='json')
-print("-" * 30)
-success_csv = extract_and_export_mappings(input_json_file, output_dir, output_format='csv')
-print("-" * 30)
-success_txt = extract_and_export_mappings(input_json_file, output_dir, output_format='txt')
-print("-" * 30)
-
-# 5. Check results
-print("--- 导出状态 ---")
-if success_json: print(f"JSON 导出操作完成。")
-else: print("JSON 导出操作失败或未执行。")
-if success_csv: print(f"CSV 导出操作完成。")
-else: print("CSV 导出操作失败或未执行。")
-if success_txt: print(f"TXT 导出操作完成。")
-else: print("TXT 导出操作失败或未执行。")
-print(f"请在目录 '{os.path.abspath(output_dir)}' 中查找基于自习室名称命名的输出文件。")
-if not success_json or not success_csv or not success_txt:
-    print("\n警告：至少有一个导出步骤失败。请检查上面的错误信息。")
\ No newline at end of file
+                for seat_name, coord_key in reversed_mappings.items():
+                    f.write(f"{seat_name} : {coord_key}\n")
+        try: mode = os.stat(output_filepath).st_mode & 0o777 # Keep the permissions of the file being replaced
+        except OSError: mode = 0o644
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, output_filepath)
+    except BaseException:
+        try: os.unlink(tmp_path)
+        except OSError: pass
+        raise
+
+def export_room(lib_data, pairs, skipped, base_name, output_directory, output_formats, previous_entry, force=False):
+    """
+    Exports one room's mapping in every requested format.
+
+    Returns:
+        dict: Manifest entry for the room with a 'status' of 'written', 'unchanged' or 'empty'.
+    """
+    room_name = lib_data.get('lib_name') or base_name
+    files = {fmt: f"{base_name}.{fmt}" for fmt in output_formats}
+    entry = {"lib_id": lib_data.get('lib_id'), "name": room_name, "files": files, "seats": 0, "skipped": skipped}
+    if not pairs:
+        return {**entry, "status": "empty", "hash": None}
+    input_hash = room_input_hash(pairs, output_formats)
+    if (not force and previous_entry and previous_entry.get('hash') == input_hash
+            and all(os.path.exists(os.path.join(output_directory, name)) for name in files.values())):
+        return {**previous_entry, "status": "unchanged"}
+    reversed_mappings = reverse_pairs(pairs, room_name)
+    for fmt, name in files.items():
+        write_mapping_file(reversed_mappings, os.path.join(output_directory, name), fmt)
+    return {**entry, "seats": len(reversed_mappings), "hash": input_hash, "status": "written"}
+
+def save_manifest(output_directory, manifest):
+    fd, tmp_path = tempfile.mkstemp(prefix='.manifest.', dir=output_directory)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(output_directory, MANIFEST_FILENAME))
+
+def load_manifest(output_directory):
+    try:
+        with open(os.path.join(output_directory, MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def convert_all_rooms(input_filepath, output_directory, output_formats=SUPPORTED_FORMATS, max_workers=None, force=False):
+    """
+    Streams the libs dump once and writes a separate seat_name -> coordinate mapping for every room
+    that has a seat layout, in all requested formats. Rooms are exported in parallel; rooms whose
+    input hash matches the manifest from the previous run (and whose files still exist) are skipped.
+
+    Args:
+        input_filepath (str): Path to the libs dump (e.g. seat_data_array.json).
+        output_directory (str): Directory for the per-room mapping files.
+        output_formats (iterable): Any of 'json', 'csv', 'txt'.
+        max_workers (int | None): Number of rooms exported concurrently.
+        force (bool): Rewrite every room even if its input is unchanged.
+
+    Returns:
+        dict | None: {lib_id: manifest entry} for this run, or None if the input could not be read.
+    """
+    output_formats = list(dict.fromkeys(output_formats))
+    unsupported = [fmt for fmt in output_formats if fmt not in SUPPORTED_FORMATS]
+    if unsupported or not output_formats:
+        print(f"错误: 不支持的输出格式 {unsupported or output_formats}，可选: {', '.join(SUPPORTED_FORMATS)}")
+        return None
+
+    print(f"开始处理输入文件: {input_filepath}")
+    if not os.path.exists(input_filepath):
+        print(f"错误: 输入文件未找到 {input_filepath}")
+        return None
+    os.makedirs(output_directory, exist_ok=True)
+    manifest = load_manifest(output_directory)
+
+    # The dump is streamed: only the compact (coordinate, seat_name) pairs of the room being read are
+    # kept, and each room is handed to the pool as soon as its closing brace has been parsed
+    futures = {}
+    used_names = set()
+    rooms_total = 0
+    pairs, skipped = [], 0
+    try:
+        with open(input_filepath, 'r', encoding='utf-8') as f, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for event, lib_index, record in libs_stream.iter_lib_events(f):
+                if event == "seat":
+                    pair = seat_pair(record)
+                    if pair:
+                        pairs.append(pair)
+                    else:
+                        skipped += 1
+                    continue
+                room_pairs, room_skipped, pairs, skipped = pairs, skipped, [], 0
+                if not isinstance(record, dict):
+                    print(f"警告: 'libs' 列表中的第 {lib_index + 1} 个元素不是字典，已跳过。")
+                    continue
+                rooms_total += 1
+                base_name = sanitize_filename(record.get('lib_name'))
+                if base_name in used_names: # Two rooms with the same name: suffix the later one with its lib_id
+                    base_name = f"{base_name}_{record.get('lib_id', lib_index)}"
+                used_names.add(base_name)
+                room_key = str(record.get('lib_id', base_name))
+                futures[room_key] = executor.submit(export_room, record, room_pairs, room_skipped, base_name,
+                                                    output_directory, output_formats, manifest.get(room_key), force)
+    except ValueError as e:
+        print(f"\n错误: 文件 {input_filepath} 无法解析: {e}")
+        return None
+    except OSError as e:
+        print(f"读取文件 {input_filepath} 时发生错误: {e}")
+        return None
+
+    results = {}
+    for room_key, future in futures.items():
+        try:
+            results[room_key] = future.result()
+        except OSError as e:
+            print(f"错误: 无法写入阅览室 {room_key} 的输出文件: {e}")
+
+    for room_key, entry in results.items():
+        if entry["status"] != "empty":
+            manifest[room_key] = {k: v for k, v in entry.items() if k != "status"}
+    save_manifest(output_directory, manifest)
+
+    statuses = [entry["status"] for entry in results.values()]
+    print(f"\n--- 转换总结 ---")
+    print(f"  自习室总数: {rooms_total}")
+    print(f"  已写入: {statuses.count('written')}，未变化已跳过: {statuses.count('unchanged')}，没有座位布局: {statuses.count('empty')}")
+    for entry in results.values():
+        if entry["status"] == "written":
+            print(f"  {entry['name']}: {entry['seats']} 个座位 -> {', '.join(entry['files'].values())}")
+    return results
+
+def extract_and_export_mappings(input_filepath, output_directory, output_format='json'):
+    """
+    Exports the seat_name -> coordinate mapping of every room in the dump in a single format.
+    Kept for compatibility; use convert_all_rooms to write several formats in one pass.
+
+    Returns:
+        bool: True if successful, False otherwise.
+    """
+    results = convert_all_rooms(input_filepath, output_directory, [output_format])
+    return results is not None and len(results) > 0
+
+
+if __name__ == "__main__":
+    import argparse
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="从 libs 数据生成每个阅览室的座位号 -> 坐标映射")
+    parser.add_argument("input", nargs="?", default=os.path.join(script_dir, 'seat_data_array.json'), help="libs 数据文件")
+    parser.add_argument("-o", "--output", default=os.path.join(script_dir, 'output'), help="输出目录")
+    parser.add_argument("-f", "--formats", default=",".join(SUPPORTED_FORMATS), help="输出格式，逗号分隔 (json,csv,txt)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="同时处理的阅览室数量")
+    parser.add_argument("--force", action="store_true", help="忽略上次的记录，重新生成所有阅览室")
+    args = parser.parse_args()
+
+    print("-" * 30)
+    results = convert_all_rooms(args.input, args.output, [fmt.strip() for fmt in args.formats.split(",") if fmt.strip()], args.workers, args.force)
+    print("-" * 30)
+    if results is None:
+        print("转换失败，请检查上面的错误信息。")
+        raise SystemExit(1)
+    print(f"请在目录 '{os.path.abspath(args.output)}' 中查找基于自习室名称命名的输出文件。")
+    if 'json' in args.formats and os.path.abspath(args.output) == mapping_bundle.DEFAULT_SEAT_DIR:
+        try:
+            mapping_bundle.write_bundle()
+            print(f"映射包已更新: {mapping_bundle.DEFAULT_BUNDLE_PATH}")
+        except (OSError, ValueError) as e:
+            print(f"警告: 无法更新映射包 ({e})，beta.py 启动时会自动重新生成。")
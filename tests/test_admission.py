@@ -0,0 +1,57 @@
+import datetime
+
+import pytest
+
+import beta
+
+
+FIRE_DT = datetime.datetime.now().replace(microsecond=0) + datetime.timedelta(minutes=10)
+
+
+def make_job(seat_targets, cookie="Authorization=a"):
+    return beta.SeatJob(2, cookie, 1, list(seat_targets), FIRE_DT)
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = beta.JobScheduler(max_workers=1, runner=lambda job: "成功")
+    yield scheduler
+    scheduler.shutdown(wait=False)
+
+
+def test_duplicate_is_coalesced_and_both_submitters_get_status(scheduler):
+    first = make_job([("5", "3,4"), ("6", "6,7")])
+    first_messages, second_messages = [], []
+    first.status_callbacks.append(first_messages.append)
+    assert scheduler.submit(first) is first
+
+    second = make_job([("5", "3,4"), ("6", "6,7")])
+    scheduled = scheduler.submit(second)
+    assert scheduled is first and second.coalesced_into is first
+    scheduled.status_callbacks.append(second_messages.append)
+
+    first.report_status("排队中")
+    assert first_messages == ["排队中"] and second_messages == ["排队中"]
+
+
+def test_failing_status_callback_does_not_block_others(scheduler):
+    job = make_job([("5", "3,4")])
+    received = []
+    job.status_callbacks.append(lambda message: 1 / 0)
+    job.status_callbacks.append(received.append)
+    job.report_status("开始")
+    assert received == ["开始"]
+
+
+def test_same_first_seat_with_different_fallbacks_is_rejected(scheduler):
+    scheduler.submit(make_job([("5", "3,4"), ("6", "6,7")]))
+    with pytest.raises(beta.AdmissionError) as error:
+        scheduler.submit(make_job([("5", "3,4"), ("8", "8,9")]))
+    assert error.value.status_code == 409
+
+
+def test_other_account_on_same_seat_is_moved_to_fallback(scheduler):
+    scheduler.submit(make_job([("5", "3,4")]))
+    other = make_job([("5", "3,4"), ("6", "6,7")], cookie="Authorization=b")
+    assert scheduler.submit(other) is other
+    assert other.seat_targets == [("6", "6,7"), ("5", "3,4")]
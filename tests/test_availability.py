@@ -0,0 +1,90 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import beta
+
+
+def layout(*taken_keys):
+    seats = [{"type": 1, "name": str(i + 1), "key": f"{i},0", "x": i, "y": 0, "status": f"{i},0" in taken_keys} for i in range(3)]
+    return {"seats": seats, "seats_total": len(seats)}
+
+
+class FakeFetcher:
+    def __init__(self, failing=()):
+        self.failing, self.calls = set(failing), []
+
+    def __call__(self, cookie, lib_id):
+        self.calls.append(lib_id)
+        if lib_id in self.failing: raise ValueError(f"阅览室 {lib_id} 未返回座位布局")
+        return layout("1,0")
+
+
+def test_refresh_bypasses_ttl_and_updates_cache():
+    fetcher = FakeFetcher()
+    service = beta.AvailabilityService(ttl=60, fetcher=fetcher)
+    service.room(1, "cookie")
+    results, errors = service.refresh([1, 2], "cookie")
+    assert sorted(results) == [1, 2] and errors == {}
+    assert fetcher.calls.count(1) == 2
+    assert service.cache.peek(2) is results[2]
+    assert service.room(2, None) is results[2]
+
+
+def test_recorder_uses_refresh_and_reports_errors(tmp_path, monkeypatch):
+    service = beta.AvailabilityService(ttl=60, fetcher=FakeFetcher(failing={2}))
+    monkeypatch.setattr(beta, "get_availability_service", lambda: service)
+    recorder = beta.OccupancyRecorder(beta.OccupancyStore(str(tmp_path / "occupancy.db")), 60, [1, 2],
+                                      burst_windows=[], cookie_provider=lambda: "cookie")
+    assert recorder.record_once() == 1
+    assert recorder.stats == {"rounds": 1, "written": 1, "errors": 1}
+    assert service.cache.peek(1)["_taken"] == frozenset({"1,0"})
+
+
+def test_ttl_cache_single_flight():
+    cache = beta.TTLCache(ttl=60)
+    release, calls = threading.Event(), []
+
+    def loader():
+        calls.append(1); release.wait(5); return "value"
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(cache.get_or_load, "key", loader, 5) for _ in range(4)]
+        deadline = time.time() + 5
+        while cache.stats["joined"] < 3 and time.time() < deadline: time.sleep(0.01)
+        release.set()
+        assert [future.result() for future in futures] == ["value"] * 4
+    assert len(calls) == 1
+    assert cache.stats == {"hits": 0, "loads": 1, "joined": 3}
+
+
+def test_ttl_cache_expiry_and_failed_loads(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(beta.time, "time", lambda: now[0])
+    cache = beta.TTLCache(ttl=10)
+    assert cache.get_or_load("key", lambda: 1) == 1
+    now[0] += 9
+    assert cache.get_or_load("key", lambda: 2) == 1
+    now[0] += 2
+    assert cache.peek("key") is None
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        cache.get_or_load("key", fail)
+    assert cache.get_or_load("key", lambda: 3) == 3
+
+
+def test_rooms_aggregates_errors_per_room():
+    fetcher = FakeFetcher(failing={2})
+    service = beta.AvailabilityService(ttl=60, fetcher=fetcher)
+    results, errors = service.rooms([1, 2, 3], "cookie")
+    assert sorted(results) == [1, 3]
+    assert results[1]["free"] == 2
+    assert list(errors) == [2] and "未返回座位布局" in errors[2]
+    results, errors = service.rooms([1, 2], None)
+    assert sorted(results) == [1] and "需要有效的 Cookie" in errors[2]
+    assert fetcher.calls.count(1) == 1
@@ -0,0 +1,73 @@
+import gzip
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import beta
+
+
+GZIP = {"Accept-Encoding": "gzip"}
+IDENTITY = {"Accept-Encoding": "identity"}
+
+
+@pytest.fixture(scope="module")
+def client():
+    assert beta.load_mappings()
+    return TestClient(beta.app)
+
+
+def get(client, path, **headers):
+    return client.get(path, headers=headers)
+
+
+def test_gzip_and_identity_have_different_etags(client):
+    zipped = get(client, "/api/mappings", **GZIP)
+    plain = get(client, "/api/mappings", **IDENTITY)
+    assert zipped.headers["content-encoding"] == "gzip"
+    assert "content-encoding" not in plain.headers
+    assert zipped.headers["etag"].endswith('-gzip"')
+    assert zipped.headers["etag"] != plain.headers["etag"]
+    assert zipped.headers["vary"] == plain.headers["vary"] == "Accept-Encoding"
+    assert json.loads(zipped.content) == json.loads(plain.content) # httpx 已解压 gzip 响应体
+
+
+def test_gzip_body_is_valid():
+    cached = beta.mappings_response(beta.current_mappings())
+    assert cached.gzipped is not None and gzip.decompress(cached.gzipped) == cached.body
+
+
+def test_zero_quality_gzip_is_not_used(client):
+    response = get(client, "/api/mappings", **{"Accept-Encoding": "gzip;q=0, identity"})
+    assert "content-encoding" not in response.headers
+
+
+@pytest.mark.parametrize("encoding", [GZIP, IDENTITY])
+def test_revalidation_matches_either_encoding(client, encoding):
+    plain_tag = get(client, "/api/mappings", **IDENTITY).headers["etag"]
+    gzip_tag = get(client, "/api/mappings", **GZIP).headers["etag"]
+    for tag in (plain_tag, gzip_tag):
+        response = get(client, "/api/mappings", **encoding, **{"If-None-Match": tag})
+        assert response.status_code == 304 and response.content == b""
+        assert response.headers["etag"] == (gzip_tag if encoding is GZIP else plain_tag)
+
+
+def test_weak_and_listed_tags_match(client):
+    tag = get(client, "/api/mappings", **IDENTITY).headers["etag"]
+    assert get(client, "/api/mappings", **IDENTITY, **{"If-None-Match": f"W/{tag}"}).status_code == 304
+    assert get(client, "/api/mappings", **IDENTITY, **{"If-None-Match": f'"other", W/{tag}'}).status_code == 304
+
+
+def test_star_matches(client):
+    assert get(client, "/api/mappings", **GZIP, **{"If-None-Match": "*"}).status_code == 304
+
+
+def test_unknown_tag_returns_body(client):
+    response = get(client, "/api/mappings", **IDENTITY, **{"If-None-Match": '"stale"'})
+    assert response.status_code == 200 and json.loads(response.content)["rooms"]
+
+
+def test_index_page_revalidates(client):
+    first = get(client, "/", **GZIP)
+    assert first.status_code == 200 and "text/html" in first.headers["content-type"]
+    assert get(client, "/", **GZIP, **{"If-None-Match": first.headers["etag"]}).status_code == 304
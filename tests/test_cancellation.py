@@ -0,0 +1,69 @@
+import datetime
+
+import beta
+
+
+class FakeResponse:
+    def __init__(self, text, status_code=200):
+        self.text, self.status_code, self.reason = text, status_code, "OK"
+        self.elapsed = datetime.timedelta(milliseconds=20)
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeWebSocket:
+    connected = False
+
+    def abort(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class CancelOnQueueTransport:
+    """主操作总是返回一般错误；第 cancel_on 次建立排队连接时取消任务。"""
+    def __init__(self, token, cancel_on):
+        self.token, self.cancel_on, self.queue_calls = token, cancel_on, 0
+
+    def prepare(self):
+        pass
+
+    def post(self, url, headers, payload, timeout):
+        if payload.get("operationName") in ("save", "reserveSeat"):
+            return FakeResponse('{"errors":[{"msg":"系统繁忙"}]}')
+        return FakeResponse("{}")
+
+    def connect_queue(self, url, headers, timeout):
+        self.queue_calls += 1
+        if self.queue_calls == self.cancel_on: self.token.cancel("超过任务截止时间")
+        return FakeWebSocket()
+
+
+def run_operation(monkeypatch, cancel_on):
+    monkeypatch.setattr(beta, "SLEEP_INTERVAL_ON_FAIL", 0)
+    monkeypatch.setattr(beta.seat_map_learner, "observe", lambda lib_id, text: None)
+    token = beta.CancelToken()
+    transport = CancelOnQueueTransport(token, cancel_on)
+    result = beta.perform_seat_operation(2, "Authorization=test", 1, "1,1", None, cancel_token=token, transport=transport)
+    return result, transport
+
+
+def test_cancel_during_last_queue_attempt_reports_cancelled(monkeypatch):
+    result, transport = run_operation(monkeypatch, cancel_on=beta.MAX_REQUEST_ATTEMPTS)
+    assert transport.queue_calls == beta.MAX_REQUEST_ATTEMPTS
+    assert result.startswith(beta.JOB_CANCELLED_PREFIX)
+    assert "超过任务截止时间" in result
+
+
+def test_cancel_during_first_queue_attempt_stops_retrying(monkeypatch):
+    result, transport = run_operation(monkeypatch, cancel_on=1)
+    assert transport.queue_calls == 1
+    assert result.startswith(beta.JOB_CANCELLED_PREFIX)
+
+
+def test_without_cancel_returns_last_error(monkeypatch):
+    result, transport = run_operation(monkeypatch, cancel_on=0)
+    assert transport.queue_calls == beta.MAX_REQUEST_ATTEMPTS
+    assert "系统繁忙" in result
@@ -0,0 +1,95 @@
+import sqlite3
+import time
+
+import pytest
+
+import beta
+
+
+WINDOW = "21:48"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return beta.OutcomeStore(str(tmp_path / "outcomes.db"))
+
+
+def add(store, outcome, lead_ms, offset_ms, latency_ms=60.0):
+    """按时间顺序追加一次首次尝试 (最后追加的是最近一次)。"""
+    add.ts += 1
+    with sqlite3.connect(store.db_path) as conn:
+        conn.execute("INSERT INTO outcomes VALUES (?, 'job', 1, 1, '3,4', '5', ?, 0, ?, ?, ?, '', ?, 1)",
+                     (add.ts, WINDOW, offset_ms, latency_ms, outcome, lead_ms))
+add.ts = time.time()
+
+
+def decide(store):
+    return store.decide_fire_lead(1, WINDOW)
+
+
+def test_no_history_uses_minimum(store):
+    assert decide(store)["lead_ms"] == beta.FIRE_LEAD_MIN_MS
+
+
+def test_won_keeps_lead(store):
+    add(store, "won", 40, offset_ms=-30)
+    assert decide(store)["lead_ms"] == 40
+
+
+def test_lost_early_keeps_lead(store):
+    # 提前 60 ms 发出，往返 100 ms：估计在开放前 10 ms 到达，被抢与时机无关
+    add(store, "lost", 60, offset_ms=-60, latency_ms=100)
+    decision = decide(store)
+    assert decision["inputs"][0]["arrival_ms"] == -10
+    assert decision["lead_ms"] == 60
+
+
+def test_single_lost_late_does_not_raise_lead(store):
+    # 按完整往返计算会是开放后 40 ms 到达，按一半往返估计是开放前 10 ms
+    add(store, "lost", 40, offset_ms=-20, latency_ms=60)
+    assert decide(store)["lead_ms"] == 40
+    add(store, "lost", 40, offset_ms=5, latency_ms=60)
+    assert decide(store)["lead_ms"] == 40
+
+
+def test_lost_late_streak_raises_lead(store):
+    for _ in range(beta.FIRE_LEAD_LOSS_STREAK - 1):
+        add(store, "lost", 40, offset_ms=20)
+        assert decide(store)["lead_ms"] == 40
+    add(store, "lost", 40, offset_ms=20)
+    assert decide(store)["lead_ms"] == 40 + beta.FIRE_LEAD_STEP_MS
+
+
+def test_lost_late_streak_is_reset_by_lead_change_or_win(store):
+    for _ in range(beta.FIRE_LEAD_LOSS_STREAK - 1): add(store, "lost", 20, offset_ms=20)
+    add(store, "lost", 40, offset_ms=20) # 提前量已经变化，之前的记录不计入
+    assert decide(store)["lead_ms"] == 40
+    for _ in range(beta.FIRE_LEAD_LOSS_STREAK - 1): add(store, "lost", 40, offset_ms=20)
+    add(store, "won", 40, offset_ms=-30)
+    add(store, "lost", 40, offset_ms=20)
+    assert decide(store)["lead_ms"] == 40
+
+
+def test_small_late_arrival_limits_step(store):
+    for _ in range(beta.FIRE_LEAD_LOSS_STREAK): add(store, "lost", 40, offset_ms=-25, latency_ms=60) # 开放后 5 ms 到达
+    assert decide(store)["lead_ms"] == 45
+
+
+def test_too_early_backs_off(store):
+    add(store, "too_early", 100, offset_ms=-100)
+    assert decide(store)["lead_ms"] == 100 - beta.FIRE_LEAD_BACKOFF_MS
+
+
+def test_too_early_ceiling_caps_later_increases(store):
+    add(store, "too_early", 80, offset_ms=-80)
+    for _ in range(beta.FIRE_LEAD_LOSS_STREAK): add(store, "lost", 60, offset_ms=40)
+    decision = decide(store)
+    assert decision["lead_ms"] == 80 - beta.FIRE_LEAD_BACKOFF_MS
+    assert "80" in decision["reason"]
+
+
+def test_lead_stays_within_bounds(store):
+    for _ in range(beta.FIRE_LEAD_LOSS_STREAK): add(store, "lost", beta.FIRE_LEAD_MAX_MS, offset_ms=50)
+    assert decide(store)["lead_ms"] == beta.FIRE_LEAD_MAX_MS
+    add(store, "too_early", beta.FIRE_LEAD_MIN_MS, offset_ms=-10)
+    assert decide(store)["lead_ms"] == beta.FIRE_LEAD_MIN_MS
@@ -0,0 +1,48 @@
+import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+import beta
+
+
+@pytest.fixture
+def scheduler(tmp_path, monkeypatch):
+    store = beta.JobStore(str(tmp_path / "jobs.db"), flush_interval=0.01)
+    scheduler = beta.JobScheduler(max_workers=1, store=store, runner=lambda job: "成功")
+    monkeypatch.setattr(beta, "_job_scheduler", scheduler)
+    yield scheduler
+    scheduler.shutdown(wait=False); store.close()
+
+
+def stored_done_job(store):
+    """只存在于任务数据库中的已结束任务 (如服务器重启之前完成的任务)。"""
+    job = beta.SeatJob(2, "Authorization=test", 1, [("5", "3,4")], datetime.datetime.now(), name="seat")
+    job.state, job.result = "done", "成功"
+    store.save(job); store.flush()
+    return job
+
+
+def result_events(body):
+    return [block for block in body.split("\n\n") if block.startswith("event: result") or "\nevent: result" in block]
+
+
+def test_stored_done_job_streams_result(scheduler):
+    job = stored_done_job(scheduler.store)
+    response = TestClient(beta.app).get(f"/api/jobs/{job.job_id}/events")
+    assert response.status_code == 200
+    events = result_events(response.text)
+    assert len(events) == 1 and '"status": "success"' in events[0]
+
+
+def test_stale_last_event_id_still_gets_result(scheduler):
+    job = stored_done_job(scheduler.store)
+    response = TestClient(beta.app).get(f"/api/jobs/{job.job_id}/events", headers={"Last-Event-ID": "40"})
+    assert len(result_events(response.text)) == 1
+
+
+def test_status_api_includes_result_event_for_stored_job(scheduler):
+    job = stored_done_job(scheduler.store)
+    body = TestClient(beta.app).get(f"/api/jobs/{job.job_id}").json()
+    assert body["state"] == "done"
+    assert [event["type"] for event in body["events"]] == ["result"]
@@ -0,0 +1,110 @@
+import datetime
+
+import pytest
+
+import beta
+
+
+def make_job(fire_in_seconds, seat_key="3,4", **kwargs):
+    fire_dt = datetime.datetime.now() + datetime.timedelta(seconds=fire_in_seconds)
+    return beta.SeatJob(2, "Authorization=test", 1, [("5", seat_key), ("6", "6,7")], fire_dt, name=f"seat-{seat_key}", **kwargs)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = beta.JobStore(str(tmp_path / "jobs.db"), flush_interval=0.01)
+    yield store
+    store.close()
+
+
+def new_scheduler(store):
+    return beta.JobScheduler(max_workers=2, store=store, stagger_ms=40, runner=lambda job: "成功")
+
+
+def save(store, job, state):
+    job.state = state; store.save(job); store.flush()
+
+
+def test_record_round_trip_keeps_job_options(store):
+    job = make_job(120, deadline_seconds=7.5)
+    job.stagger_ms, job.profiling, job.recording = 80, True, True
+    save(store, job, "scheduled")
+    restored = beta.job_from_record(store.get(job.job_id))
+    assert restored.deadline_seconds == 7.5
+    assert restored.stagger_ms == 80
+    assert restored.profiling and restored.recording
+    assert restored.seat_targets == job.seat_targets
+    assert restored.start_dt == job.start_dt
+
+
+def test_restore_does_not_stagger_again(store):
+    first, second = make_job(120), make_job(120, seat_key="8,9")
+    scheduler = new_scheduler(store)
+    scheduler.submit_many([first, second])
+    assert second.stagger_ms == 40
+    store.flush(); scheduler.shutdown(wait=False)
+
+    scheduler = new_scheduler(store)
+    assert scheduler.restore_pending() == (2, 0)
+    restored = scheduler.jobs[second.job_id]
+    assert restored.stagger_ms == 40
+    assert restored.start_dt == second.start_dt
+    assert scheduler.jobs[first.job_id].start_dt == first.start_dt
+    # 新任务仍按已恢复任务占用的时刻错开
+    third = make_job(0, seat_key="10,11"); third.start_dt = first.start_dt
+    scheduler.submit(third)
+    assert third.stagger_ms == 80
+    scheduler.shutdown(wait=False)
+
+
+def test_running_job_past_fire_time_is_not_rerun(store):
+    job = make_job(-2)
+    save(store, job, "running")
+    scheduler = new_scheduler(store)
+    assert scheduler.restore_pending() == (0, 1)
+    restored = scheduler.jobs[job.job_id]
+    assert restored.state == "done" and "结果未知" in restored.result
+    store.flush()
+    assert store.get(job.job_id)["state"] == "done"
+    scheduler.shutdown(wait=False)
+
+
+def test_running_job_before_fire_time_is_restored(store):
+    job = make_job(120) # 停止时还在提前派发后的倒计时中，尚未发出请求
+    save(store, job, "running")
+    scheduler = new_scheduler(store)
+    assert scheduler.restore_pending() == (1, 0)
+    assert scheduler.jobs[job.job_id].state == "scheduled"
+    scheduler.shutdown(wait=False)
+
+
+def test_expired_scheduled_job_is_not_run(store):
+    job = make_job(-beta.JOB_RESTORE_GRACE_SECONDS - 10)
+    save(store, job, "scheduled")
+    scheduler = new_scheduler(store)
+    assert scheduler.restore_pending() == (0, 1)
+    assert "已过期" in scheduler.jobs[job.job_id].result
+    scheduler.shutdown(wait=False)
+
+
+def test_finished_jobs_are_evicted_after_retention(store):
+    scheduler = beta.JobScheduler(max_workers=2, store=store, runner=lambda job: "成功", retention_seconds=0)
+    try:
+        jobs = scheduler.submit_many([make_job(-1, "3,4"), make_job(-1, "8,9")])
+        assert scheduler.wait_all(jobs, timeout=5)
+        assert scheduler.jobs == {}
+        store.flush()
+        assert all(store.get(job.job_id)["state"] == "done" for job in jobs)
+        assert scheduler.cancel(jobs[0].job_id) is None
+    finally:
+        scheduler.shutdown()
+
+
+def test_finished_jobs_are_kept_within_retention(store):
+    scheduler = new_scheduler(store)
+    try:
+        job = scheduler.submit(make_job(-1))
+        assert scheduler.wait_all([job], timeout=5)
+        assert scheduler.jobs[job.job_id] is job
+    finally:
+        scheduler.shutdown()
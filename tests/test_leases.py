@@ -0,0 +1,85 @@
+import datetime
+import time
+
+import pytest
+
+import beta
+
+
+def make_job(fire_in_seconds, seat_key="3,4"):
+    fire_dt = datetime.datetime.now() + datetime.timedelta(seconds=fire_in_seconds)
+    return beta.SeatJob(2, "Authorization=test", 1, [("5", seat_key)], fire_dt, name=f"seat-{seat_key}")
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return beta.SQLiteLeaseBackend(str(tmp_path / "shared_jobs.db"))
+
+
+def states(backend):
+    return {row["job_id"]: row for row in backend.list()}
+
+
+def test_lease_backend_is_abstract():
+    with pytest.raises(TypeError):
+        beta.LeaseBackend()
+
+
+def test_add_rejects_duplicate_job(backend):
+    assert backend.add(make_job(60))
+    assert not backend.add(make_job(60))
+    assert backend.add(make_job(60, seat_key="6,7"))
+
+
+def test_claim_only_jobs_within_horizon(backend):
+    near, far = make_job(5), make_job(600, seat_key="6,7")
+    backend.add(near); backend.add(far)
+    claimed = backend.claim("node-a", time.time() + 30, ttl=15, limit=10)
+    assert [job.job_id for job in claimed] == [near.job_id]
+    row = states(backend)[near.job_id]
+    assert row["state"] == "leased" and row["owner"] == "node-a"
+    assert states(backend)[far.job_id]["state"] == "open"
+
+
+def test_live_lease_is_not_claimed_by_other_node(backend):
+    job = make_job(5)
+    backend.add(job)
+    assert backend.claim("node-a", time.time() + 30, ttl=15, limit=10)
+    assert backend.claim("node-b", time.time() + 30, ttl=15, limit=10) == []
+    assert backend.renew("node-a", [job.job_id], ttl=15) == [job.job_id]
+    assert backend.renew("node-b", [job.job_id], ttl=15) == []
+
+
+def test_expired_lease_before_fire_time_is_reclaimed(backend):
+    job = make_job(5)
+    backend.add(job)
+    backend.claim("node-a", time.time() + 30, ttl=0.01, limit=10)
+    time.sleep(0.05)
+    claimed = backend.claim("node-b", time.time() + 30, ttl=15, limit=10)
+    assert [c.job_id for c in claimed] == [job.job_id]
+    assert states(backend)[job.job_id]["owner"] == "node-b"
+    assert states(backend)[job.job_id]["claims"] == 2
+    # 原节点的租约已被接管，续约和写回都会失败
+    assert backend.renew("node-a", [job.job_id], ttl=15) == []
+    job.result = "成功"
+    assert not backend.complete("node-a", job)
+    assert backend.complete("node-b", job)
+
+
+def test_expired_lease_after_fire_time_is_not_refired(backend):
+    job = make_job(0.02)
+    backend.add(job)
+    backend.claim("node-a", time.time() + 30, ttl=0.01, limit=10)
+    time.sleep(0.05) # 已过执行时间，且租约已过期 (持有节点可能在发出请求后失联)
+    assert backend.claim("node-b", time.time() + 30, ttl=15, limit=10) == []
+    row = states(backend)[job.job_id]
+    assert row["state"] == "done" and row["owner"] == "node-a"
+    assert "结果未知" in row["result"]
+
+
+def test_released_job_is_claimable_again(backend):
+    job = make_job(5)
+    backend.add(job)
+    backend.claim("node-a", time.time() + 30, ttl=15, limit=10)
+    backend.release("node-a", job.job_id)
+    assert [c.job_id for c in backend.claim("node-b", time.time() + 30, ttl=15, limit=10)] == [job.job_id]
@@ -0,0 +1,89 @@
+import io
+import json
+import os
+
+import pytest
+
+from data_process import libs_stream
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TRICKY = {
+    "meta": {"note": "brackets ] } [ { and \"quotes\" \\ inside", "list": [1, [2, {"x": "]"}], -0.5e-3], "ok": True},
+    "data": {
+        "other": ["skip me", {"nested": "\\\"}"}, None],
+        "userAuth": {
+            "reserve": {
+                "libs": [
+                    {"lib_id": -2500.5, "lib_name": "阅览室 \"A\" [1]", "lib_layout": {
+                        "max_x": 123456789, "seats": [{"key": "1,2.", "name": "7", "status": False},
+                                                      {"key": "}{", "name": "\\u005d\\\\", "status": True}],
+                        "seats_total": 2}},
+                    "not a dict",
+                    {"lib_id": 12, "lib_layout": {"seats": []}},
+                ],
+            },
+            "tail": 1e10,
+        },
+    },
+}
+
+
+def expected_events(doc, with_seats=True):
+    events = []
+    for index, lib in enumerate(doc["data"]["userAuth"]["reserve"]["libs"]):
+        if isinstance(lib, dict) and isinstance(lib.get("lib_layout"), dict):
+            lib = dict(lib, lib_layout=dict(lib["lib_layout"]))
+            seats = lib["lib_layout"].pop("seats")
+            if with_seats: events += [("seat", index, seat) for seat in seats]
+        events.append(("lib", index, lib))
+    return events
+
+
+def events(text, chunk_size, with_seats=True):
+    return list(libs_stream.iter_lib_events(io.StringIO(text), with_seats=with_seats, chunk_size=chunk_size))
+
+
+@pytest.mark.parametrize("with_seats", [True, False])
+def test_matches_json_for_every_small_chunk_size(with_seats):
+    for text in (json.dumps(TRICKY), json.dumps(TRICKY, ensure_ascii=False, indent=1)):
+        expected = expected_events(TRICKY, with_seats)
+        for chunk_size in range(1, 65):
+            assert events(text, chunk_size, with_seats) == expected, chunk_size
+
+
+def test_numbers_split_across_chunks():
+    text = '{"data": {"userAuth": {"reserve": {"libs": [-2500.5, 123456789, 1e-7, true]}}}}'
+    for chunk_size in range(1, 12):
+        assert [lib for _, _, lib in events(text, chunk_size)] == [-2500.5, 123456789, 1e-7, True]
+
+
+def test_sample_dump_matches_json():
+    with open(os.path.join(ROOT, "data_process", "seat", "seat_data_array.json"), encoding="utf-8") as fp:
+        text = fp.read()
+    expected = expected_events(json.loads(text))
+    for chunk_size in (1, 7, 64, libs_stream.DEFAULT_CHUNK_SIZE):
+        assert events(text, chunk_size) == expected
+
+
+@pytest.mark.parametrize("text", [
+    '{"data": {"userAuth": {"reserve": {}}}}',
+    '{"data": {"userAuth": "[\\"reserve\\"]"}}',
+    '{"data": null, "libs": []}',
+])
+def test_missing_libs_path(text):
+    with pytest.raises(ValueError, match="未找到"):
+        events(text, 3)
+
+
+@pytest.mark.parametrize("text, message", [
+    ('{"data": {"userAuth": {"reserve": {"libs": []}}}} garbage', "多余内容"),
+    ('{"data": {"userAuth": {"reserve": {"libs": []}}}}}', "多余内容"),
+    ('{"data": {"userAuth": {"reserve": {"libs": {}}}}}', "不是列表"),
+    ('{"data": {"skipped": ["unterminated ]}', "不完整"),
+    ('[]', "顶层结构"),
+])
+def test_malformed_input(text, message):
+    for chunk_size in (1, 4, 64):
+        with pytest.raises(ValueError, match=message):
+            events(text, chunk_size)
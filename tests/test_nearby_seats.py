@@ -0,0 +1,41 @@
+import pytest
+
+import beta
+
+
+class FakeAvailability:
+    def __init__(self, live_seats, taken):
+        self.live_seats, self.taken = live_seats, frozenset(taken)
+
+    def room(self, lib_id, cookie=None):
+        return {"_index": beta.SeatGridIndex(self.live_seats), "_taken": self.taken}
+
+
+class BrokenAvailability:
+    def room(self, lib_id, cookie=None):
+        raise RuntimeError("offline")
+
+
+STATIC_SEATS = [("1", "0,0", 0, 0), ("2", "1,0", 1, 0), ("3", "2,0", 2, 0), ("4", "3,0", 3, 0)]
+
+
+@pytest.fixture
+def static_index(monkeypatch):
+    monkeypatch.setattr(beta, "get_seat_index", lambda room_name, mappings=None: beta.SeatGridIndex(STATIC_SEATS))
+
+
+def test_anchor_missing_from_live_layout_keeps_live_occupancy(monkeypatch, static_index):
+    monkeypatch.setattr(beta, "get_availability_service", lambda: FakeAvailability(STATIC_SEATS[1:], taken={"1,0"}))
+    nearby = beta.find_nearby_seats(2, "1", 2)
+    assert [key for _, key, _, _, _ in nearby] == ["2,0", "3,0"]
+
+
+def test_without_live_data_returns_nearest_seats(monkeypatch, static_index):
+    monkeypatch.setattr(beta, "get_availability_service", lambda: BrokenAvailability())
+    nearby = beta.find_nearby_seats(2, "1", 2)
+    assert [key for _, key, _, _, _ in nearby] == ["1,0", "2,0"]
+
+
+def test_expand_seat_targets_skips_taken_seats(monkeypatch, static_index):
+    monkeypatch.setattr(beta, "get_availability_service", lambda: FakeAvailability([], taken={"1,0", "2,0"}))
+    assert beta.expand_seat_targets(2, [("1", "0,0")], 1, None) == [("1", "0,0"), ("4", "3,0")]
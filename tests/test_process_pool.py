@@ -0,0 +1,78 @@
+import queue
+import threading
+
+import beta
+
+
+class FakeOutcomeStore:
+    def __init__(self):
+        self.records = []
+
+    def record(self, job, attempt, message=""):
+        self.records.append((job.job_id, attempt, message))
+
+
+class FakeLearner:
+    def __init__(self):
+        self.layouts = []
+
+    def observe(self, lib_id, layout):
+        self.layouts.append((lib_id, layout))
+
+
+def job_spec(job_id="job1", lib_id=1):
+    return {"job_id": job_id, "name": "seat", "mode": 2, "cookie": "Authorization=test", "lib_id": lib_id,
+            "seat_targets": [("5", "3,4")], "fire_at": None, "deadline": None, "fire_lead_ms": 0, "fire_decision": None,
+            "profiling": False, "recording": False}
+
+
+def test_worker_loads_mappings_and_forwards_results(monkeypatch):
+    # 在本进程中运行工作进程入口，结束后由 monkeypatch 恢复被替换的全局对象
+    monkeypatch.setattr(beta, "_outcome_store", None)
+    monkeypatch.setattr(beta, "seat_map_learner", beta.seat_map_learner)
+    monkeypatch.setattr(beta, "LEARN_SEAT_MAPS", True)
+    monkeypatch.setattr(beta, "get_http_session", lambda: None)
+    room_names = []
+
+    def fake_run(job):
+        room_names.append(job.mappings.room_name(job.lib_id))
+        beta.seat_map_learner.observe(job.lib_id, "layout")
+        beta.get_outcome_store().record(job, {"seat": "5", "key": "3,4", "result": "成功"}, "")
+        return "成功"
+    monkeypatch.setattr(beta, "run_seat_job", fake_run)
+
+    monkeypatch.setattr(beta, "MAPPING_REGISTRY", beta.MappingRegistry()) # 与新启动的工作进程一样，尚未加载映射
+    assert not beta.current_mappings().rooms
+    lib_id = 525
+    task_queue, event_queue = queue.Queue(), queue.Queue()
+    task_queue.put(("run", job_spec(lib_id=lib_id)))
+    worker = threading.Thread(target=beta._job_worker_main, args=(0, task_queue, event_queue, 1))
+    worker.start()
+    messages = [event_queue.get(timeout=5) for _ in range(3)]
+    task_queue.put(None); worker.join(timeout=5)
+
+    assert room_names == [beta.current_mappings().rooms[str(lib_id)]]
+    assert ("layout", lib_id, "layout") in messages
+    assert ("outcome", "job1", {"seat": "5", "key": "3,4", "result": "成功"}, "") in messages
+    assert messages[-1][:3] == ("done", "job1", "成功")
+
+
+def test_parent_writes_forwarded_results(monkeypatch):
+    store, learner = FakeOutcomeStore(), FakeLearner()
+    monkeypatch.setattr(beta, "get_outcome_store", lambda: store)
+    monkeypatch.setattr(beta, "seat_map_learner", learner)
+    pool = beta.ProcessJobPool.__new__(beta.ProcessJobPool) # 不启动工作进程，只测试主进程的事件处理
+    pool._lock, pool._event_queue = threading.Lock(), queue.Queue()
+    job = beta.SeatJob(2, "Authorization=test", 1, [("5", "3,4")], None, job_id="job1")
+    done, outcome = threading.Event(), []
+    pool._pending = {"job1": (job, done, outcome)}
+    attempt = {"seat": "5", "key": "3,4", "result": "成功"}
+    for message in [("layout", 1, "layout"), ("status", "job1", "排队中"), ("outcome", "job1", attempt, ""),
+                    ("done", "job1", "成功", [attempt], None), None]:
+        pool._event_queue.put(message)
+    pool._listen_loop()
+
+    assert learner.layouts == [(1, "layout")]
+    assert store.records == [("job1", attempt, "")]
+    assert done.is_set() and outcome == ["成功", [attempt], None]
+    assert job.events.since(0)[0][-1]["message"] == "排队中"
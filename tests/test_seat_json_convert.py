@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_does_not_touch_sys_path_or_duplicate_modules():
+    code = ("import sys; before = list(sys.path)\n"
+            "from data_process.seat import seat_json_convert\n"
+            "from data_process import mapping_bundle\n"
+            "assert sys.path == before\n"
+            "assert seat_json_convert.mapping_bundle is mapping_bundle\n"
+            "assert 'mapping_bundle' not in sys.modules and 'libs_stream' not in sys.modules\n")
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+
+
+def test_runs_as_a_script(tmp_path):
+    script = os.path.join(ROOT, "data_process", "seat", "seat_json_convert.py")
+    result = subprocess.run([sys.executable, script, "--help"], cwd=str(tmp_path), capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr